@@ -0,0 +1,86 @@
+"""
+This Source Code Form is subject to the terms of the Mozilla Public
+License, v. 2.0. If a copy of the MPL was not distributed with this
+file, You can obtain one at http://mozilla.org/MPL/2.0/
+"""
+
+# Compares compression ratio and throughput of the model transfer codecs on the
+# MNIST and chest x-ray CNN weights (or on any .eflw file written by a node).
+#
+#   python edgefl/benchmarks/compression_benchmark.py
+#   python edgefl/benchmarks/compression_benchmark.py --weights-file edgefl/file_write/node1/mnist/3-replica-node1.eflw
+#
+# Freshly initialized weights are close to random and compress worse than trained
+# ones, so prefer a real model file when one is available.
+
+import argparse
+import os
+import sys
+import time
+
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(PROJECT_ROOT)
+
+from platform_components.helpers.LoadClassFromFile import load_class_from_file
+from platform_components.lib.modules.compression import CODECS, is_codec_available
+from platform_components.lib.modules.weights_file_format import pack_weights, unpack_weights, load_weights
+
+DATA_HANDLERS_DIR = os.path.join(PROJECT_ROOT, "platform_components", "data_handlers")
+MODELS = {
+    "mnist": ("custom_data_handler.py", "MnistDataHandler"),
+    "chest_xrays_bbox": ("chest_xrays_bbox_data_handler.py", "ChestXraysBBoxDataHandler"),
+}
+
+
+def model_weights(model):
+    file_name, class_name = MODELS[model]
+    handler_class = load_class_from_file(os.path.join(DATA_HANDLERS_DIR, file_name), class_name)
+    # model_def only builds the Keras model, so skip __init__ (which needs EdgeLake and the data tables)
+    handler = handler_class.__new__(handler_class)
+    return handler.model_def().get_weights()
+
+
+def best_time(fn, repeat):
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn()
+        best = min(best, time.perf_counter() - start)
+    return best, result
+
+
+def benchmark(name, weights, repeat):
+    raw_size = sum(layer.nbytes for layer in weights)
+    print(f"\n{name}: {len(weights)} layers, {raw_size / 2**20:.2f} MiB")
+    print(f"{'codec':<8}{'shuffle':<9}{'size MiB':>10}{'ratio':>8}{'encode MiB/s':>14}{'decode MiB/s':>14}")
+    for codec in CODECS:
+        if not is_codec_available(codec):
+            print(f"{codec:<8}(not installed)")
+            continue
+        for shuffle in ((False,) if codec == "none" else (False, True)):
+            encode_time, encoded = best_time(lambda: pack_weights(weights, codec=codec, shuffle=shuffle), repeat)
+            decode_time, _ = best_time(lambda: unpack_weights(encoded), repeat)
+            print(f"{codec:<8}{str(shuffle):<9}{len(encoded) / 2**20:>10.2f}{raw_size / len(encoded):>8.2f}"
+                  f"{raw_size / 2**20 / encode_time:>14.1f}{raw_size / 2**20 / decode_time:>14.1f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark model transfer compression codecs.")
+    parser.add_argument('--models', nargs='+', choices=sorted(MODELS), default=sorted(MODELS),
+                        help="Data handler models whose initial weights are benchmarked")
+    parser.add_argument('--weights-file', action='append', default=[],
+                        help="Weights (.eflw) file to benchmark instead of freshly initialized models")
+    parser.add_argument('--repeat', type=int, default=3, help="Timing repetitions; the best run is reported")
+    args = parser.parse_args()
+
+    if args.weights_file:
+        for path in args.weights_file:
+            weights, _ = load_weights(path, mmap=False)
+            benchmark(os.path.basename(path), weights, args.repeat)
+    else:
+        for model in args.models:
+            benchmark(model, model_weights(model), args.repeat)
+
+
+if __name__ == '__main__':
+    main()
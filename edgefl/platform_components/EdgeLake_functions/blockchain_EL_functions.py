@@ -13,6 +13,8 @@ import json
 
 from requests import RequestException
 
+from platform_components.EdgeLake_functions import edgelake_client
+
 
 def insert_policy(el_url, policy):
     headers = {
@@ -21,7 +23,7 @@ def insert_policy(el_url, policy):
         'command': 'blockchain insert where policy = !my_policy and local = true and blockchain = master'
     }
 
-    response = requests.post(el_url, headers=headers, data=policy)
+    response = edgelake_client.post(el_url, headers=headers, data=policy)
     return response
 
 # TODO: fix proper blockchain update command
@@ -41,7 +43,7 @@ def delete_policy(el_url, policy_id):
         'command': f'blockchain delete policy where id = {policy_id} and local = true and blockchain = master'
     }
 
-    response = requests.post(el_url, headers=headers, data=None)
+    response = edgelake_client.post(el_url, headers=headers, data=None)
     return response
 
 def check_policy_inserted(el_url, policy):
@@ -57,7 +59,7 @@ def check_policy_inserted(el_url, policy):
             'command': 'blockchain prepare policy !my_policy'
         }
 
-        response = requests.post(el_url, headers=headers, data=policy)
+        response = edgelake_client.post(el_url, headers=headers, data=policy)
 
         headers = {
             'User-Agent': 'AnyLog/1.23',
@@ -67,7 +69,7 @@ def check_policy_inserted(el_url, policy):
         # print(f"check_policy_inserted: {response.status_code}")
         # print(response.status_code)
 
-        response = requests.get(el_url, headers=headers)
+        response = edgelake_client.get(el_url, headers=headers)
         retrieved_policy = json.loads(response.content.decode('utf-8'))
 
         if retrieved_policy:
@@ -82,7 +84,7 @@ def get_policies(el_url, policy_type='*', condition=None):
         'Content-Type': 'text/plain',
         'command': command
     }
-    response = requests.get(el_url, headers=headers)
+    response = edgelake_client.get(el_url, headers=headers)
     if response.status_code != 200:
         raise Exception(f"Request failed with status code {response.status_code}: {response.reason}. Command: {command}")
 
@@ -99,7 +101,7 @@ def get_policies(el_url, index='*', condition=None):
         'Content-Type': 'text/plain',
         'command': command
     }
-    response = requests.get(el_url, headers=headers)
+    response = edgelake_client.get(el_url, headers=headers)
     if response.status_code != 200:
         raise Exception(f"Request failed with status code {response.status_code}: {response.reason}. Command: {command}")
 
@@ -116,7 +118,7 @@ def get_policy_id_by_name(el_url, policy_name):
         'Content-Type': 'text/plain',
         'command': f'blockchain get {policy_name}'
     }
-    response = requests.get(el_url, headers=headers)
+    response = edgelake_client.get(el_url, headers=headers)
     data = response.json()
     if not data:
         return None
@@ -139,7 +141,7 @@ def get_all_databases(edgelake_node_url):
 
     try:
         # Send the POST request
-        response = requests.get(edgelake_node_url, headers=headers)
+        response = edgelake_client.get(edgelake_node_url, headers=headers)
 
         # Raise an HTTPError if the response code indicates failure
         response.raise_for_status()
@@ -180,7 +182,7 @@ def connect_to_db(edgelake_node_url, db_name, user, password, ip, port):
     }
     try:
         # Send the POST request
-        response = requests.post(edgelake_node_url, headers=headers)
+        response = edgelake_client.post(edgelake_node_url, headers=headers)
 
         # Raise an HTTPError if the response code indicates failure
         response.raise_for_status()
@@ -204,7 +206,7 @@ def get_all_databases(edgelake_node_url):
 
     try:
         # Send the POST request
-        response = requests.get(edgelake_node_url, headers=headers)
+        response = edgelake_client.get(edgelake_node_url, headers=headers)
 
         # Raise an HTTPError if the response code indicates failure
         response.raise_for_status()
@@ -245,7 +247,7 @@ def connect_to_db(edgelake_node_url, db_name, user, password, ip, port):
     }
     try:
         # Send the POST request
-        response = requests.post(edgelake_node_url, headers=headers)
+        response = edgelake_client.post(edgelake_node_url, headers=headers)
 
         # Raise an HTTPError if the response code indicates failure
         response.raise_for_status()
@@ -272,7 +274,7 @@ def fetch_data_from_db(edgelake_node_url, query, tcp_ip_port):
 
     try:
         # Send the GET request
-        response = requests.get(edgelake_node_url, headers=headers)
+        response = edgelake_client.get(edgelake_node_url, headers=headers)
 
         # Raise an HTTPError if the response code indicates failure
         response.raise_for_status()
@@ -0,0 +1,126 @@
+"""
+This Source Code Form is subject to the terms of the Mozilla Public
+License, v. 2.0. If a copy of the MPL was not distributed with this
+file, You can obtain one at http://mozilla.org/MPL/2.0/
+"""
+
+# Shared HTTP client for the EdgeLake REST API (and the node/aggregator servers).
+#
+# Every request goes through a connection-pooled, keep-alive session per host instead of
+# opening a new TCP connection per command, with default timeouts and retries:
+#   - requests that were never sent (connection errors) are retried for every method
+#   - GET requests are also retried on read timeouts and 502/503/504 responses
+# Retries back off exponentially with full jitter, so many nodes hitting one EdgeLake
+# node don't retry in lockstep.
+#
+# Environment:
+#   EDGELAKE_CONNECT_TIMEOUT  seconds to establish a connection (default 5)
+#   EDGELAKE_READ_TIMEOUT     seconds to wait for data on an open connection (default 300)
+#   EDGELAKE_MAX_RETRIES      retries after the first attempt (default 2)
+#   EDGELAKE_POOL_SIZE        connections kept open per host (default 16)
+
+import asyncio
+import os
+import random
+import threading
+import time
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+
+CONNECT_TIMEOUT = float(os.getenv("EDGELAKE_CONNECT_TIMEOUT", "5"))
+READ_TIMEOUT = float(os.getenv("EDGELAKE_READ_TIMEOUT", "300"))
+MAX_RETRIES = int(os.getenv("EDGELAKE_MAX_RETRIES", "2"))
+POOL_SIZE = int(os.getenv("EDGELAKE_POOL_SIZE", "16"))
+BACKOFF_BASE = 0.25 # seconds
+BACKOFF_MAX = 5 # seconds
+
+RETRY_STATUS_CODES = {502, 503, 504}
+
+_sessions = {}
+_sessions_lock = threading.Lock()
+
+
+def get_session(url):
+    """
+    Returns the pooled session for the host of `url`, creating it on first use.
+    """
+    parts = urlsplit(url)
+    key = f"{parts.scheme}://{parts.netloc}"
+    with _sessions_lock:
+        if key not in _sessions:
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=1, pool_maxsize=POOL_SIZE)
+            session.mount("http://", adapter)
+            session.mount("https://", adapter)
+            _sessions[key] = session
+        return _sessions[key]
+
+
+def backoff_delay(attempt):
+    """
+    Seconds to wait before retry number `attempt` (0-based): exponential with full jitter.
+    """
+    return random.uniform(0, min(BACKOFF_MAX, BACKOFF_BASE * 2 ** attempt))
+
+
+def request(method, url, timeout=None, retries=None, **kwargs):
+    """
+    Send a request through the pooled session of `url`'s host.
+
+    :param method: HTTP method, e.g. 'GET' or 'POST'.
+    :param timeout: Seconds, or a (connect, read) tuple; defaults to (CONNECT_TIMEOUT, READ_TIMEOUT).
+    :param retries: Retries after the first attempt; defaults to MAX_RETRIES.
+    :param kwargs: Passed to `requests.Session.request` (headers, data, json, stream, ...).
+    :return: The response of the last attempt.
+    :rtype: requests.Response
+    :raises requests.exceptions.RequestException: If the last attempt failed.
+    """
+    method = method.upper()
+    if timeout is None:
+        timeout = (CONNECT_TIMEOUT, READ_TIMEOUT)
+    if retries is None:
+        retries = MAX_RETRIES
+    idempotent = method in ("GET", "HEAD")
+    session = get_session(url)
+
+    for attempt in range(retries + 1):
+        last_attempt = attempt == retries
+        try:
+            response = session.request(method, url, timeout=timeout, **kwargs)
+        except requests.exceptions.ConnectionError:
+            # Includes connect timeouts and keep-alive connections the server already closed
+            if last_attempt:
+                raise
+        except requests.exceptions.Timeout:
+            if last_attempt or not idempotent:
+                raise
+        else:
+            if last_attempt or not idempotent or response.status_code not in RETRY_STATUS_CODES:
+                return response
+            response.close()
+        time.sleep(backoff_delay(attempt))
+
+
+def get(url, **kwargs):
+    return request("GET", url, **kwargs)
+
+
+def post(url, **kwargs):
+    return request("POST", url, **kwargs)
+
+
+async def async_request(method, url, **kwargs):
+    """
+    `request` for async code such as FastAPI handlers; runs on a worker thread so the event loop isn't blocked.
+    """
+    return await asyncio.to_thread(request, method, url, **kwargs)
+
+
+async def async_get(url, **kwargs):
+    return await async_request("GET", url, **kwargs)
+
+
+async def async_post(url, **kwargs):
+    return await async_request("POST", url, **kwargs)
@@ -5,16 +5,23 @@ file, You can obtain one at http://mozilla.org/MPL/2.0/
 """
 
 
+import codecs
 import os
+import threading
 import time
 import docker
 # Add files to MongoDB through EdgeLake
 
 import requests
 from requests_toolbelt.multipart.encoder import MultipartEncoder
+
+from platform_components.EdgeLake_functions import edgelake_client
 import sys
 import tarfile
 
+DOWNLOAD_CHUNK_SIZE = 1 << 20 # bytes read from the response at a time
+
+
 def write_file(edgelake_node_url, dbms, table, filename):
     lst = filename.split('/')
     # lst[-1] = f'{dbms}.{table}.{lst[-1]}'
@@ -27,9 +34,9 @@ def write_file(edgelake_node_url, dbms, table, filename):
         # 'command': f'file store where dbms = {dbms} and table = {table} and dest = {filename}'
     }
 
+    # Streamed from the open file rather than read into memory first; it can't be rewound, so don't retry
     with open(filename, 'rb') as f:
-        binary_data = f.read()
-        response = requests.post(edgelake_node_url, headers=headers, data=binary_data, verify=False)
+        response = edgelake_client.post(edgelake_node_url, headers=headers, data=f, verify=False, retries=0)
     return response
 
 
@@ -60,7 +67,7 @@ def create_directory_in_container(edgelake_url, container_name, directory_path):
     }
 
     try:
-        resp = requests.post(edgelake_url, data='', headers=headers)
+        resp = edgelake_client.post(edgelake_url, data='', headers=headers)
     except:
         errno, value = sys.exc_info()[:2]
         print(f'Error: {errno}: {value}')
@@ -92,7 +99,12 @@ def copy_file_to_container(tmp_dir, container_name, edgelake_url, src_path, dest
         }
 
         try:
-            resp = requests.post(edgelake_url, data=m, headers=headers)
+            # The multipart encoder streams the file in chunks and can't be rewound, so don't retry
+            resp = edgelake_client.post(edgelake_url, data=m, headers=headers, retries=0)
+            if resp.status_code != 200:
+                print(f"Status: {resp.status_code}")
+                print("Response:", resp.text)
+            return resp
         except:
             errno, value = sys.exc_info()[:2]
             print(f'Error: {errno}: {value}')
@@ -115,13 +127,32 @@ def copy_file_to_container(tmp_dir, container_name, edgelake_url, src_path, dest
     # ###########################################################################
 
 
-def copy_file_from_container(tmp_dir, container_name, edgelake_data_host_url, src_path, dest_path, ip_port_file_loc):
+def _stream_to_file(resp, dest_path):
+    # EdgeLake sends the file as text, each byte as the UTF-8 encoding of its Latin-1 character. Undo that one
+    # chunk at a time so memory stays bounded, and write next to dest_path so readers never see a partial file.
+    decoder = codecs.getincrementaldecoder("utf-8")()
+    # Per thread, since identical models from different nodes share a content-addressed dest_path
+    tmp_path = f"{dest_path}.{threading.get_ident()}.part"
+    try:
+        with open(tmp_path, "wb") as f:
+            for chunk in resp.iter_content(chunk_size=DOWNLOAD_CHUNK_SIZE):
+                if chunk:
+                    f.write(decoder.decode(chunk).encode("latin1"))
+            f.write(decoder.decode(b"", final=True).encode("latin1"))
+        os.replace(tmp_path, dest_path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+
+def copy_file_from_container(tmp_dir, container_name, edgelake_data_host_url, src_path, dest_path, ip_port_file_loc, timeout=None):
     """
     Copies a file from a container to the host machine.
 
     :param container_name: Name or ID of the container
     :param src_path: Path of the source file inside the container
     :param dest_path: Destination path on the host (directory or full path)
+    :param timeout: Seconds to wait for the connection and for each read (None uses the client's default)
     """
 
     headers = {
@@ -131,17 +162,11 @@ def copy_file_from_container(tmp_dir, container_name, edgelake_data_host_url, sr
 
     # Send the request
     try:
-        resp = requests.post(edgelake_data_host_url, headers=headers, stream=True)
-        raw = resp.content
-        cleaned = raw.decode("utf-8").encode("latin1")
+        resp = edgelake_client.post(edgelake_data_host_url, headers=headers, stream=True, timeout=timeout)
         # Save response content to a local file
         if resp.status_code == 200:
-            with open(dest_path, "wb") as f:
-                f.write(cleaned)
-                # for chunk in resp.iter_content(chunk_size=8192):
-                #     if chunk:
-                #         f.write(chunk)
-
+            with resp:
+                _stream_to_file(resp, dest_path)
         else:
             print(f"Status: {resp.status_code}")
             print("Response:", resp.text)
@@ -199,7 +224,7 @@ def copy_file_from_container(tmp_dir, container_name, edgelake_data_host_url, sr
     # ####### End Using Docker API ###########
 
 
-def read_file(edgelake_node_url, file_path, dest, ip_port):
+def read_file(edgelake_node_url, file_path, dest, ip_port, timeout=None):
     filename = file_path.split('/')[-1]
     headers = {
         'User-Agent': 'AnyLog/1.23',
@@ -211,7 +236,7 @@ def read_file(edgelake_node_url, file_path, dest, ip_port):
 
     # print(f"FILE GET COMMAND: headers: {headers['command']}")
     try:
-        response = requests.post(edgelake_node_url, headers=headers, data='')
+        response = edgelake_client.post(edgelake_node_url, headers=headers, data='', timeout=timeout)
         return response
     except:
         errno, value = sys.exc_info()[:2]
@@ -231,7 +256,7 @@ def read_file_mongo(edgelake_node_url, dbms, table, filename, dest, ip_port):
 
     print(f"FILE GET COMMAND: headers: {headers['command']}")
     try:
-        response = requests.post(edgelake_node_url, headers=headers, data='')
+        response = edgelake_client.post(edgelake_node_url, headers=headers, data='')
         return response
     except:
         errno, value = sys.exc_info()[:2]
@@ -245,7 +270,7 @@ if __name__ == '__main__':
 
     headers = {
         "User-Agent": "AnyLog/1.23",
-        "command": "file from /app/file_write/node2/fl7/1-replica-node2.pkl"
+        "command": "file from /app/file_write/node2/fl7/1-replica-node2.eflw"
     }
 
     resp = requests.post(url, headers=headers, stream=True)
@@ -0,0 +1,191 @@
+"""
+This Source Code Form is subject to the terms of the Mozilla Public
+License, v. 2.0. If a copy of the MPL was not distributed with this
+file, You can obtain one at http://mozilla.org/MPL/2.0/
+"""
+
+# Typed EdgeLake policies of EdgeFL: the index's init policy, the aggregator's RoundStart
+# policies and the nodes' submodel policies.
+#
+# Policies are validated when they are built or parsed and serialized once with json.dumps,
+# so values with quotes or backslashes (e.g. paths) can't break the policy text, and retries
+# send the cached bytes. Records parsed from the blockchain keep every attribute, including
+# EdgeLake's own (id, date, ledger) and attributes newer versions add, and can be read like
+# the dicts they replace: policy['round_number'], policy.get('checksum', '').
+
+import hashlib
+import json
+
+from platform_components.lib.modules.exceptions import PolicyError
+
+REQUIRED = object() # default of attributes every policy must have
+
+
+def _to_bool(value):
+    if isinstance(value, str):
+        if value.lower() not in ('true', 'false'):
+            raise ValueError(f"not a boolean: {value!r}")
+        return value.lower() == 'true'
+    return bool(value)
+
+
+def _to_int(value):
+    if isinstance(value, bool) or (isinstance(value, float) and not value.is_integer()):
+        raise ValueError(f"not an integer: {value!r}")
+    return int(value)
+
+
+COERCE = {str: str, int: _to_int, float: float, bool: _to_bool}
+
+
+class Policy:
+    """
+    Base of the typed policies; subclasses declare their POLICY_TYPE and FIELDS.
+    """
+    POLICY_TYPE = None
+    FIELDS = {} # {attribute: (type, default)}
+
+    def __init__(self, index, /, **attributes):
+        """
+        :param index: Index the policy belongs to, its top-level name on the blockchain.
+        :param attributes: Values of FIELDS; attributes not in FIELDS are kept as they are.
+        :raises PolicyError: If a required attribute is missing or a value has the wrong type.
+        """
+        if not index:
+            raise PolicyError(f"{self.POLICY_TYPE} policy without an index")
+        self.index = str(index)
+        self._values = {}
+        for name, (kind, default) in self.FIELDS.items():
+            value = attributes.pop(name, default)
+            if value is REQUIRED or value is None:
+                raise PolicyError(f"{self.POLICY_TYPE} policy of index {index} is missing '{name}'")
+            try:
+                self._values[name] = COERCE[kind](value)
+            except (TypeError, ValueError) as e:
+                raise PolicyError(f"{self.POLICY_TYPE} policy of index {index}: invalid '{name}': {str(e)}")
+        if self._values.get('round_number', 1) < 1:
+            raise PolicyError(f"{self.POLICY_TYPE} policy of index {index}: round_number must be positive")
+        self._values['policy_type'] = self.POLICY_TYPE
+        self._extra = attributes # e.g. id, date and ledger of policies read from the blockchain
+        self._key = None
+        self._encoded = None
+
+    @classmethod
+    def parse(cls, index, policy):
+        """
+        Typed record of a policy dict read from the blockchain.
+
+        :raises PolicyError: If the policy is malformed.
+        """
+        attributes = dict(policy)
+        policy_type = attributes.pop('policy_type', cls.POLICY_TYPE)
+        if cls.POLICY_TYPE is not None and policy_type != cls.POLICY_TYPE:
+            raise PolicyError(f"Expected a {cls.POLICY_TYPE} policy of index {index}, got {policy_type}")
+        record_cls = cls if cls.POLICY_TYPE is not None else POLICY_TYPES.get(policy_type)
+        if record_cls is None:
+            raise PolicyError(f"Unknown policy type {policy_type} of index {index}")
+        return record_cls(index, **attributes)
+
+    def __getattr__(self, name):
+        values = self.__dict__.get('_values', {})
+        if name in values:
+            return values[name]
+        raise AttributeError(name)
+
+    def __getitem__(self, name):
+        if name in self._values:
+            return self._values[name]
+        return self._extra[name]
+
+    def __contains__(self, name):
+        return name in self._values or name in self._extra
+
+    def get(self, name, default=None):
+        if name in self._values:
+            return self._values[name]
+        return self._extra.get(name, default)
+
+    def __repr__(self):
+        return f"{type(self).__name__}({self.index!r}, {self.to_dict()!r})"
+
+    def to_dict(self):
+        return {**self._extra, **self._values}
+
+    @property
+    def key(self):
+        """Deterministic key of the policy: the same index and attributes always give the same key."""
+        if self._key is None:
+            canonical = json.dumps({self.index: self._values}, sort_keys=True, separators=(',', ':'))
+            self._key = hashlib.sha256(canonical.encode('utf-8')).hexdigest()[:32]
+        return self._key
+
+    def encode(self):
+        """
+        The `<my_policy = {...}>` text to insert, as bytes; built once, then reused by every retry.
+        """
+        if self._encoded is None:
+            body = {**self._values, 'policy_key': self.key}
+            self._encoded = f"<my_policy = {json.dumps({self.index: body})}>".encode('utf-8')
+        return self._encoded
+
+
+class InitPolicy(Policy):
+    POLICY_TYPE = 'init'
+    FIELDS = {
+        'name': (str, REQUIRED),
+        'module_name': (str, REQUIRED),
+        'module_path': (str, REQUIRED),
+        'ip_port': (str, ''),
+        'rest_ip_port': (str, ''),
+        'db_name': (str, ''),
+        'codec': (str, 'none'),
+        'byte_shuffle': (bool, False),
+        'update_encoding': (str, 'full'),
+        'topk_ratio': (float, 0.01),
+        'quantization': (str, 'none'),
+        'round_mode': (str, 'sync'),
+    }
+
+
+class RoundStartPolicy(Policy):
+    POLICY_TYPE = 'RoundStart'
+    FIELDS = {
+        'index': (str, REQUIRED),
+        'node_type': (str, 'aggregator'),
+        'round_number': (int, REQUIRED),
+        'initParams': (str, ''), # link of the model the round starts from; '' for the first round
+        'content_length': (int, 0), # 0 and '' (older aggregators) skip the check of the download
+        'checksum': (str, ''),
+        'node_id': (str, ''),
+        'ip_port': (str, ''),
+        'rest_ip_port': (str, ''),
+    }
+
+
+class SubmodelPolicy(Policy):
+    POLICY_TYPE = 'submodel'
+    FIELDS = {
+        'node': (str, REQUIRED),
+        'round_number': (int, REQUIRED),
+        'index': (str, REQUIRED),
+        'node_type': (str, 'training'),
+        'ip_port': (str, ''),
+        'rest_ip_port': (str, ''),
+        'trained_params_local_path': (str, REQUIRED),
+        'num_samples': (int, 0),
+        'content_length': (int, 0),
+        'checksum': (str, ''),
+        'parent': (str, ''), # aggregator that fuses the submodel; '' for nodes that predate the field
+    }
+
+
+POLICY_TYPES = {cls.POLICY_TYPE: cls for cls in (InitPolicy, RoundStartPolicy, SubmodelPolicy)}
+
+
+def parse_policy(index, policy):
+    """
+    Typed record of any EdgeFL policy dict, chosen by its policy_type.
+
+    :raises PolicyError: If the policy is malformed or of an unknown type.
+    """
+    return Policy.parse(index, policy)
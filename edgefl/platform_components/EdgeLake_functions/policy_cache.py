@@ -0,0 +1,130 @@
+"""
+This Source Code Form is subject to the terms of the Mozilla Public
+License, v. 2.0. If a copy of the MPL was not distributed with this
+file, You can obtain one at http://mozilla.org/MPL/2.0/
+"""
+
+import os
+import threading
+
+from platform_components.EdgeLake_functions.blockchain_EL_functions import get_policies
+from platform_components.EdgeLake_functions.policies import parse_policy
+from platform_components.lib.modules.exceptions import PolicyError
+
+
+class PolicyCache:
+    """
+    Local cache of the round policies (RoundStart and submodel) of an EdgeLake node.
+
+    Policies are indexed by index, node_type and round_number. Rounds only move forward,
+    so each query asks EdgeLake for policies from a watermark round on instead of the
+    whole history, and policies already seen (by id) are not parsed again. Policies are
+    cached as typed records (see policies.py); malformed ones are skipped, not raised,
+    so one bad policy on the blockchain can't stall a round. Lookups of a round or of
+    the latest round are dict accesses.
+
+    Only the last `keep_rounds` rounds (default MAX_STALENESS + 2, enough for late
+    submodels) are kept: when a newer round shows up, older rounds and their ids are
+    dropped, so a long-running training doesn't grow the cache without bound. A dropped
+    round is fetched from EdgeLake again if it is asked for.
+    """
+    def __init__(self, edgelake_node_url, logger=None, keep_rounds=None):
+        self.edgelake_node_url = edgelake_node_url
+        self.logger = logger
+        keep_rounds = keep_rounds if keep_rounds is not None else int(os.getenv("MAX_STALENESS", "1")) + 2
+        self.keep_rounds = max(1, int(keep_rounds))
+        self._lock = threading.Lock()
+        self._seen_ids = {} # {(index, node_type): {policy_id: round_number}}
+        self._rounds = {} # {(index, node_type): {round_number: [record, ...]}}
+        self._latest = {} # {(index, node_type): highest round_number seen}
+
+    def refresh(self, index, node_type, from_round):
+        """
+        Fetch the policies of `index` and `node_type` from round `from_round` on.
+
+        :return: Number of policies that were not cached yet.
+        :rtype: int
+        """
+        condition = f"where node_type = {node_type} and round_number >= {from_round}"
+        policies = get_policies(self.edgelake_node_url, index, condition)
+        with self._lock:
+            return sum(self._add(index, node_type, policy) for policy in policies)
+
+    def _add(self, index, node_type, policy):
+        key = (index, node_type)
+        seen_ids = self._seen_ids.setdefault(key, {})
+        policy_id = policy.get('id')
+        if policy_id is not None and policy_id in seen_ids:
+            return False
+        try:
+            record = parse_policy(index, policy)
+        except PolicyError as e:
+            if policy_id is not None:
+                # Don't parse (and warn about) it again while its round is cached
+                round_number = policy.get('round_number')
+                seen_ids[policy_id] = round_number if isinstance(round_number, int) else self._latest.get(key, 0)
+            if self.logger:
+                self.logger.warning(f"[{index}] Skipping malformed policy {policy_id}: {str(e)}")
+            return False
+        policy_id = policy_id or record.key
+        if policy_id in seen_ids:
+            return False
+
+        round_number = record.round_number
+        seen_ids[policy_id] = round_number
+        self._rounds.setdefault(key, {}).setdefault(round_number, []).append(record)
+        if round_number > self._latest.get(key, 0):
+            self._latest[key] = round_number
+            self._prune(key)
+        return True
+
+    def _prune(self, key):
+        # Drop the rounds (and their ids) that fell out of the window below the latest round
+        oldest = self._latest[key] - self.keep_rounds + 1
+        rounds = self._rounds[key]
+        for round_number in [r for r in rounds if r < oldest]:
+            del rounds[round_number]
+        seen_ids = self._seen_ids[key]
+        for policy_id in [i for i, r in seen_ids.items() if r < oldest]:
+            del seen_ids[policy_id]
+
+    def get_round(self, index, node_type, round_number, refresh=True):
+        """
+        Policies of `node_type` for one round of `index`.
+
+        :param refresh: Ask EdgeLake for policies of this round (and later) first.
+        :return: List of policies, possibly empty.
+        """
+        if refresh:
+            self.refresh(index, node_type, round_number)
+        with self._lock:
+            return list(self._rounds.get((index, node_type), {}).get(round_number, []))
+
+    def get_submodels(self, index, round_number):
+        """Submodel policies the training nodes published for the round so far."""
+        return self.get_round(index, 'training', round_number)
+
+    def get_round_start(self, index, round_number):
+        """
+        The aggregator's RoundStart policy for the round, or None if it is not inserted yet.
+
+        There is one per round, so EdgeLake is only queried until it has been seen.
+        """
+        policies = self.get_round(index, 'aggregator', round_number, refresh=False)
+        if not policies:
+            policies = self.get_round(index, 'aggregator', round_number)
+        return policies[0] if policies else None
+
+    def get_latest_round_start(self, index, refresh=True):
+        """
+        RoundStart policy of the highest round of `index`, or None if training never started.
+        """
+        key = (index, 'aggregator')
+        if refresh:
+            with self._lock:
+                watermark = self._latest.get(key, 0) + 1
+            self.refresh(index, 'aggregator', watermark)
+        with self._lock:
+            if key not in self._latest:
+                return None
+            return self._rounds[key][self._latest[key]][0]
@@ -0,0 +1,144 @@
+"""
+This Source Code Form is subject to the terms of the Mozilla Public
+License, v. 2.0. If a copy of the MPL was not distributed with this
+file, You can obtain one at http://mozilla.org/MPL/2.0/
+"""
+
+import threading
+import time
+
+import requests
+
+from platform_components.EdgeLake_functions import edgelake_client
+from platform_components.EdgeLake_functions.blockchain_EL_functions import insert_policy
+
+MAX_CONFIRMED_KEYS = 4096 # keys of confirmed policies remembered to skip writing them again
+
+
+class PolicyWriter:
+    """
+    Writes the policies of one node or aggregator to the blockchain through its EdgeLake node.
+
+    Every policy carries a `policy_key` derived from its contents, which makes writes idempotent:
+    a policy whose key is found on the blockchain is never inserted again. Policies written
+    concurrently (e.g. the RoundStart policies of several indexes) are inserted by one writer
+    thread, one insert per policy, and all inserts that did not clearly succeed are confirmed
+    together with a single lookup per index; only policies that lookup doesn't find are inserted
+    again, after a backoff.
+    """
+    def __init__(self, edgelake_node_url, logger=None):
+        self.edgelake_node_url = edgelake_node_url
+        self.logger = logger
+        self._condition = threading.Condition()
+        self._pending = [] # [(index, key, encoded policy)], in order of submission
+        self._confirmed = {} # {key: True}, insertion ordered so the oldest keys are dropped first
+        self._errors = {} # {key: message of the last failed attempt}
+        self._thread = None
+
+    def write(self, policy, timeout=None):
+        """
+        Write a policy and wait until it is on the blockchain.
+
+        :param policy: A typed Policy (InitPolicy, RoundStartPolicy, SubmodelPolicy); its `key` is written with it.
+        :param timeout: Seconds to wait at most (None waits until it is confirmed).
+        :return: The policy's key.
+        :rtype: str
+        :raises TimeoutError: If the policy was not confirmed within `timeout`; it is still written later.
+        """
+        index, key, text = policy.index, policy.key, policy.encode()
+
+        with self._condition:
+            if key in self._confirmed:
+                return key
+            if all(pending_key != key for _, pending_key, _ in self._pending):
+                self._pending.append((index, key, text))
+            self._start()
+            self._condition.notify_all()
+            if not self._condition.wait_for(lambda: key in self._confirmed, timeout):
+                raise TimeoutError(f"[{index}] Policy {key} not confirmed after {timeout}s: "
+                                   f"{self._errors.get(key, 'no response')}")
+        return key
+
+    def _start(self):
+        if self._thread is None or not self._thread.is_alive():
+            self._thread = threading.Thread(name="policy-writer", target=self._run, daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        attempt = 0
+        while True:
+            with self._condition:
+                self._condition.wait_for(lambda: self._pending)
+                batch = list(self._pending)
+
+            try:
+                unconfirmed = [item for item in batch if not self._insert(*item)]
+                if unconfirmed:
+                    found = self._lookup(unconfirmed)
+                    unconfirmed = [item for item in unconfirmed if item[1] not in found]
+            except Exception as e:
+                # The thread must survive anything: writers wait for it to confirm their policies
+                for _, key, _ in batch:
+                    self._errors[key] = str(e)
+                if self.logger:
+                    self.logger.error(f"Policy writer failed on a batch of {len(batch)} policies, retrying: {str(e)}")
+                unconfirmed = batch
+
+            with self._condition:
+                done = {key for _, key, _ in batch} - {key for _, key, _ in unconfirmed}
+                for key in done:
+                    self._confirm(key)
+                self._pending = [item for item in self._pending if item[1] not in done]
+                self._condition.notify_all()
+
+            if unconfirmed:
+                # Only the policies that are neither inserted nor found are retried, together
+                time.sleep(edgelake_client.backoff_delay(attempt))
+                attempt += 1
+            else:
+                attempt = 0
+
+    def _insert(self, index, key, text):
+        try:
+            response = insert_policy(self.edgelake_node_url, text)
+            if response.status_code == 200:
+                return True
+            self._errors[key] = f"HTTP {response.status_code}: {response.text}"
+        except requests.exceptions.RequestException as e:
+            self._errors[key] = str(e)
+        if self.logger:
+            self.logger.debug(f"[{index}] Insert of policy {key} failed, confirming: {self._errors[key]}")
+        return False
+
+    def _lookup(self, items):
+        """
+        Keys among `items` whose policy is on the blockchain, with one lookup per index.
+        """
+        found = set()
+        keys_by_index = {}
+        for index, key, _ in items:
+            keys_by_index.setdefault(index, []).append(key)
+        for index, keys in keys_by_index.items():
+            condition = " or ".join(f"policy_key = {key}" for key in keys)
+            headers = {
+                'User-Agent': 'AnyLog/1.23',
+                'Content-Type': 'text/plain',
+                'command': f'blockchain get {index} where {condition}'
+            }
+            try:
+                response = edgelake_client.get(self.edgelake_node_url, headers=headers)
+                if response.status_code != 200:
+                    continue
+                for policy in response.json() or []:
+                    if isinstance(policy, dict) and isinstance(policy.get(index), dict):
+                        found.add(policy[index].get('policy_key'))
+            except (requests.exceptions.RequestException, ValueError) as e:
+                if self.logger:
+                    self.logger.debug(f"[{index}] Unable to confirm policies: {str(e)}")
+        return found
+
+    def _confirm(self, key):
+        self._errors.pop(key, None)
+        self._confirmed[key] = True
+        while len(self._confirmed) > MAX_CONFIRMED_KEYS:
+            del self._confirmed[next(iter(self._confirmed))]
@@ -5,25 +5,38 @@ file, You can obtain one at http://mozilla.org/MPL/2.0/
 """
 
 import os
-from asyncio import sleep
+import time
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor, as_completed
 
 # import numpy as np
-import pickle
 from threading import Lock
 from dotenv import load_dotenv
 
 from platform_components.EdgeLake_functions.mongo_file_store import copy_file_to_container, create_directory_in_container
-from platform_components.EdgeLake_functions.blockchain_EL_functions import insert_policy, \
-    check_policy_inserted, delete_policy, get_policy_id_by_name, get_policies
+from platform_components.EdgeLake_functions.blockchain_EL_functions import delete_policy, get_policy_id_by_name, \
+    get_policies
+from platform_components.EdgeLake_functions.policies import InitPolicy, RoundStartPolicy, SubmodelPolicy
+from platform_components.EdgeLake_functions.policy_writer import PolicyWriter
 from platform_components.EdgeLake_functions.mongo_file_store import read_file, write_file, copy_file_from_container
+from platform_components.EdgeLake_functions.policy_cache import PolicyCache
+from platform_components.EdgeLake_functions.edgelake_client import backoff_delay
 
 from platform_components.lib.modules.local_model_update import LocalModelUpdate
+from platform_components.lib.modules.weights_file_format import check_weights_file
+from platform_components.lib.modules.model_store import ModelStore
+from platform_components.lib.modules.compute_executor import ComputeExecutor
+from platform_components.lib.modules.inference_dispatcher import InferenceDispatcher
+from platform_components.lib.modules.compression import get_codec
+from platform_components.lib.modules.update_encoding import UpdateEncoder, decode_update
 
 from platform_components.helpers.LoadClassFromFile import load_class_from_file
 
 
 load_dotenv()
 
+ROUND_MODES = ('sync', 'semi-sync', 'async')
+
 
 class Aggregator:
     def __init__(self, ip, port, logger):
@@ -34,6 +47,10 @@ class Aggregator:
         self.training_app_dir = os.getenv('TRAINING_APPLICATION_DIR')
 
         self.agg_name = os.getenv("AGG_NAME")
+        self.policy_cache = PolicyCache(self.edgelake_node_url, logger) # RoundStart and submodel policies seen so far
+        self.policy_writer = PolicyWriter(self.edgelake_node_url, logger) # idempotent, batch-confirmed policy inserts
+        self.compute = ComputeExecutor(logger) # runs all model work (fusing, model updates, inference)
+        self.inference_dispatcher = InferenceDispatcher(logger, executor=self.compute) # batches concurrent direct-inference requests
 
         self.server_ip = ip
         self.server_port = port
@@ -55,6 +72,11 @@ class Aggregator:
         self.databases = {}
 
         self.end_round = {}
+        self.global_weights = {} # most recently aggregated weights at each index
+        self.global_rounds = {} # round that produced global_weights at each index
+        self.codecs = {} # (codec, byte_shuffle) used for model files at each index, as recorded in its init policy
+        self.model_files = {} # {aggregated model link: (content_length, checksum)}, announced in RoundStart policies
+        self.model_stores = {} # ModelStore of the model files at each index
         # self.fetch_indexes_and_modules()
 
         self.file_write_destination = os.path.join(self.github_dir, os.getenv("FILE_WRITE_DESTINATION"), self.agg_name)
@@ -63,6 +85,31 @@ class Aggregator:
         self.docker_file_write_destination = None
         # =====
 
+        # Node submodels are downloaded and decoded concurrently, so a round waits for the slowest node only
+        self.fetch_timeout = float(os.getenv("FETCH_TIMEOUT", "60")) # seconds, per transfer attempt
+        self.fetch_retries = int(os.getenv("FETCH_RETRIES", "3"))
+        # Seconds to wait for a policy to be confirmed, as long as a transfer with all its retries
+        self.policy_write_timeout = self.fetch_timeout * (self.fetch_retries + 1)
+        self.fetch_executor = ThreadPoolExecutor(max_workers=int(os.getenv("FETCH_WORKERS", "8")),
+                                                 thread_name_prefix="agg/fetch")
+
+        # sync rounds wait for minParams submodels; semi-sync rounds also close at a deadline, and submodels
+        # that arrive after their round closed are folded into a later round with a staleness-discounted weight;
+        # async rounds fuse any minParams buffered submodels of recent rounds and mix them into the global model
+        self.round_mode = os.getenv("ROUND_MODE", "sync").lower()
+        if self.round_mode not in ROUND_MODES:
+            raise ValueError(f"Unknown ROUND_MODE '{self.round_mode}'. Supported modes: {', '.join(ROUND_MODES)}")
+        self.round_deadline = float(os.getenv("ROUND_DEADLINE", "60")) # seconds after the round started
+        self.max_staleness = int(os.getenv("MAX_STALENESS", "1")) # rounds a late submodel may lag behind
+        self.staleness_exponent = float(os.getenv("STALENESS_EXPONENT", "0.5"))
+        self.async_mixing = float(os.getenv("ASYNC_MIXING", "0.6")) # share of the buffered submodels in each new model
+        self.fused_links = {} # {index: {round_number: submodel links fused into some round}}, for late submodels
+
+        # Regional tier: fuse the submodels of this aggregator's own nodes and publish them as one submodel to the
+        # parent aggregator, following its rounds instead of starting them
+        self.parent_url = os.getenv("PARENT_AGGREGATOR_URL", "")
+        self.parent_names = {} # name of the parent aggregator at each index, from its RoundStart policies
+
         if os.getenv("EDGELAKE_DOCKER_RUNNING").lower() == "false":
             self.docker_running = False
         else:
@@ -75,6 +122,8 @@ class Aggregator:
             os.makedirs(os.path.dirname(
                 f"{self.file_write_destination}/{index}/"),
                 exist_ok=True)
+        if index not in self.model_stores:
+            self.model_stores[index] = ModelStore.from_env(os.path.join(self.file_write_destination, index), self.logger)
 
         if not os.path.exists(os.path.join(self.tmp_dir, index)):
             os.makedirs(os.path.join(self.tmp_dir, index), exist_ok=True)
@@ -87,45 +136,48 @@ class Aggregator:
             #                               f"{self.docker_file_write_destination}/aggregator/")
 
 
-    def initialize_index_on_blockchain(self, index, module_name, module_path, db_name):
-        if self.get_index_data_in_blockchain(index):
+    def initialize_index_on_blockchain(self, index, module_name, module_path, db_name, codec='none', byte_shuffle=False,
+                                       update_encoding='full', topk_ratio=0.01, quantization='none', round_mode='sync'):
+        index_data = self.get_index_data_in_blockchain(index)
+        if index_data:
+            # e.g. a regional aggregator joining an index its parent initialized; its files use the index's codec
+            self.codecs[index] = (index_data.get('codec', 'none'),
+                                  str(index_data.get('byte_shuffle', 'false')).lower() == 'true')
             return {
                 'status': 'error',
                 'message': 'index already initialized on the blockchain'
             }
 
         try:
-            data = f'''<my_policy = {{"{index}" : {{
-                                        "policy_type": "init",
-                                        "name": "{index}",
-                                        "module_name": "{module_name}",
-                                        "module_path": "{module_path}",
-                                        "ip_port": "{self.edgelake_tcp_node_ip_port}",
-                                        "rest_ip_port": "{self.edgelake_node_url}",
-                                        "db_name": "{db_name}"
-            }} }}>'''
-            success = False
-            while not success:
-                response = insert_policy(self.edgelake_node_url, data)
-                if response.status_code == 200:
-                    success = True
-                else:
-                    # sleep(np.random.randint(2, 5))
-                    sleep(3)
-
-                    if check_policy_inserted(self.edgelake_node_url, data):
-                        success = True
-
-            if success:
-                return {
-                    'status': 'success',
-                    'message': 'index initialized onto the blockchain'
-                }
-            else:
-                return {
-                    'status': 'error',
-                    'message': f'Request failed with status code: {response.status_code}'
-                }
+            codec = get_codec(codec).name # fail before inserting a policy nobody could honor
+            UpdateEncoder(update_encoding, topk_ratio, quantization)
+            self.policy_writer.write(InitPolicy(
+                index,
+                name=index,
+                module_name=module_name,
+                module_path=module_path,
+                ip_port=self.edgelake_tcp_node_ip_port,
+                rest_ip_port=self.edgelake_node_url,
+                db_name=db_name,
+                codec=codec,
+                byte_shuffle=bool(byte_shuffle),
+                update_encoding=update_encoding,
+                topk_ratio=topk_ratio,
+                quantization=quantization,
+                round_mode=round_mode
+            ), timeout=self.policy_write_timeout)
+            self.codecs[index] = (codec, bool(byte_shuffle))
+            return {
+                'status': 'success',
+                'message': 'index initialized onto the blockchain'
+            }
+        except TimeoutError as e:
+            # Not confirmed in time (EdgeLake node down or overloaded); it may still be written later
+            self.logger.error(f"[{index}] InitPolicy not confirmed on the blockchain: {str(e)}")
+            return {
+                'status': 'error',
+                'message': str(e)
+            }
         except Exception as e:
             return {
                 'status': 'error',
@@ -215,38 +267,26 @@ class Aggregator:
             #         sleep(np.random.randint(1,3))
 
             # Inserting policy back in with updated initParams link
-            data = f'''<my_policy = {{"{index}" : {{
-                                                    "index" : "{index}",
-                                                    "policy_type" : "RoundStart",
-                                                    "node_type": "aggregator",
-                                                    "round_number": {round_number},
-                                                    "initParams": "{initParams_link}",
-                                                    "node_id": "{self.agg_name}",
-                                                    "ip_port": "{self.edgelake_tcp_node_ip_port}",
-                                                    "rest_ip_port": "{self.edgelake_node_url}"
-                                          }} }}>'''
-            insert_success = False
-            while not insert_success:
-                response = insert_policy(self.edgelake_node_url, data)
-                if response.status_code == 200:
-                    insert_success = True
-                else:
-                    # sleep(np.random.randint(2, 5))
-                    sleep(3)
-
-                    if check_policy_inserted(self.edgelake_node_url, data):
-                        insert_success = True
-
-            if insert_success:
-                return {
-                    'status': 'success',
-                    'message': f'Successfully updated most recent aggregated model file at policy {index}-r'
-                }
-            else:
-                return {
-                    'status': 'error',
-                    'message': f'Request failed with status code: {response.status_code}'
-                }
+            self.policy_writer.write(RoundStartPolicy(
+                index,
+                index=index,
+                round_number=round_number,
+                initParams=initParams_link,
+                node_id=self.agg_name,
+                ip_port=self.edgelake_tcp_node_ip_port,
+                rest_ip_port=self.edgelake_node_url
+            ), timeout=self.policy_write_timeout)
+            return {
+                'status': 'success',
+                'message': f'Successfully updated most recent aggregated model file at policy {index}-r'
+            }
+        except TimeoutError as e:
+            # Not confirmed in time (EdgeLake node down or overloaded); it may still be written later
+            self.logger.error(f"[{index}] RoundStartPolicy not confirmed on the blockchain: {str(e)}")
+            return {
+                'status': 'error',
+                'message': str(e)
+            }
         except Exception as e:
             return {
                 'status': 'error',
@@ -255,128 +295,313 @@ class Aggregator:
 
     # function to call the start round function
     def start_round(self, initParams_link, round_number, index):
+        # Unknown (0, '') for links this aggregator didn't write, e.g. after a restart; nodes then skip the check
+        content_length, checksum = self.model_files.get(initParams_link, (0, ''))
         try:
-            # Format data exactly like the example curl command but with your values
             # NOTE: ask why are we adding the node num from agg
-            data = f'''<my_policy = {{"{index}" : {{
-                                        "index" : "{index}",
-                                        "policy_type": "RoundStart",
-                                        "node_type": "aggregator",
-                                        "round_number": {round_number},
-                                        "initParams": "{initParams_link}",
-                                        "node_id": "{self.agg_name}",
-                                        "ip_port": "{self.edgelake_tcp_node_ip_port}",
-                                        "rest_ip_port": "{self.edgelake_node_url}"
-                              }} }}>'''
-            success = False
-            while not success:
-                # print("Attempting insert")
-                response = insert_policy(self.edgelake_node_url, data)
-                if response.status_code == 200:
-                    success = True
-                else:
-                    # sleep(np.random.randint(5,15))
-                    sleep(5)
+            self.policy_writer.write(RoundStartPolicy(
+                index,
+                index=index,
+                round_number=round_number,
+                initParams=initParams_link,
+                content_length=content_length,
+                checksum=checksum,
+                node_id=self.agg_name,
+                ip_port=self.edgelake_tcp_node_ip_port,
+                rest_ip_port=self.edgelake_node_url
+            ), timeout=self.policy_write_timeout)
+            return {
+                'status': 'success',
+                'message': 'initTraining called successfully'
+            }
+        except TimeoutError as e:
+            # Not confirmed in time (EdgeLake node down or overloaded); it may still be written later
+            self.logger.error(f"[{index}] RoundStartPolicy not confirmed on the blockchain: {str(e)}")
+            return {
+                'status': 'error',
+                'message': str(e)
+            }
+        except Exception as e:
+            return {
+                'status': 'error',
+                'message': str(e)
+            }
 
-                    if check_policy_inserted(self.edgelake_node_url, data):
-                        success = True
-            if success:
-                return {
-                    'status': 'success',
-                    'message': 'initTraining called successfully'
-                }
-            else:
-                return {
-                    'status': 'error',
-                    'message': f'Request failed with status code: {response.status_code}'
-                }
+    def accepts_submodel(self, policy):
+        # Submodels name the aggregator that initialized their node (or region) as parent; the root also
+        # takes submodels of nodes that predate the field
+        parent = policy.get('parent', '')
+        return parent == self.agg_name or (not parent and not self.parent_url)
+
+    def follow_parent_round(self, policy, index):
+        # Regional tier: the parent's RoundStart policy names the parent and the global model the nodes'
+        # updates of the round are encoded against, so download it once for the whole region
+        self.parent_names[index] = policy.get('node_id', '')
+        round_number = int(policy['round_number'])
+        link = policy.get('initParams', '')
+        if not link or self.global_rounds.get(index) == round_number - 1:
+            return
+        weights = self.fetch_node_weights(index, link, policy.get('ip_port', ''), policy.get('rest_ip_port', ''),
+                                          int(policy.get('content_length', 0) or 0), policy.get('checksum', ''))
+        self.global_weights[index] = weights
+        self.global_rounds[index] = round_number - 1 # aggregates carry the round that produced them
+        self.training_apps[index].update_model(weights)
+
+    def publish_regional_submodel(self, index, round_number, model_link, num_samples):
+        content_length, checksum = self.model_files.get(model_link, (0, ''))
+        try:
+            self.policy_writer.write(SubmodelPolicy(
+                index,
+                node=self.agg_name,
+                round_number=round_number,
+                index=index,
+                ip_port=self.edgelake_tcp_node_ip_port,
+                rest_ip_port=self.edgelake_node_url,
+                trained_params_local_path=model_link,
+                num_samples=num_samples,
+                content_length=content_length,
+                checksum=checksum,
+                parent=self.parent_names.get(index, '')
+            ), timeout=self.policy_write_timeout)
+            return {
+                'status': 'success',
+                'message': f'regional submodel of round {round_number} published'
+            }
+        except TimeoutError as e:
+            # Not confirmed in time (EdgeLake node down or overloaded); it may still be written later
+            self.logger.error(f"[{index}] SubmodelPolicy not confirmed on the blockchain: {str(e)}")
+            return {
+                'status': 'error',
+                'message': str(e)
+            }
         except Exception as e:
             return {
                 'status': 'error',
                 'message': str(e)
             }
 
-    def fetch_decoded_params(self, decoded_params_dict, node_param_download_links, ip_ports, rest_ip_ports, index):
+    def new_round_accumulator(self, index):
+        # Data handlers that provide a streaming aggregator get updates folded in as soon as they are decoded,
+        # otherwise all updates are kept in memory and handed to aggregate_model_weights at the end of the round
+        training_app = self.training_apps[index]
+        if hasattr(training_app, 'get_streaming_aggregator'):
+            return training_app.get_streaming_aggregator()
+        return None
+
+    def get_base_weights(self, index, base_round):
+        # Global model that delta/top-k updates of the next round are encoded against
+        if self.global_rounds.get(index) == base_round:
+            return self.global_weights[index]
+        if self.parent_url: # a regional tier's own files are its submodels, not global models
+            return None
+        # e.g. training continued after a restart; the aggregate is still in the model store
+        local_path = self.model_stores[index].lookup_round(base_round)
+        if local_path is None:
+            return None
+        return LocalModelUpdate.load(local_path).get('weights')
+
+    def download_model_file(self, index, path, local_path, ip_port, rest_ip_port):
+        filename = path.split('/')[-1]
+        if self.docker_running:
+            response = copy_file_from_container(os.path.join(self.tmp_dir, index), self.docker_container_name,
+                                                rest_ip_port, path, local_path, ip_port,
+                                                timeout=self.fetch_timeout)
+        else:
+            response = read_file(rest_ip_port, path, local_path, ip_port, timeout=self.fetch_timeout)
+
+        if response is None:
+            raise ValueError(f"Failed to retrieve node params from link: {filename}. No response")
+        if response.status_code != 200:
+            raise ValueError(
+                f"Failed to retrieve node params from link: {filename}. HTTP Status: {response.status_code}"
+            )
+
+    def fetch_node_weights(self, index, path, ip_port, rest_ip_port, content_length=0, checksum=''):
+        """
+        Download one node's submodel and decode it into full weights, retrying failed attempts
+        until the file matches the content length and checksum announced in its policy.
+
+        :return: The node's per-layer weights.
+        :raises Exception: The last error once all attempts failed.
+        """
+        filename = path.split('/')[-1]
+        store = self.model_stores[index]
+        # Downloads with a known checksum are kept in the model store under it; older nodes' files by name
+        local_path = store.path_of(checksum) if checksum else f'{self.file_write_destination}/{index}/{filename}'
+        for attempt in range(self.fetch_retries + 1):
+            try:
+                # Skip the download if the file is already stored, e.g. by an attempt whose decoding failed
+                if not (checksum and store.lookup(checksum)):
+                    self.download_model_file(index, path, local_path, ip_port, rest_ip_port)
+
+                check_weights_file(local_path, content_length, checksum)
+                # Memory-mapped, so the update is folded straight from the page cache
+                node_update = LocalModelUpdate.load(local_path)
+                if not node_update.exist_key('weights'):
+                    raise ValueError(f"Missing model_weights in data from file: {filename}")
+                if checksum:
+                    store.add(checksum, self.round_number.get(index, 0))
+                base_weights = None
+                if node_update.exist_key('update_encoding') and node_update.get('update_encoding') != 'full':
+                    base_weights = self.get_base_weights(index, node_update.get('base_round'))
+                # Rebuild full weights from delta/top-k/quantized updates before fusing them
+                return decode_update(node_update, base_weights)
+            except Exception as e:
+                if attempt == self.fetch_retries:
+                    raise
+                self.logger.warning(f"[{index}] Attempt {attempt + 1} to fetch {filename} failed, retrying: {str(e)}")
+                time.sleep(backoff_delay(attempt))
+
+    def staleness_weight(self, staleness):
+        # Polynomial discount (1 + staleness)^-a of a submodel trained `staleness` rounds behind the round it's fused in
+        return (1 + staleness) ** -self.staleness_exponent
+
+    def mark_fused(self, index, round_number, links):
+        # Remember which submodels of a round were fused, so they're not fused again as late submodels
+        rounds = self.fused_links.setdefault(index, {})
+        rounds.setdefault(round_number, set()).update(links)
+        # Submodels older than max_staleness rounds are never fused, so neither is the record needed
+        for old_round in [r for r in rounds if r < round_number - self.max_staleness]:
+            del rounds[old_round]
+
+    def get_fused_links(self, index, round_number):
+        return self.fused_links.get(index, {}).get(round_number, set())
+
+    def fetch_decoded_params(self, decoded_params_dict, node_param_download_links, ip_ports, rest_ip_ports, index,
+                             accumulator=None, sample_counts=None, expected_files=None, staleness=0):
         # use the node_param_download_links to get all the file
-        # in the form of tuples, like ["('blobs_admin', 'node_model_updates', '1-replica-node1.pkl')"]
+        # in the form of tuples, like ["('blobs_admin', 'node_model_updates', '1-replica-node1.eflw')"]
         # node_ref = db.reference('node_model_updates')
 
-        # Loop through each provided download link to retrieve node parameter objects
+        # Download and decode every new link concurrently; existing paths are not fetched again
+        futures = {}
+        submitted = set()
         for i, path in enumerate(node_param_download_links):
-            # Don't fetch for existing paths
-
-            if path in decoded_params_dict:
+            if path in decoded_params_dict or path in submitted:
                 continue
-
+            submitted.add(path)
+            # (content_length, checksum) announced by the node; (0, '') skips the check
+            content_length, checksum = expected_files[i] if expected_files else (0, '')
+            future = self.fetch_executor.submit(self.fetch_node_weights, index, path, ip_ports[i], rest_ip_ports[i],
+                                                content_length, checksum)
+            futures[future] = i
+
+        # Fold each update in as soon as it lands, on this thread since the accumulator is not thread-safe
+        for future in as_completed(futures):
+            i = futures[future]
+            path = node_param_download_links[i]
+            filename = path.split('/')[-1]
             try:
-                # Make sure the directory exists
-                filename = path.split('/')[-1]
-                local_path = f'{self.file_write_destination}/{index}/{filename}'
-                if self.docker_running:
-                    docker_file_path = f'{self.docker_file_write_destination}/{index}/{filename}'
-                    # response = read_file(rest_ip_ports[i], path,
-                    #                      docker_file_path, ip_ports[i])
-                    response = copy_file_from_container(os.path.join(self.tmp_dir, index), self.docker_container_name,
-                                             rest_ip_ports[i], node_param_download_links[i],
-                                             local_path, ip_ports[i])
+                data = future.result()
+
+                # Nodes that do not report a sample count (0) contribute with unit weight
+                num_samples = sample_counts[i] if sample_counts else 0
+                if staleness:
+                    # Late submodel from an earlier round: it counts less the further behind it is
+                    num_samples = (num_samples or 1) * self.staleness_weight(staleness)
+                if accumulator is not None:
+                    # Fold in right away; only remember that this link has been consumed
+                    accumulator.fold(data, weight=num_samples or 1)
+                    decoded_params_dict[path] = None
                 else:
-                    response = read_file(rest_ip_ports[i], path,
-                                         local_path, ip_ports[i])
-
-                if response.status_code != 200:
-                    raise ValueError(
-                        f"Failed to retrieve node params from link: {filename}. HTTP Status: {response.status_code}"
-                    )
-
-                # Decode the model weights from the file
-                sleep(1)
-                with open(local_path, 'rb') as f:
-                    data = pickle.load(f)
-                if not data:
-                    raise ValueError(f"Missing model_weights in data from file: {filename}")
-                decoded_params_dict[path] = LocalModelUpdate(weights=data)
+                    decoded_params_dict[path] = LocalModelUpdate(weights=data, num_samples=num_samples)
             except Exception as e:
                 self.logger.error(f"Error retrieving data from link {filename}: {str(e)}")
                 continue
 
-    def aggregate_model_params(self, decoded_params, round_number, index):
-        aggregate_params_weights = self.training_apps[index].aggregate_model_weights(decoded_params)
-        aggregate_model_update = LocalModelUpdate(weights=aggregate_params_weights)
-        # encode params back to string
-        encoded_params = self.encode_params(aggregate_model_update)
-
-        data_entry = {
-            'newUpdates': encoded_params
-        }
-
+    def mix_global_model(self, index, weights, mixing):
+        # FedAsync-style update of the current global model: (1 - mixing) * global + mixing * weights
+        current = self.global_weights.get(index)
+        if current is None or mixing >= 1 or len(current) != len(weights):
+            return weights
+        mixed = []
+        for global_layer, layer in zip(current, weights):
+            global_layer, layer = np.asarray(global_layer), np.asarray(layer)
+            if not np.issubdtype(layer.dtype, np.floating) or global_layer.shape != layer.shape:
+                mixed.append(layer)
+                continue
+            mixed.append(((1 - mixing) * global_layer + mixing * layer).astype(layer.dtype, copy=False))
+        return mixed
+
+    def fuse_params(self, decoded_params, index, accumulator=None):
+        if accumulator is not None:
+            return accumulator.result()
+        return self.training_apps[index].aggregate_model_weights(decoded_params)
+
+    def aggregate_model_params(self, decoded_params, round_number, index, accumulator=None, mixing=1.0):
+        aggregate_params_weights = self.fuse_params(decoded_params, index, accumulator)
+        if mixing < 1:
+            aggregate_params_weights = self.mix_global_model(index, aggregate_params_weights, mixing)
+        # Nodes encode their next updates against this model, identified by its round
+        aggregate_model_update = LocalModelUpdate(weights=aggregate_params_weights, round_number=round_number)
+        self.global_weights[index] = aggregate_params_weights
+        self.global_rounds[index] = round_number
+        return self.write_model_file(aggregate_model_update, round_number, index)
+
+    def aggregate_regional_params(self, decoded_params, round_number, index, accumulator=None, num_samples=0):
+        # Regional tier: sent upward as plain weights with the region's total sample count, so the parent
+        # weighs the region by the data behind it
+        regional_weights = self.fuse_params(decoded_params, index, accumulator)
+        return self.write_model_file(LocalModelUpdate(weights=regional_weights, num_samples=num_samples),
+                                     round_number, index)
+
+    def write_model_file(self, model_update, round_number, index):
         # push agg data
-        # TODO: will this work on windows?
-        file_write_path = f'{self.file_write_destination}/{index}/{round_number}-{self.agg_name}_update.json'
-
-        with open(file_write_path, 'wb') as f:
-            f.write(self.encode_params(data_entry))
+        # Serialized once, here at the I/O boundary, into the index's content-addressed model store
+        codec, byte_shuffle = self.codecs.get(index, ('none', False))
+        file_write_path, content_length, checksum = self.model_stores[index].put(
+            model_update, round_number, codec=codec, shuffle=byte_shuffle
+        )
+        file_info = (content_length, checksum)
 
         if self.docker_running:
-            docker_file_write_path = f'{self.docker_file_write_destination}/{index}/{round_number}-{self.agg_name}_update.json'
+            docker_file_write_path = f'{self.docker_file_write_destination}/{index}/{os.path.basename(file_write_path)}'
             copy_file_to_container(os.path.join(self.tmp_dir,index), self.docker_container_name, self.edgelake_node_url,
                                    file_write_path,
                                    docker_file_write_path)
+            self.model_files[docker_file_write_path] = file_info
             return docker_file_write_path
 
+        self.model_files[file_write_path] = file_info
         return file_write_path
 
-    def encode_params(self, new_model_weights):
-        # serialized_data = gzip.compress(pickle.dumps(new_model_weights)) # maybe, so that we don't stored super large models as is
-        serialized_data = pickle.dumps(new_model_weights)
+    def encode_params(self, model_update, index=None):
+        codec, byte_shuffle = self.codecs.get(index, ('none', False))
+        serialized_data = model_update.serialize(codec=codec, shuffle=byte_shuffle)
         return serialized_data
 
     def decode_params(self, encoded_model_update):
-        # model_weights = pickle.loads(gzip.decompress(encoded_model_update))
-        model_weights = pickle.loads(encoded_model_update)
-        return model_weights
+        # The codec is recorded in the encoded header
+        model_update = LocalModelUpdate.deserialize(encoded_model_update)
+        return model_update
 
     def inference(self, index):
         return self.training_apps[index].run_inference()
 
+    # Score of the index's model on the given samples; batched with concurrent requests if the data handler can
     def direct_inference(self, index, data, labels):
-        return self.training_apps[index].direct_inference(data, labels)
\ No newline at end of file
+        return self.inference_score(index, self.submit_direct_inference(index, data).result(), labels)
+
+    # Future of the predictions, for callers on an event loop to await; runs on the compute executor
+    def submit_direct_inference(self, index, data):
+        return self.inference_dispatcher.submit(index, self.training_apps[index], data)
+
+    def inference_score(self, index, predictions, labels):
+        """
+        Score predictions against their labels with the data handler's `score(predictions, labels)`
+        if it has one (e.g. error metrics of a regression model), else as classification accuracy.
+
+        :raises ValueError: If there are not as many labels as predictions.
+        """
+        predictions = np.atleast_1d(np.asarray(predictions))
+        if len(predictions) != len(labels):
+            raise ValueError(f"Data and labels must have the same length ({len(predictions)} != {len(labels)}).")
+        handler = self.training_apps[index]
+        if hasattr(handler, 'score'):
+            return handler.score(predictions, np.asarray(labels))
+        return self.inference_accuracy(predictions, labels)
+
+    @staticmethod
+    def inference_accuracy(predictions, labels):
+        # Share (%) of predictions equal to their label
+        return float(np.mean(np.asarray(predictions) == np.asarray(labels)) * 100)
\ No newline at end of file
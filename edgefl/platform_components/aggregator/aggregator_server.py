@@ -6,6 +6,7 @@ file, You can obtain one at http://mozilla.org/MPL/2.0/
 
 
 import argparse
+from contextlib import asynccontextmanager
 from dotenv import load_dotenv
 
 from fastapi.responses import JSONResponse
@@ -15,7 +16,6 @@ from fastapi.responses import PlainTextResponse
 from platform_components.aggregator.aggregator import Aggregator
 import asyncio
 import logging
-import pickle
 import requests
 import os
 import threading
@@ -28,15 +28,25 @@ from fastapi.middleware.cors import CORSMiddleware
 
 from pydantic import BaseModel
 
+from platform_components.EdgeLake_functions import edgelake_client
 from platform_components.EdgeLake_functions.blockchain_EL_functions import get_local_ip
 import warnings
 
 from platform_components.lib.logger.logger_config import configure_logging
 from platform_components.lib.modules.exceptions import NodeInitializationError
+from platform_components.lib.modules.local_model_update import LocalModelUpdate
+from platform_components.lib.modules.round_events import RoundEvents, push_event, EVENT_KINDS
+from platform_components.lib.modules.round_scheduler import RoundScheduler
 
 warnings.filterwarnings("ignore")
 
-app = FastAPI()
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    yield
+    # Stop the training runs of all indexes with the server
+    await round_scheduler.cancel_all()
+
+app = FastAPI(lifespan=lifespan)
 load_dotenv()
 
 
@@ -57,9 +67,12 @@ logger.setLevel(logging.INFO)  # Excludes WARNING, ERROR, CRITICAL
 ip = get_local_ip()
 port = os.getenv("SERVER_PORT", "8080")
 aggregator = Aggregator(ip, port, logger)
+# URL nodes push their submodel events to
+aggregator_url = os.getenv("AGGREGATOR_URL", f"http://{ip}:{port}")
+round_events = RoundEvents()
 
-# Track the training process of each index so that they can join once they're done
-training_processes = {}
+# Training runs of all indexes, as tasks on the server's event loop
+round_scheduler = RoundScheduler(logger)
 
 
 #######  FASTAPI IMPLEMENTATION  #######
@@ -82,6 +95,16 @@ class ContinueTrainingRequest(BaseModel):
     minParams: int
     index: str
 
+class RegisterChildRequest(BaseModel):
+    index: str
+    url: str # server of the regional aggregator, where round_start events are pushed
+
+class NotifyRequest(BaseModel):
+    index: str
+    kind: str
+    round_number: int
+    sender: str | None = None
+
 class InferenceRequest(BaseModel):
     input: list # each element in here is one data value to test
     labels: list # check element type within direct_inference
@@ -119,9 +142,20 @@ def init(request: InitRequest):
         initialize_nodes(node_urls, index)
 
         aggregator.set_module_at_index(index, module_name, module_path)
-        aggregator.initialize_index_on_blockchain(index, module_name, module_path, db_name)
+        # Compression for model transfers; recorded in the index's init policy so every node uses the same codec
+        codec = os.getenv("MODEL_CODEC", "none")
+        byte_shuffle = os.getenv("MODEL_BYTE_SHUFFLE", "False").lower() == "true"
+        # Update encoding nodes use for their submodels (full, delta or topk, optionally quantized)
+        update_encoding = os.getenv("UPDATE_ENCODING", "full")
+        topk_ratio = float(os.getenv("UPDATE_TOPK_RATIO", "0.01"))
+        quantization = os.getenv("UPDATE_QUANTIZATION", "none")
+        # Nodes of async indexes train on the newest model whenever they're ready, skipping versions they missed
+        aggregator.initialize_index_on_blockchain(index, module_name, module_path, db_name, codec, byte_shuffle,
+                                                  update_encoding, topk_ratio, quantization, aggregator.round_mode)
         aggregator.initialize_training_app_on_index(index)
         aggregator.initialize_file_write_paths_on_index(index)
+        if aggregator.parent_url:
+            register_with_parent(index)
 
         initialized_nodes = [url for url in node_urls if url in aggregator.node_urls[index]]
         failed_nodes = [url for url in node_urls if url not in aggregator.node_urls[index]]
@@ -151,9 +185,41 @@ def init(request: InitRequest):
             detail=str(e)
         )
 
+def register_with_parent(index):
+    """Regional tier: count as one node of the index at the parent aggregator, which then pushes us its rounds."""
+    try:
+        response = edgelake_client.post(f'{aggregator.parent_url}/register-child',
+                                        json={'index': index, 'url': aggregator_url}, timeout=10)
+        if response.status_code != 200:
+            logger.warning(f"[{index}] Parent aggregator refused registration: {response.status_code} {response.text}")
+    except requests.exceptions.RequestException as e:
+        # Still works without it: rounds are found by polling, and minParams at the parent must account for us
+        logger.warning(f"[{index}] Unable to register with parent aggregator {aggregator.parent_url}: {str(e)}")
+
+
+@app.post('/register-child')
+def register_child(request: RegisterChildRequest):
+    """Add a regional aggregator to an index; its fused submodel counts as one node's."""
+    index = request.index
+    if index not in aggregator.indexes:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail=f"Index {index} not found (not yet initialized)."
+        )
+    with aggregator.lock:
+        if request.url not in aggregator.node_urls[index]:
+            aggregator.node_urls[index].add(request.url)
+            aggregator.node_count[index] += 1
+    logger.info(f"[{index}] Registered regional aggregator {request.url}")
+    return {
+        'status': 'success',
+        'message': f'Regional aggregator {request.url} registered at index {index}'
+    }
+
+
 def is_node_online(node_url: str):
     try:
-        response = requests.get(node_url, timeout=2)
+        response = edgelake_client.get(node_url, timeout=2, retries=0)
         return True
     except requests.exceptions.RequestException:
         return False
@@ -186,13 +252,15 @@ def initialize_nodes(node_urls: list[str], index):
                 replica_name = f"node{replica_number}"
                 aggregator.node_count[index] = replica_number
 
-            response = requests.post(f'{node_url}/init-node', json={
+            response = edgelake_client.post(f'{node_url}/init-node', json={
                 'replica_ip': ip_port[0],
                 'replica_port': ip_port[1],
                 'replica_name': replica_name,
                 'replica_index': index,
-                'round_number': aggregator.round_number[index]
-            })
+                'round_number': aggregator.round_number[index],
+                'aggregator_url': aggregator_url,
+                'aggregator_name': aggregator.agg_name # the node's submodels name it as their parent
+            }, timeout=180) # loading the data handler on the node can take a while
 
             # init end_round
 
@@ -268,85 +336,100 @@ async def init_training(request: TrainingRequest):
                 detail="Number of rounds must be positive"
             )
 
-        # TODO: if a training process is in-progress, do not allow another call to /start-training
-
-        # TODO: add a manual way to stop training (if needed)
+        if round_scheduler.is_running(index):
+            raise HTTPException(
+                status_code=status.HTTP_409_CONFLICT,
+                detail=f"Training is already in progress at index {index}; stop it first or use /continue-training"
+            )
 
         starting_round = 1
-        end_round = num_rounds
+        if aggregator.parent_url:
+            # Regional tier: join the parent's training at its current round
+            starting_round = get_last_round_number(index) or 1
+        end_round = starting_round + num_rounds - 1
         initial_params = ''
         logger.info(f"[{index}] {num_rounds} {'round' if num_rounds == 1 else 'rounds'} of training started.")
-        # Allow for independent training processes
-        training_thread = threading.Thread(
-            name=f"agg/start-training--{index}",
-            target=start_training,
-            args=(aggregator, initial_params, starting_round, end_round, index),
-            daemon=True
-        )
-        training_thread.start()
+        # Runs next to the other indexes' training on the server's event loop
+        round_scheduler.start(index, lambda state: start_training(state, initial_params), starting_round, end_round)
 
         return {
             "status": "success",
             "message": f"Started training at index: {index}"
         }
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(
             status_code=500,
             detail=str(e)
         )
 
-def start_training(aggregator, initial_params, starting_round, end_round, index):
-    try:
-        aggregator.end_round[index] = end_round
-        # for r in range(starting_round, end_round + 1):
-        while starting_round <= aggregator.end_round[index]:
-            r = starting_round
-            aggregator.round_number[index] = r
-            logger.info(f"[{index}] Starting training round {r}")
-            aggregator.start_round(initial_params, r, index)
-            logger.debug(f"[{index}] Sent initial parameters to nodes")
-
-            # Listen for updates from nodes
-            new_aggregator_params = asyncio.run(
-                listen_for_update_agg(aggregator.minParams[index], r, index)
-            )
-            logger.debug(f"[{index}] Received aggregated parameters")
-
-            # Set initial params to newly aggregated params for the next round
-            initial_params = new_aggregator_params # docker: /app/file_write/agg/{index}/1-agg_update.json
-            # print(initial_params) # debugging
-            logger.info(f"[{index}][Round {r}] Step 4 Complete: model parameters aggregated")
-
-            starting_round += 1
-
-            # Track the last agg model file because it's not stored in a policy after the last round
-            # aggregator.store_most_recent_agg_params(initial_params, index, starting_round)
+async def start_training(state, initial_params):
+    """
+    Run the rounds of one index until its end_round, which /continue-training may extend meanwhile.
+
+    :param state: Round state of the run, kept by the round scheduler.
+    :param initial_params: Link of the model the first round starts from ('' for round 1).
+    """
+    index = state['index']
+    aggregator.end_round[index] = state['end_round']
+    r = state['round_number']
+    while r <= aggregator.end_round[index]:
+        state.update(round_number=r, end_round=aggregator.end_round[index], phase='starting', submodels=0)
+        aggregator.round_number[index] = r
+        logger.info(f"[{index}] Starting training round {r}")
+        if aggregator.parent_url:
+            # Regional tier: the parent starts the rounds; relay them to our nodes
+            state['phase'] = 'waiting'
+            round_data = await wait_for_parent_round(r, index)
+            await asyncio.to_thread(aggregator.follow_parent_round, round_data, index)
+        else:
+            result = await asyncio.to_thread(aggregator.start_round, initial_params, r, index)
+            if result['status'] != 'success':
+                # Nodes would never see the round; fail the run instead of waiting for submodels forever
+                raise RuntimeError(f"[{index}] Unable to start round {r}: {result['message']}")
+        # Wake the nodes' listeners instead of letting them find the policy at their next poll
+        push_event(list(aggregator.node_urls.get(index, ())), index, 'round_start', r, aggregator.agg_name)
+        logger.debug(f"[{index}] Sent initial parameters to nodes")
+
+        # Listen for updates from nodes
+        state['phase'] = 'collecting'
+        if aggregator.round_mode == 'async':
+            new_aggregator_params = await buffer_async_updates(r, index, state)
+        else:
+            new_aggregator_params = await listen_for_update_agg(aggregator.minParams[index], r, index, state)
+        logger.debug(f"[{index}] Received aggregated parameters")
 
-            # Then, update aggregator's model at 'index'
-            local_path_of_initial_params = f"{aggregator.file_write_destination}/{index}/{r}-{aggregator.agg_name}_update.json"
-            with open(local_path_of_initial_params, "rb") as f:
-                data = pickle.load(f)
+        # Set initial params to newly aggregated params for the next round
+        initial_params = new_aggregator_params # docker: /app/file_write/agg/{index}/{checksum}.eflw
+        # print(initial_params) # debugging
+        logger.info(f"[{index}][Round {r}] Step 4 Complete: model parameters aggregated")
+        if aggregator.parent_url: # the parent's model of the next round is loaded when following it
+            r += 1
+            continue
 
-            if data and 'newUpdates' in data:
-                weights = aggregator.decode_params(data['newUpdates'])
-            else:
-                aggregator.logger.error(f"[{index}] Invalid data or 'newUpdates' missing in Firestore response: {data}")
-                raise ValueError(f"[{index}] Invalid data or 'newUpdates' missing in Firestore response: {data}")
+        # Track the last agg model file because it's not stored in a policy after the last round
+        # aggregator.store_most_recent_agg_params(initial_params, index, starting_round)
 
-            aggregator.training_apps[index].update_model(weights)
+        # Then, update aggregator's model at 'index' with the weights it just aggregated
+        state['phase'] = 'updating'
+        weights = aggregator.global_weights.get(index)
+        if weights is None:
+            local_path_of_initial_params = aggregator.model_stores[index].lookup_round(r)
+            if local_path_of_initial_params is None:
+                raise ValueError(f"[{index}] Aggregated model file of round {r} is missing from the model store")
+            data = LocalModelUpdate.load(local_path_of_initial_params)
 
+            if not data.exist_key('weights'):
+                aggregator.logger.error(f"[{index}] Invalid data or 'weights' missing in aggregated model file")
+                raise ValueError(f"[{index}] Invalid data or 'weights' missing in aggregated model file")
+            weights = data.get('weights')
 
+        await aggregator.compute.run(index, aggregator.training_apps[index].update_model, weights)
+        r += 1
 
-        logger.info(f"[{index}] Training completed successfully")
-        return {
-            "status": "success",
-            "message": "Training completed successfully"
-        }
-    except Exception as e:
-        if isinstance(e, ValueError):
-            raise ValueError(f"[{index}] Invalid data or 'newUpdates' missing in Firestore response: {data}")
-        else:
-            raise RuntimeError(f"An error occurred during training: {str(e)}")
+    state['phase'] = 'done'
+    logger.info(f"[{index}] Training completed successfully")
 
 
 @app.post('/update-minParams')
@@ -362,7 +445,7 @@ async def update_minParams(request: UpdatedMinParamsRequest):
                 detail=f"Index {index} not found (not yet initialized)."
             )
 
-        check_index_response = requests.get(url, headers={
+        check_index_response = await edgelake_client.async_get(url, headers={
             'User-Agent': 'AnyLog/1.23',
             "command": f"blockchain get index where name = {index}"
         })
@@ -399,81 +482,218 @@ async def update_minParams(request: UpdatedMinParamsRequest):
         )
 
 
-async def listen_for_update_agg(min_params, round_number, index):
-    """Asynchronously poll for aggregated parameters from the blockchain."""
+async def fetch_submodels(policies, decoded_params, index, accumulator, staleness=0, skip=()):
+    """Download, decode and fold the submodels of `policies` that are not in `decoded_params` or `skip` yet."""
+    # Only submodels addressed to this aggregator; regional tiers fuse their own nodes' submodels
+    policies = [item for item in policies
+                if aggregator.accepts_submodel(item) and item.get('trained_params_local_path') not in skip]
+    if not policies:
+        return
+    # Extract all trained_params into a list
+    node_params_links = [item.get('trained_params_local_path') for item in policies]
+    ip_ports = [item.get('ip_port') for item in policies]
+    rest_ip_ports = [item.get('rest_ip_port') for item in policies]
+    sample_counts = [int(item.get('num_samples', 0) or 0) for item in policies]
+    expected_files = [(int(item.get('content_length', 0) or 0), item.get('checksum', '')) for item in policies]
+
+    # Updates decoded_params with newly fetched decoded params (with node link as key)
+    await asyncio.to_thread(
+        aggregator.fetch_decoded_params,
+        decoded_params_dict=decoded_params,
+        node_param_download_links=node_params_links,
+        ip_ports=ip_ports,
+        rest_ip_ports=rest_ip_ports,
+        index=index,
+        accumulator=accumulator,
+        sample_counts=sample_counts,
+        expected_files=expected_files,
+        staleness=staleness
+    )
+
+
+async def wait_for_parent_round(round_number, index):
+    """Regional tier: wait for the parent aggregator's RoundStart policy of the round."""
+    logger.info(f"[{index}] waiting for the parent aggregator to start round {round_number}...")
+    events_seen = 0 # round_start events pushed by the parent for the round
+    while True:
+        try:
+            round_data = await asyncio.to_thread(aggregator.policy_cache.get_round_start, index, round_number)
+            if round_data:
+                return round_data
+        except Exception as e:
+            logger.error(f"[{index}] Error waiting for round {round_number} of the parent aggregator: {str(e)}")
+        events_seen = await round_events.async_wait(index, 'round_start', round_number, events_seen, 5)
+
+
+async def publish_to_parent(decoded_params, round_number, index, accumulator, num_samples):
+    """Regional tier: fuse our nodes' submodels into one, weighted by sample count, and publish it to the parent."""
+    link = await aggregator.compute.run(
+        index,
+        aggregator.aggregate_regional_params,
+        decoded_params=decoded_params,
+        round_number=round_number,
+        index=index,
+        accumulator=accumulator,
+        num_samples=num_samples
+    )
+    result = await asyncio.to_thread(aggregator.publish_regional_submodel, index, round_number, link, num_samples)
+    if result['status'] != 'success':
+        raise RuntimeError(f"[{index}] Unable to publish the regional submodel of round {round_number}: {result['message']}")
+    push_event([aggregator.parent_url], index, 'submodel', round_number, aggregator.agg_name)
+    return link
+
+
+async def listen_for_update_agg(min_params, round_number, index, state=None):
+    """
+    Asynchronously poll for aggregated parameters from the blockchain; blocking steps run on worker threads.
+
+    In semi-sync mode the round also closes ROUND_DEADLINE seconds after it started, with whatever
+    submodels arrived by then, and submodels of the previous MAX_STALENESS rounds that missed their
+    round are fused into this one with a staleness-discounted weight.
+    """
     logger.info(f"[{index}] listening for updates...")
-    url = f'http://{os.getenv("EXTERNAL_IP")}'
 
     # TODO: update min_params here with aggregator.min_params since the update_minParams request doesn't affect here
     #  as of now
     decoded_params = {} # { 'node_params_link': 'decoded_param' }
+    late_params = {} # { round_number: { 'node_params_link': 'decoded_param' } } of earlier rounds' stragglers
+    sample_counts = {} # { 'node_params_link': num_samples }, summed up by a regional tier
+    accumulator = aggregator.new_round_accumulator(index) # None if the data handler has no streaming aggregator
+    events_seen = 0 # submodel events pushed by nodes for this round
     check_chances = 5 # Once this reaches <= 0, we will ignore min_params and handle accordingly
+    state = state if state is not None else {}
+    semi_sync = aggregator.round_mode == 'semi-sync'
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + aggregator.round_deadline
+    late_rounds = range(max(1, round_number - aggregator.max_staleness), round_number) if semi_sync else ()
     while True:
         try:
-            # Fetch policies containing the node models at index and round number
-            params_response = requests.get(url, headers={
-                'User-Agent': 'AnyLog/1.23',
-                # "command": f"blockchain get {index}-a{round_number}"
-                "command": f"blockchain get {index} where round_number={round_number} and node_type=training"
-            })
-            params_response.raise_for_status()  # != 200
-
-            result = params_response.json()
+            # Submodel policies of the round (and of the rounds whose stragglers are still fused); only policies
+            # that are new since the last check are parsed
+            first_round = late_rounds[0] if late_rounds else round_number
+            await asyncio.to_thread(aggregator.policy_cache.refresh, index, 'training', first_round)
+            result = aggregator.policy_cache.get_round(index, 'training', round_number, refresh=False)
             if result:
-                # Extract all trained_params into a list
-                node_params_links = [
-                    item.get(index).get('trained_params_local_path')
-                    for item in result
-                    if index in item
-                ]
-                ip_ports = [
-                    item.get(index).get('ip_port')
-                    for item in result
-                    if index in item
-                ]
-
-                rest_ip_ports = [
-                    item.get(index).get('rest_ip_port')
-                    for item in result
-                    if index in item
-                ]
-
-                # Updates decoded_params with newly fetched decoded params (with node link as key)
-                aggregator.fetch_decoded_params(
-                    decoded_params_dict=decoded_params,
-                    node_param_download_links=node_params_links,
-                    ip_ports=ip_ports,
-                    rest_ip_ports=rest_ip_ports,
-                    index=index
+                sample_counts.update({item.get('trained_params_local_path'): int(item.get('num_samples', 0) or 0)
+                                      for item in result})
+                await fetch_submodels(result, decoded_params, index, accumulator)
+                state['submodels'] = len(decoded_params)
+
+            # Stragglers of earlier rounds are fetched and fused alongside this round's submodels
+            for late_round in late_rounds:
+                late = late_params.setdefault(late_round, {})
+                policies = aggregator.policy_cache.get_round(index, 'training', late_round, refresh=False)
+                sample_counts.update({item.get('trained_params_local_path'): int(item.get('num_samples', 0) or 0)
+                                      for item in policies})
+                await fetch_submodels(policies, late, index, accumulator, staleness=round_number - late_round,
+                                      skip=aggregator.get_fused_links(index, late_round))
+            late_count = sum(len(late) for late in late_params.values())
+            state['late_submodels'] = late_count
+
+            if semi_sync:
+                ready = len(decoded_params) >= min_params or (
+                    loop.time() >= deadline and (decoded_params or late_count)
                 )
+            else:
+                # If enough parameters or not getting ALL parameters in time, get the URL
+                ready = len(decoded_params) >= min_params or (decoded_params and not check_chances)
+            if ready:
+                if semi_sync and len(decoded_params) < min_params:
+                    logger.info(f"[{index}][Round {round_number}] Deadline passed; fusing {len(decoded_params)} "
+                                f"submodels and {late_count} late submodels")
+                state['phase'] = 'aggregating'
+                fused = list(decoded_params.values())
+                for late in late_params.values():
+                    fused.extend(late.values())
+                if aggregator.parent_url:
+                    aggregated_params_link = await publish_to_parent(
+                        fused, round_number, index, accumulator,
+                        sum(sample_counts.get(link, 0) for link in decoded_params) +
+                        sum(sample_counts.get(link, 0) for late in late_params.values() for link in late)
+                    )
+                else:
+                    aggregated_params_link = await aggregator.compute.run(
+                        index,
+                        aggregator.aggregate_model_params,
+                        decoded_params=fused,
+                        round_number=round_number,
+                        index=index,
+                        accumulator=accumulator
+                    )
+                aggregator.mark_fused(index, round_number, decoded_params)
+                for late_round, late in late_params.items():
+                    aggregator.mark_fused(index, late_round, late)
+                return aggregated_params_link
+
+            # Semi-sync rounds close at their deadline instead
+            if not semi_sync:
+                # TODO: Adjust this to decrement with >=0 decoded params, but based on nodes' training process
+                # Only decrement the counter when there is at least 1 decoded params
+                if decoded_params and check_chances:
+                    check_chances -= 1
 
-            # If enough parameters or not getting ALL parameters in time, get the URL
-            if len(decoded_params) >= min_params or (decoded_params and not check_chances):
+                # Use most recent aggregated model link if failed to pull any node models
+                if not decoded_params and not check_chances:
+                    aggregated_params_link = await asyncio.to_thread(get_last_aggregated_params, index)
+                    if aggregated_params_link: # but only fetch if there exists one
+                        return aggregated_params_link
+                    check_chances = 5 # If none, then reset and try to fetch node model links again
 
-                aggregated_params_link = aggregator.aggregate_model_params(
-                    decoded_params=list(decoded_params.values()),
+        except Exception as e:
+            logger.error(f"[{index}] Aggregator_server.py --> Waiting for file: {e}")
+
+        # Check again as soon as a node reports a submodel, or after 2 seconds (or at the deadline) at the latest
+        timeout = max(0.1, min(2, deadline - loop.time())) if semi_sync else 2
+        events_seen = await round_events.async_wait(index, 'submodel', round_number, events_seen, timeout)
+
+
+async def buffer_async_updates(round_number, index, state=None):
+    """
+    Asynchronous (FedBuff-style) round: fuse the first minParams submodels trained on this round's model or on
+    one of the MAX_STALENESS rounds before it, and mix them into the global model.
+
+    Nodes start training on the newest model whenever they're ready, so fast nodes keep the rounds going
+    while slow nodes' submodels arrive in later rounds; each submodel is weighted down by its staleness,
+    and so is the mixing share of the whole buffer.
+    """
+    logger.info(f"[{index}] buffering updates...")
+    buffered = {} # { base round_number: { 'node_params_link': 'decoded_param' } }
+    accumulator = aggregator.new_round_accumulator(index) # None if the data handler has no streaming aggregator
+    events_seen = 0 # submodel events pushed by nodes for this round
+    state = state if state is not None else {}
+    oldest_round = max(1, round_number - aggregator.max_staleness)
+    while True:
+        try:
+            await asyncio.to_thread(aggregator.policy_cache.refresh, index, 'training', oldest_round)
+            for base_round in range(oldest_round, round_number + 1):
+                policies = aggregator.policy_cache.get_round(index, 'training', base_round, refresh=False)
+                await fetch_submodels(policies, buffered.setdefault(base_round, {}), index, accumulator,
+                                      staleness=round_number - base_round,
+                                      skip=aggregator.get_fused_links(index, base_round))
+            count = sum(len(params) for params in buffered.values())
+            state['submodels'] = count
+
+            if count >= max(1, aggregator.minParams[index]):
+                state['phase'] = 'aggregating'
+                discount = sum(aggregator.staleness_weight(round_number - base_round) * len(params)
+                               for base_round, params in buffered.items()) / count
+                aggregated_params_link = await aggregator.compute.run(
+                    index,
+                    aggregator.aggregate_model_params,
+                    decoded_params=[param for params in buffered.values() for param in params.values()],
                     round_number=round_number,
-                    index=index
+                    index=index,
+                    accumulator=accumulator,
+                    mixing=min(1.0, aggregator.async_mixing * discount)
                 )
+                for base_round, params in buffered.items():
+                    aggregator.mark_fused(index, base_round, params)
                 return aggregated_params_link
-
-            # TODO: Adjust this to decrement with >=0 decoded params, but based on nodes' training process
-            # Only decrement the counter when there is at least 1 decoded params
-            if decoded_params and check_chances:
-                check_chances -= 1
-
-            # Use most recent aggregated model link if failed to pull any node models
-            if not decoded_params and not check_chances:
-                aggregated_params_link = get_last_aggregated_params(index)
-                if aggregated_params_link: # but only fetch if there exists one
-                    return aggregated_params_link
-                check_chances = 5 # If none, then reset and try to fetch node model links again
-
         except Exception as e:
             logger.error(f"[{index}] Aggregator_server.py --> Waiting for file: {e}")
 
-        # TODO: see there's an alternative to this sleep e.g. sleeping for less time or using another function
-        await asyncio.sleep(2)
+        # Check again as soon as a node reports a submodel for this round, or after 2 seconds at the latest
+        events_seen = await round_events.async_wait(index, 'submodel', round_number, events_seen, 2)
 
 
 @app.post('/continue-training')
@@ -511,8 +731,8 @@ async def continue_training(request: ContinueTrainingRequest):
                 detail=f"[{index}] No previous training found"
             )
 
-        # if mid training, we don't need to do anything but update the end_round value
-        if aggregator.round_number[index] < aggregator.end_round[index]:
+        # if mid training, we don't need to do anything but update the end_round value the run checks after each round
+        if round_scheduler.is_running(index):
             aggregator.end_round[index] = aggregator.end_round[index] + additional_rounds
             return {
                 "status": "success",
@@ -528,21 +748,11 @@ async def continue_training(request: ContinueTrainingRequest):
                 detail=f"[{index}] Failed to fetch aggregated parameters from round {last_round}"
             )
 
-        # TODO: if a training process is in-progress, do not allow another call to /continue-training
-
-        # TODO: add a manual way to stop training (if needed)
-
         starting_round = last_round + 1
         end_round = last_round + additional_rounds
         logger.info(f"[{index}] Continuing training from round {last_round}, adding {additional_rounds} more {'round' if additional_rounds == 1 else 'rounds'}.")
-        # Allow for independent training processes
-        training_thread = threading.Thread(
-            name=f"agg/continue-training--{index}",
-            target=start_training,
-            args=(aggregator, initial_params, starting_round, end_round, index),
-            daemon=True
-        )
-        training_thread.start()
+        # Runs next to the other indexes' training on the server's event loop
+        round_scheduler.start(index, lambda state: start_training(state, initial_params), starting_round, end_round)
 
         return {
             "status": "success",
@@ -555,82 +765,112 @@ async def continue_training(request: ContinueTrainingRequest):
         )
 
 
-def get_last_round_number(index):
-    """Get the last completed round number from the blockchain."""
-    url = f'http://{os.getenv("EXTERNAL_IP")}'
+@app.get('/training-status')
+def get_training_statuses():
+    """Round state of the training runs of all indexes."""
+    return round_scheduler.get_states()
 
-    try:
-        # Query the blockchain for all 'r' prefixed keys to find the highest round number
-        response = requests.get(url, headers={
-            'User-Agent': 'AnyLog/1.23',
-            # "command": f"blockchain get * where [index] = {index} and [node_type] = aggregator"
-            "command": f"blockchain get {index} where node_type = aggregator"
-        })
 
-        if response.status_code == 200:
-            policies = response.json()
-            if not policies or not isinstance(policies, list):
-                return None
+@app.get('/training-status/{index}')
+def get_training_status(index):
+    """Round state of the current (or last) training run of an index."""
+    if index not in aggregator.indexes:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail=f"Index {index} not found (not yet initialized)."
+        )
+    state = round_scheduler.get_state(index)
+    if state is None:
+        return {
+            'index': index,
+            'status': 'idle',
+            'round_number': aggregator.round_number.get(index)
+        }
+    return state
 
-            # Extract round numbers from keys like '{index}-r1', '{index}-r2', etc.
-            highest_round_number = 0
-            for policy in policies:
-                # if key.startswith('a') and key[1:].isdigit():
-                #     round_numbers.append(int(key[1:]))
-                key = next(iter(policy)) # it is dict form at first
-                if key[-1] == 'r':
-                    break
 
-                _, number = key.rsplit("-r", 1)
-                highest_round_number = max(highest_round_number, int(number))
+@app.post('/stop-training/{index}')
+async def stop_training(index):
+    """Cancel the training run of an index; it can be resumed with /continue-training."""
+    if not await round_scheduler.cancel(index):
+        raise HTTPException(
+            status_code=status.HTTP_409_CONFLICT,
+            detail=f"No training in progress at index {index}"
+        )
+    state = round_scheduler.get_state(index)
+    return {
+        'status': 'success',
+        'message': f"Stopped training at index {index} in round {state['round_number']}"
+    }
 
-            if highest_round_number == 0:
-                return None
 
-            return highest_round_number
-        else:
-            logger.error(f"[{index}] Error fetching keys: {response.status_code}")
+def get_last_round_number(index):
+    """Get the last started round number from the blockchain."""
+    try:
+        policy = aggregator.policy_cache.get_latest_round_start(index)
+        if policy is None:
             return None
-
+        return int(policy['round_number'])
     except Exception as e:
         logger.error(f"[{index}] Error fetching last round number: {str(e)}")
         return None
 
 
 def get_last_aggregated_params(index):
-    """Get the aggregated parameters from the specified round."""
-    url = f'http://{os.getenv("EXTERNAL_IP")}'
+    """Get the most recent aggregated parameters published in a RoundStart policy."""
     try:
-        # Get the aggregated parameters from index-r
-        response = requests.get(url, headers={
-            'User-Agent': 'AnyLog/1.23',
-            "command": f"blockchain get {index}-r"
-        })
-
-        if response.status_code == 200:
-            result = response.json()
-            if result and isinstance(result, list) and len(result) > 0:
-                for item in result:
-                    if f'{index}-r' in item and 'initParams' in item[f'{index}-r']:
-                        return item[f'{index}-r']['initParams']
-
-            logger.info(f"[{index}] No aggregated parameters found in policy {index}-r")
-            return None
-
-        else:
-            logger.error(f"[{index}] Error fetching aggregated parameters: {response.status_code}")
-            return None
+        policy = aggregator.policy_cache.get_latest_round_start(index)
+        if policy and policy.get('initParams'):
+            return policy['initParams']
 
+        logger.info(f"[{index}] No aggregated parameters found in the RoundStart policies")
+        return None
     except Exception as e:
         logger.error(f"[{index}] Error fetching aggregated parameters: {str(e)}")
         return None
 
 
+@app.post("/notify")
+def notify(request: NotifyRequest):
+    """Wake the listeners waiting for a policy; sent by nodes after inserting their submodel."""
+    try:
+        round_events.notify(request.index, request.kind, request.round_number)
+    except ValueError as e:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=str(e)
+        )
+    return {
+        'status': 'success',
+        'message': f'{request.kind} event for round {request.round_number} received'
+    }
+
+
+@app.get("/events/{index}")
+async def wait_for_event(index, kind: str, round_number: int, seen: int = 0, timeout: float = 25):
+    """Long-poll: return once more than `seen` events of `kind` arrived for the round, or after `timeout` seconds."""
+    if kind not in EVENT_KINDS:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"Unknown event kind '{kind}'. Supported kinds: {', '.join(EVENT_KINDS)}"
+        )
+    # Suspends on the event loop instead of holding one of the threads sync endpoints run on
+    count = await round_events.async_wait(index, kind, round_number, seen, min(max(timeout, 0), 60))
+    return {
+        'index': index,
+        'kind': kind,
+        'round_number': round_number,
+        'count': count
+    }
+
+
 # TODO: make labels optional (...maybe user doesn't feel like getting the accuracy?)
 @app.post("/direct-inference/{index}", response_class=PlainTextResponse)
 async def direct_inference(index, request: InferenceRequest):
     try:
-        results = aggregator.direct_inference(index, request.input, request.labels)
+        # Awaited, not run inline: the batch runs on the compute executor while the event loop keeps serving
+        predictions = await asyncio.wrap_future(aggregator.submit_direct_inference(index, request.input))
+        results = aggregator.inference_score(index, predictions, request.labels)
         response = (f"{{"
                     f"'index': '{index}',"
                     f" 'status': 'success',"
@@ -24,7 +24,7 @@ from sklearn.metrics import mean_squared_error, accuracy_score
 
 
 from platform_components.lib.modules.local_model_update import LocalModelUpdate
-from platform_components.model_fusion_algorithms.FedAvg import FedAvg_aggregate
+from platform_components.model_fusion_algorithms.FedAvg import FedAvg_aggregate, StreamingFedAvg
 
 from platform_components.lib.logger.logger_config import configure_logging
 logger = logging.getLogger(__name__)
@@ -174,7 +174,8 @@ class ChestXraysBBoxDataHandler():
             verbose=1
         )
 
-        return self.get_weights()
+        # Report the local dataset size so the aggregator can weight this model accordingly
+        return LocalModelUpdate(weights=self.get_weights(), num_samples=len(self.train_df))
 
 
     def set_generators(self, training_data, testing_data, batch_size):
@@ -218,6 +219,10 @@ class ChestXraysBBoxDataHandler():
         aggregated_params = FedAvg_aggregate(weights)
         return aggregated_params
 
+    def get_streaming_aggregator(self):
+        # Lets the aggregator fold node updates in as they arrive instead of holding all of them
+        return StreamingFedAvg()
+
     # TODO: bbox.direct_inference()
     def direct_inference(self, data):
         """
@@ -4,9 +4,9 @@ License, v. 2.0. If a copy of the MPL was not distributed with this
 file, You can obtain one at http://mozilla.org/MPL/2.0/
 """
 
-import ast
 import logging
 import os
+from concurrent.futures import ThreadPoolExecutor, as_completed
 
 import numpy as np
 from tensorflow.python import keras
@@ -14,9 +14,10 @@ from keras import layers, optimizers, models
 from sklearn.metrics import accuracy_score
 import tensorflow as tf
 from platform_components.lib.logger.logger_config import configure_logging
+from platform_components.lib.modules.image_columns import decode_images, decode_labels
 from platform_components.lib.modules.local_model_update import LocalModelUpdate
 from platform_components.EdgeLake_functions.blockchain_EL_functions import fetch_data_from_db
-from platform_components.model_fusion_algorithms.FedAvg import FedAvg_aggregate
+from platform_components.model_fusion_algorithms.FedAvg import FedAvg_aggregate, StreamingFedAvg
 
 from tensorflow.python.client import device_lib
 
@@ -42,9 +43,14 @@ LOGICAL_DATABASE=os.getenv('LOGICAL_DATABASE')
 TRAIN_TABLE=os.getenv('TRAIN_TABLE')
 # Table containing test data
 TEST_TABLE=os.getenv('TEST_TABLE')
+# Rows per query and concurrent queries when fetching the whole test table for evaluation
+TEST_PAGE_SIZE=int(os.getenv('TEST_PAGE_SIZE', '500'))
+TEST_FETCH_WORKERS=int(os.getenv('TEST_FETCH_WORKERS', '4'))
 
 
 class MnistDataHandler():
+    supports_prefetch = True # load_dataset has no side effects, so the node can load the next round early
+
     def __init__(self, node_name):
         # configure_logging(f"node_server_{port}")
         configure_logging("node_server_data_handler")
@@ -61,6 +67,7 @@ class MnistDataHandler():
         self.preprocessor = None
         self.testing_generator = None
         self.training_generator = None
+        self.test_data_cache = None # ((row count, first row_id, last row_id), (images, labels)) of the test table
         
         self.node_name = node_name
 
@@ -145,64 +152,32 @@ class MnistDataHandler():
 
         return acc
 
-    # TODO this function doesn't work
     def direct_inference(self, data):
         """
         Run inference on raw input data against given labels (already in MNIST format).
         Handles data conversion and validation internally.
         """
         # TODO: add another input type that allows for raw images to work (would be converted properly)
-        data = np.array(data)
-        res = self.fl_model.predict(data.reshape(1, 28, 28, 1))
-        return np.argmax(res, axis=1)
+        return self.predict_batch(self.prepare_samples(data))
 
-        # Validate existence and check that there is the same number of data inputs as number of labels
-        # if not data and not labels and len(data) != len(labels):
-        #     raise ValueError(f"Data and labels lists must have the same length ({len(data)} != {len(labels)}).")
-
-        # Validate labels/predictions and convert labels into a numpy array
-        # if not isinstance(labels[0], int):
-        #     raise TypeError(
-        #         f"Labels must be a list of integers."
-        #     )
-
-        # Set up the test data properly
-        test_images = []
-        test_labels = []
-        for image, label in zip(data, labels):
-            # Convert data type to required numpy array
-            image = np.array(image, dtype=np.float32)
-            # Validate input dimensions and reshape
-            if image.ndim not in [1, 3]:
-                raise ValueError(
-                    f"Invalid input dimensions ({image.ndim}D). "
-                    "Expected 1D (784 elements) or 3D (28x28x1) array."
-                )
-            if image.size != 784:
-                raise ValueError(
-                    f"1D input must contain exactly 784 elements. Got {image.size}."
-                )
-            test_images.append(image)
-            test_labels.append(label)
-
-        # Convert test data into final numpy arrays
-        img_rows, img_cols = 28, 28
-        test_images_final = np.array(test_images, dtype=np.float32).reshape(-1, img_rows, img_cols, 1)
-        # test_labels_final = np.array(test_labels, dtype=np.int64)
+    def prepare_samples(self, data):
+        # One image (784 values or 28x28) or a list of them, as a batch of shape (n, 28, 28, 1)
+        samples = np.asarray(data, dtype=np.float32)
+        if samples.size == 0 or samples.size % 784 != 0:
+            raise ValueError(f"Expected one or more images of 784 values, got {samples.size} values")
+        return samples.reshape(-1, 28, 28, 1)
 
-        # Get predictions
+    def predict_batch(self, samples):
+        # Predicted digit of each sample; one call for the whole batch instead of predict's per-call setup
         with tf.device(device):
-            predictions = self.fl_model.predict(test_images_final)
-        y_pred = np.argmax(predictions, axis=1)
-
-        # Calculate accuracy
-        acc = accuracy_score(test_labels_final, y_pred) * 100
-
-        return acc
+            res = self.fl_model.predict_on_batch(samples)
+        return np.argmax(res, axis=1)
 
-    def train(self, round_number):
-        (x_train, y_train), (x_test, y_test) = self.load_dataset(
-            node_name=self.node_name, round_number=round_number)
+    def train(self, round_number, dataset=None):
+        # dataset: the round's load_dataset result if the node prefetched it
+        if dataset is None:
+            dataset = self.load_dataset(node_name=self.node_name, round_number=round_number)
+        (x_train, y_train), (x_test, y_test) = dataset
 
         early_stopping = keras.callbacks.EarlyStopping(
             monitor='loss',
@@ -221,7 +196,8 @@ class MnistDataHandler():
                 callbacks=[early_stopping]
             )
 
-        return self.get_weights()
+        # Report the local dataset size so the aggregator can weight this model accordingly
+        return LocalModelUpdate(weights=self.get_weights(), num_samples=len(x_train))
 
     def update_model(self, weights):
         if isinstance(weights, LocalModelUpdate):
@@ -232,40 +208,54 @@ class MnistDataHandler():
         aggregated_params = FedAvg_aggregate(weights)
         return aggregated_params
 
-    def get_all_test_data(self, node_name):
-        # 1. run sql to get all test data for x and y
-        # 2. check if number returned equals number in db
-        # 3. return test data
-        batch_amount = 50 # TODO: make this parameterized
-        # db_name = os.getenv("PSQL_DB_NAME")
-
-        # Get number of rows
-        row_count_query = f"sql {self.db_name} SELECT count(*) FROM {TEST_TABLE}"
-        row_count = fetch_data_from_db(self.edgelake_node_url, row_count_query, self.tcp_ip_port)
-        num_rows = row_count["Query"][0].get('count(*)')
-        # fetch in offsets of 50
-        # TODO: Get row offset queries to work
-        for offset in range(1):
-        # for offset in range(0, num_rows, batch_amount):
-            query_test = f"sql {self.db_name} SELECT image, label FROM {TEST_TABLE} LIMIT 50"
-            test_data = fetch_data_from_db(self.edgelake_node_url, query_test, self.tcp_ip_port)
+    def get_streaming_aggregator(self):
+        # Lets the aggregator fold node updates in as they arrive instead of holding all of them
+        return StreamingFedAvg()
 
-            # Assuming the data is returned as dictionaries with keys 'x' and 'y'
-            query_test_result = np.array(test_data["Query"]) # TODO: watch out when exceeding max rounds stored in the db
-            x_test_images = []
-            y_test_labels = []
-            for i in range(len(query_test_result)):
-                x_test_image_np_array = np.array(ast.literal_eval(query_test_result[i]['image']))
-                y_test_label = query_test_result[i]['label']
-                x_test_images.append(x_test_image_np_array)
-                y_test_labels.append(y_test_label)
+    def get_all_test_data(self, node_name):
+        """
+        The whole test table, fetched in pages of TEST_PAGE_SIZE rows by up to TEST_FETCH_WORKERS
+        concurrent queries and decoded into preallocated arrays.
 
-            y_test_labels_final = np.array(y_test_labels, dtype=np.int64)
+        Pages are ranges of row_id, so they don't rely on OFFSET. The result is cached until the
+        table's row count or row_id range changes, which costs one aggregate query per call.
 
-            img_rows, img_cols = 28, 28
-            x_test_images_final = np.array(x_test_images, dtype=np.float32).reshape(-1, img_rows, img_cols, 1)
+        :return: Test images of shape (n, 28, 28, 1) and their labels.
+        :rtype: tuple
+        """
+        stats_query = f"sql {self.db_name} SELECT count(*), min(row_id), max(row_id) FROM {TEST_TABLE}"
+        stats = fetch_data_from_db(self.edgelake_node_url, stats_query, self.tcp_ip_port)["Query"][0]
+        num_rows = int(stats.get('count(*)') or 0)
+        first_id, last_id = int(stats.get('min(row_id)') or 0), int(stats.get('max(row_id)') or 0)
+        table_version = (num_rows, first_id, last_id)
+        if self.test_data_cache is not None and self.test_data_cache[0] == table_version:
+            return self.test_data_cache[1]
 
-            return x_test_images_final, y_test_labels_final
+        img_rows, img_cols = 28, 28
+        x_test_images = np.empty((num_rows, img_rows * img_cols), dtype=np.float32)
+        y_test_labels = np.empty(num_rows, dtype=np.int64)
+
+        def fetch_page(low_id):
+            query = (f"sql {self.db_name} SELECT image, label FROM {TEST_TABLE} "
+                     f"WHERE row_id >= {low_id} AND row_id < {low_id + TEST_PAGE_SIZE}")
+            rows = fetch_data_from_db(self.edgelake_node_url, query, self.tcp_ip_port)["Query"]
+            return decode_images(rows, pixels=img_rows * img_cols), decode_labels(rows)
+
+        filled = 0
+        with ThreadPoolExecutor(max_workers=TEST_FETCH_WORKERS, thread_name_prefix="test-data") as executor:
+            pages = [executor.submit(fetch_page, low_id) for low_id in range(first_id, last_id + 1, TEST_PAGE_SIZE)]
+            for page in as_completed(pages):
+                images, labels = page.result()
+                # Rows deleted since the count make pages shorter; the arrays are trimmed below
+                count = min(len(labels), num_rows - filled)
+                x_test_images[filled:filled + count] = images[:count]
+                y_test_labels[filled:filled + count] = labels[:count]
+                filled += count
+
+        result = x_test_images[:filled].reshape(-1, img_rows, img_cols, 1), y_test_labels[:filled]
+        self.test_data_cache = (table_version, result)
+        self.logger.debug(f"Fetched {filled} test rows in {len(pages)} pages")
+        return result
 
     # SAMPLE SQL Edgelake Commands:
     # FORMAT:
@@ -300,34 +290,17 @@ class MnistDataHandler():
             train_data = fetch_data_from_db(self.edgelake_node_url, query_train, self.tcp_ip_port)
             test_data = fetch_data_from_db(self.edgelake_node_url, query_test, self.tcp_ip_port)
 
-            # Assuming the data is returned as dictionaries with keys 'x' and 'y'
-            query_train_result = np.array(train_data["Query"])
-            x_train_images = []
-            y_train_labels = []
-            for i in range(len(query_train_result)):
-                x_train_image_np_array = np.array(ast.literal_eval(query_train_result[i]['image']))
-                y_train_label = query_train_result[i]['label']
-                x_train_images.append(x_train_image_np_array)
-                y_train_labels.append(y_train_label)
-
-            y_train_label_final = np.array(y_train_labels, dtype=np.int64)
-
-            query_test_result = np.array(test_data["Query"])
-            x_test_images = []
-            y_test_labels = []
-            for i in range(len(query_test_result)):
-                x_test_image_np_array = np.array(ast.literal_eval(query_test_result[i]['image']))
-                x_test_images.append(x_test_image_np_array)
-                y_test_label = query_test_result[i]['label']
-                y_test_labels.append(y_test_label)
+            # Images are decoded straight into float32 arrays, whether stored as array literals or base64
+            query_train_result = train_data["Query"]
+            query_test_result = test_data["Query"]
+            y_train_label_final = decode_labels(query_train_result)
+            y_test_label_final = decode_labels(query_test_result)
 
             img_rows, img_cols = 28, 28
-            x_train_images_final = np.array(x_train_images, dtype=np.float32).reshape(-1, img_rows, img_cols, 1)
-            x_test_images_final = np.array(x_test_images, dtype=np.float32).reshape(-1, img_rows, img_cols, 1)
+            x_train_images_final = decode_images(query_train_result, pixels=img_rows * img_cols).reshape(-1, img_rows, img_cols, 1)
+            x_test_images_final = decode_images(query_test_result, pixels=img_rows * img_cols).reshape(-1, img_rows, img_cols, 1)
 
             self.logger.debug(f"Train data shape after loading and reshaping: {x_train_images_final.shape}")
-
-            y_test_label_final = np.array(y_test_labels, dtype=np.int64)
             self.logger.debug(f"Test data shape after loading: {x_test_images_final.shape}")
 
         except Exception as e:
@@ -9,11 +9,11 @@ import os
 import logging
 
 import numpy as np
-import requests
 
 # import pandas as pd
 # from sklearn.preprocessing import MinMaxScaler
 
+from platform_components.EdgeLake_functions import edgelake_client
 from platform_components.EdgeLake_functions.blockchain_EL_functions import fetch_data_from_db
 from keras import layers, optimizers, models
 from tensorflow.python import keras
@@ -23,7 +23,7 @@ from sklearn.metrics import mean_absolute_error
 from sklearn.metrics import r2_score
 
 from platform_components.lib.modules.local_model_update import LocalModelUpdate
-from platform_components.model_fusion_algorithms.FedAvg import FedAvg_aggregate
+from platform_components.model_fusion_algorithms.FedAvg import FedAvg_aggregate, StreamingFedAvg
 
 from platform_components.lib.logger.logger_config import configure_logging
 logger = logging.getLogger(__name__)
@@ -45,6 +45,8 @@ TEST_TABLE=os.getenv('TEST_TABLE')
 # connect dbms system_query where type=sqlite and memory = true
 
 class WinniioDataHandler():
+    supports_prefetch = True # load_dataset has no side effects, so the node can load the next round early
+
     def __init__(self, node_name):
         """
         Initialize.
@@ -84,7 +86,7 @@ class WinniioDataHandler():
         if is_query is True:
             headers['destination'] = EDGE_NODE_URL
         try:
-            response = requests.get(url=QUERY_NODE_URL, headers=headers)
+            response = edgelake_client.get(QUERY_NODE_URL, headers=headers)
             response.raise_for_status()
         except Exception as error:
             logger.error(Exception(f"Failed to execute GET against {QUERY_NODE_URL} (Error: {error})"))
@@ -191,9 +193,11 @@ class WinniioDataHandler():
             weights = weights.get("weights")
         self.fl_model.set_weights(weights)
 
-    def train(self, round_number):
-        (x_train, y_train), (x_test, y_test) = self.load_dataset(
-            node_name=self.node_name, round_number=round_number)
+    def train(self, round_number, dataset=None):
+        # dataset: the round's load_dataset result if the node prefetched it
+        if dataset is None:
+            dataset = self.load_dataset(node_name=self.node_name, round_number=round_number)
+        (x_train, y_train), (x_test, y_test) = dataset
 
         early_stopping = keras.callbacks.EarlyStopping(
             monitor='loss',
@@ -214,7 +218,8 @@ class WinniioDataHandler():
                                  verbose=1)
 
         self.logger.debug(f'History is {history.history}')
-        return self.get_weights()
+        # Report the local dataset size so the aggregator can weight this model accordingly
+        return LocalModelUpdate(weights=self.get_weights(), num_samples=len(x_train))
 
     def batch_generator(self, x_train, y_train, batch_size):
         size = len(x_train)  # Total number of samples
@@ -260,16 +265,36 @@ class WinniioDataHandler():
         aggregated_params = FedAvg_aggregate(weights)
         return aggregated_params
 
+    def get_streaming_aggregator(self):
+        # Lets the aggregator fold node updates in as they arrive instead of holding all of them
+        return StreamingFedAvg()
+
     def direct_inference(self, data):
         """
         Run inference on raw input data against given labels (already in WINNIIO format).
         Handles data conversion and validation internally.
         """
-        data = np.array(data)
-        data = data.reshape(-1, 1, 6)
-        predictions = self.fl_model.predict_on_batch(data)
+        predictions = self.predict_batch(self.prepare_samples(data))
         self.logger.info(f"[Inference] Step 5: Edge inference complete")
-        return predictions.reshape(-1)
+        return predictions
+
+    def prepare_samples(self, data):
+        # One reading (6 values) or a list of them, as a batch of shape (n, 1, 6)
+        samples = np.asarray(data, dtype=np.float32)
+        if samples.size == 0 or samples.size % 6 != 0:
+            raise ValueError(f"Expected one or more readings of 6 values, got {samples.size} values")
+        return samples.reshape(-1, 1, 6)
+
+    def predict_batch(self, samples):
+        return self.fl_model.predict_on_batch(samples).reshape(-1)
+
+    def score(self, predictions, labels):
+        # Regression model: exact matches are meaningless, report the error metrics of run_inference
+        labels = np.asarray(labels, dtype=np.float32)
+        mse = mean_squared_error(labels, predictions)
+        return {"mae": mean_absolute_error(labels, predictions), "mse": mse, "rmse": np.sqrt(mse),
+                "r2": r2_score(labels, predictions) if len(labels) > 1 else None,
+                "reg_accuracy": self.regression_accuracy(labels, predictions, threshold=0.1)}
 
 
     def run_inference(self):
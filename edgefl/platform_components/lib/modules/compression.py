@@ -0,0 +1,133 @@
+"""
+Compression codecs for model weight transfers.
+
+The codec used for an index is recorded in its init policy so that every node writes
+its model files the same way. Files are self-describing, so readers only need the
+codec's library to be installed. lz4 and zstd are optional dependencies:
+
+    pip install lz4 zstandard
+"""
+
+import zlib
+
+import numpy as np
+
+CODECS = ('none', 'gzip', 'lz4', 'zstd')
+DEFAULT_CODEC = 'none'
+
+
+class _NoneCodec:
+    name = 'none'
+
+    def compress(self, data):
+        return data
+
+    def decompress(self, data, size):
+        return data
+
+
+class _GzipCodec:
+    # DEFLATE through zlib; the gzip container would only add a second checksum
+    name = 'gzip'
+
+    def __init__(self, level=6):
+        self.level = level
+
+    def compress(self, data):
+        return zlib.compress(data, self.level)
+
+    def decompress(self, data, size):
+        return zlib.decompress(data, bufsize=max(size, 1))
+
+
+class _Lz4Codec:
+    name = 'lz4'
+
+    def __init__(self):
+        import lz4.frame
+        self.lz4 = lz4.frame
+
+    def compress(self, data):
+        return self.lz4.compress(data, store_size=True)
+
+    def decompress(self, data, size):
+        return self.lz4.decompress(data)
+
+
+class _ZstdCodec:
+    name = 'zstd'
+
+    def __init__(self, level=3):
+        import zstandard
+        self.compressor = zstandard.ZstdCompressor(level=level)
+        self.decompressor = zstandard.ZstdDecompressor()
+
+    def compress(self, data):
+        return self.compressor.compress(data)
+
+    def decompress(self, data, size):
+        return self.decompressor.decompress(data, max_output_size=size)
+
+
+_CODEC_CLASSES = {
+    'none': _NoneCodec,
+    'gzip': _GzipCodec,
+    'lz4': _Lz4Codec,
+    'zstd': _ZstdCodec,
+}
+_codec_cache = {}
+
+
+def get_codec(name):
+    """
+    Returns the codec registered under `name`.
+
+    :param name: One of CODECS.
+    :raises ValueError: If the codec is unknown or its library is not installed.
+    """
+    name = (name or DEFAULT_CODEC).lower()
+    if name not in _codec_cache:
+        if name not in _CODEC_CLASSES:
+            raise ValueError(f"Unknown compression codec '{name}'. Supported codecs: {', '.join(CODECS)}")
+        try:
+            _codec_cache[name] = _CODEC_CLASSES[name]()
+        except ImportError as e:
+            raise ValueError(f"Compression codec '{name}' is not available: {str(e)}")
+    return _codec_cache[name]
+
+
+def is_codec_available(name):
+    try:
+        get_codec(name)
+        return True
+    except ValueError:
+        return False
+
+
+def byte_shuffle(array):
+    """
+    Group the i-th byte of every element together.
+
+    Float weights have near-constant sign/exponent bytes, so shuffled data compresses
+    considerably better than the interleaved original.
+
+    :return: The shuffled bytes.
+    :rtype: bytes
+    """
+    array = np.asarray(array, order='C')
+    if array.dtype.itemsize == 1:
+        return array.tobytes()
+    return array.reshape(-1).view(np.uint8).reshape(-1, array.dtype.itemsize).T.tobytes()
+
+
+def byte_unshuffle(data, dtype):
+    """
+    Inverse of `byte_shuffle`.
+
+    :return: A flat array of `dtype`.
+    """
+    dtype = np.dtype(dtype)
+    shuffled = np.frombuffer(data, dtype=np.uint8)
+    if dtype.itemsize == 1:
+        return shuffled.view(dtype)
+    return shuffled.reshape(dtype.itemsize, -1).T.copy().view(dtype).reshape(-1)
@@ -0,0 +1,80 @@
+"""
+Shared executor for the model work of the aggregator and node servers.
+
+Training, fusing, evaluation and inference (Keras fit/predict, FedAvg) block for a long
+time and hold the GIL for much of it. Running them inline in an `async def` endpoint
+freezes the event loop, and with it every control-plane call (/update-minParams, status
+endpoints, event notifications). All model work is therefore submitted here and runs on
+a pool of COMPUTE_WORKERS threads; async code awaits it with `run`, threads block on the
+future returned by `submit`.
+
+At most COMPUTE_PER_INDEX tasks of an index run at once, the rest wait in order, so one
+index under heavy inference load can't occupy every worker and starve the others.
+"""
+
+import asyncio
+import os
+import threading
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+
+
+class ComputeExecutor:
+    def __init__(self, logger=None, workers=None, per_index=None):
+        self.logger = logger
+        workers = int(workers if workers is not None else os.getenv("COMPUTE_WORKERS", "4"))
+        self.per_index = max(1, int(per_index if per_index is not None else os.getenv("COMPUTE_PER_INDEX", "2")))
+        self._executor = ThreadPoolExecutor(max_workers=max(1, workers), thread_name_prefix="compute")
+        self._lock = threading.Lock()
+        self._running = {} # {index: number of tasks running}
+        self._waiting = {} # {index: deque of (Future, fn, args, kwargs) over the index's limit}
+
+    def submit(self, index, fn, /, *args, **kwargs):
+        """
+        Run `fn(*args, **kwargs)` as model work of `index`.
+
+        :return: concurrent.futures.Future of its result.
+        """
+        future = Future()
+        with self._lock:
+            if self._running.get(index, 0) >= self.per_index:
+                self._waiting.setdefault(index, deque()).append((future, fn, args, kwargs))
+                return future
+            self._running[index] = self._running.get(index, 0) + 1
+        self._start(index, future, fn, args, kwargs)
+        return future
+
+    async def run(self, index, fn, /, *args, **kwargs):
+        """Await `fn(*args, **kwargs)` run as model work of `index`, without blocking the event loop."""
+        return await asyncio.wrap_future(self.submit(index, fn, *args, **kwargs))
+
+    def _start(self, index, future, fn, args, kwargs):
+        if not future.set_running_or_notify_cancel():
+            self._done(index)
+            return
+        try:
+            task = self._executor.submit(fn, *args, **kwargs)
+        except Exception as e:
+            # e.g. RuntimeError once the pool is shut down; free the slot instead of leaking it
+            future.set_exception(e)
+            self._done(index)
+            return
+        task.add_done_callback(lambda task: self._finish(index, future, task))
+
+    def _finish(self, index, future, task):
+        exception = task.exception()
+        if exception is not None:
+            future.set_exception(exception)
+        else:
+            future.set_result(task.result())
+        self._done(index)
+
+    def _done(self, index):
+        # Start the next waiting task of the index in the slot that just freed up
+        with self._lock:
+            waiting = self._waiting.get(index)
+            if not waiting:
+                self._running[index] -= 1
+                return
+            future, fn, args, kwargs = waiting.popleft()
+        self._start(index, future, fn, args, kwargs)
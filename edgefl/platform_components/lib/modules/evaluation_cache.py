@@ -0,0 +1,91 @@
+"""
+Cached evaluation results of a node's models, served to /inference.
+
+Evaluating means fetching the test set and running a forward pass over it, while the
+model of an index only changes once per round. Results are therefore kept per index
+with the version of the model they were computed on, and re-evaluated in the background
+when the node reports a new model (after training a round) or when the result is older
+than EVAL_CACHE_TTL seconds, which picks up changes of the test set. Until then, callers
+get the stored result immediately; only the very first request of an index waits.
+
+Each result is a dict:
+
+- metrics:      whatever the data handler's run_inference returned
+- model_round:  round of the model that was evaluated (0 before the first round)
+- evaluated_at: UNIX timestamp
+- stale:        True while a newer model or the test set is being evaluated
+"""
+
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+
+class EvaluationCache:
+    def __init__(self, logger=None, ttl=None):
+        self.logger = logger
+        self.ttl = float(ttl if ttl is not None else os.getenv("EVAL_CACHE_TTL", "300"))
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="node/evaluation")
+        self._lock = threading.Lock()
+        self._evaluators = {} # {index: function evaluating the index's current model}
+        self._versions = {} # {index: (round_number, change count)} of the current model
+        self._results = {} # {index: (model version, result dict)}
+        self._running = {} # {index: Future of the evaluation in progress}
+
+    def model_changed(self, index, round_number, evaluate):
+        """
+        Record that the model of `index` changed and re-evaluate it in the background.
+
+        :param evaluate: Function called without arguments that returns the model's metrics.
+        """
+        with self._lock:
+            changes = self._versions.get(index, (0, 0))[1] + 1
+            self._versions[index] = (round_number, changes)
+            self._evaluators[index] = evaluate
+        self._refresh(index)
+
+    def get(self, index, evaluate):
+        """
+        Latest evaluation of `index`, refreshed in the background if it is out of date.
+
+        :param evaluate: Used if the node never reported a model of `index` (e.g. before training).
+        :return: Result dict (see module docstring).
+        """
+        with self._lock:
+            self._evaluators.setdefault(index, evaluate)
+            cached = self._results.get(index)
+            current = self._versions.get(index, (0, 0))
+        if cached is None:
+            return dict(self._refresh(index).result())
+
+        version, result = cached
+        stale = version != current or time.time() - result['evaluated_at'] > self.ttl
+        if stale:
+            self._refresh(index)
+        return {**result, 'stale': stale}
+
+    def _refresh(self, index):
+        with self._lock:
+            future = self._running.get(index)
+            if future is None or future.done():
+                future = self._executor.submit(self._evaluate, index)
+                self._running[index] = future
+            return future
+
+    def _evaluate(self, index):
+        with self._lock:
+            version = self._versions.get(index, (0, 0))
+            evaluate = self._evaluators[index]
+        try:
+            metrics = evaluate()
+        except Exception as e:
+            if self.logger:
+                self.logger.error(f"[{index}] Evaluation of round {version[0]} failed: {str(e)}")
+            raise
+        result = {'metrics': metrics, 'model_round': version[0], 'evaluated_at': time.time(), 'stale': False}
+        with self._lock:
+            self._results[index] = (version, result)
+        if self.logger:
+            self.logger.debug(f"[{index}] Evaluated the model of round {version[0]}: {metrics}")
+        return result
@@ -5,3 +5,6 @@ class NodeInitializationError(Exception):
         self.detail = detail
         super().__init__(f"Node initialization failed ({status_code}): {detail}")
 
+
+class PolicyError(ValueError):
+    """Raised when a policy is missing attributes or has attributes of the wrong type."""
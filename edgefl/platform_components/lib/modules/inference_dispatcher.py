@@ -0,0 +1,145 @@
+"""
+Micro-batched direct inference.
+
+Each direct-inference request used to run its own `predict` call, whose fixed Keras
+overhead dwarfs the work for a single sample. The dispatcher queues the requests of an
+index and runs them as one batch when INFERENCE_MAX_BATCH samples are queued or the
+oldest request has waited INFERENCE_MAX_DELAY_MS, then hands each request its own slice
+of the predictions. If a batch fails, its requests are rerun one by one, so a bad request
+only fails itself.
+
+Data handlers opt in by implementing
+
+- prepare_samples(data): the request's input as an array of samples, shape (n, ...); a
+  single sample and a list of samples are both accepted
+- predict_batch(samples): one prediction per sample, as an array of length n
+
+Handlers without them are called with `direct_inference(data)` per request, as before.
+
+Given a ComputeExecutor, batches (and unbatched requests) run on it as model work of their
+index; otherwise they run on the dispatcher's own thread.
+"""
+
+import os
+import threading
+import time
+from concurrent.futures import Future, InvalidStateError
+
+import numpy as np
+
+
+class InferenceDispatcher:
+    def __init__(self, logger=None, max_batch=None, max_delay_ms=None, executor=None):
+        self.logger = logger
+        self.executor = executor
+        self.max_batch = max(1, int(max_batch if max_batch is not None else os.getenv("INFERENCE_MAX_BATCH", "64")))
+        delay_ms = float(max_delay_ms if max_delay_ms is not None else os.getenv("INFERENCE_MAX_DELAY_MS", "5"))
+        self.max_delay = delay_ms / 1000
+        self._condition = threading.Condition()
+        self._queues = {} # {index: [(samples, Future, enqueued at), ...]}
+        self._handlers = {} # {index: data handler predicting the queued samples}
+        self._threads = {} # {index: flushing thread}
+
+    def submit(self, index, handler, data):
+        """
+        Queue a request for the next batch of `index`.
+
+        :return: Future of the request's predictions (a list, one per sample).
+        :raises ValueError: If the handler rejects the input.
+        """
+        if not (hasattr(handler, 'prepare_samples') and hasattr(handler, 'predict_batch')):
+            # Handler can't batch; answer the request on its own
+            if self.executor is not None:
+                return self.executor.submit(index, handler.direct_inference, data)
+            future = Future()
+            try:
+                future.set_result(handler.direct_inference(data))
+            except Exception as e:
+                future.set_exception(e)
+            return future
+
+        future = Future()
+        samples = handler.prepare_samples(data)
+        with self._condition:
+            self._handlers[index] = handler
+            self._queues.setdefault(index, []).append((samples, future, time.monotonic()))
+            thread = self._threads.get(index)
+            if thread is None or not thread.is_alive():
+                thread = threading.Thread(name=f"inference--{index}", target=self._run, args=(index,), daemon=True)
+                self._threads[index] = thread
+                thread.start()
+            self._condition.notify_all()
+        return future
+
+    def _queued_samples(self, index):
+        return sum(len(samples) for samples, _, _ in self._queues.get(index, ()))
+
+    def _run(self, index):
+        while True:
+            batch = []
+            try:
+                with self._condition:
+                    self._condition.wait_for(lambda: self._queues.get(index))
+                    # Flush once the batch is full or its oldest request waited long enough
+                    deadline = self._queues[index][0][2] + self.max_delay
+                    while self._queued_samples(index) < self.max_batch:
+                        remaining = deadline - time.monotonic()
+                        if remaining <= 0:
+                            break
+                        self._condition.wait(remaining)
+                    count = 0
+                    queue = self._queues[index]
+                    while queue and (not batch or count + len(queue[0][0]) <= self.max_batch):
+                        request = queue.pop(0)
+                        # Requests whose caller went away (e.g. the client disconnected) are dropped
+                        if request[1].set_running_or_notify_cancel():
+                            batch.append(request)
+                            count += len(request[0])
+                    handler = self._handlers[index]
+                if batch:
+                    self._flush(index, handler, batch)
+            except Exception as e:
+                # The thread must survive anything: later requests of the index wait for it
+                if self.logger:
+                    self.logger.error(f"[{index}] Inference of {len(batch)} requests failed: {str(e)}")
+                for _, future, _ in batch:
+                    self._resolve(future, exception=e)
+
+    @staticmethod
+    def _resolve(future, result=None, exception=None):
+        # Resolve a request; one that is already resolved must not stop the rest of its batch
+        try:
+            if exception is not None:
+                future.set_exception(exception)
+            else:
+                future.set_result(result)
+        except InvalidStateError:
+            pass
+
+    def _predict(self, index, handler, samples):
+        if self.executor is not None:
+            return self.executor.submit(index, handler.predict_batch, samples).result()
+        return handler.predict_batch(samples)
+
+    def _flush(self, index, handler, batch):
+        try:
+            predictions = self._predict(index, handler, np.concatenate([samples for samples, _, _ in batch]))
+        except Exception as e:
+            if self.logger:
+                self.logger.error(f"[{index}] Batched inference of {len(batch)} requests failed: {str(e)}")
+            if len(batch) == 1:
+                self._resolve(batch[0][1], exception=e)
+                return
+            # Rerun the requests one by one so only the one(s) causing the failure get the error
+            for samples, future, _ in batch:
+                try:
+                    self._resolve(future, np.asarray(self._predict(index, handler, samples)).tolist())
+                except Exception as e:
+                    self._resolve(future, exception=e)
+            return
+        offset = 0
+        for samples, future, _ in batch:
+            self._resolve(future, np.asarray(predictions[offset:offset + len(samples)]).tolist())
+            offset += len(samples)
+        if self.logger:
+            self.logger.debug(f"[{index}] Inference batch of {offset} samples from {len(batch)} requests")
@@ -1,46 +1,48 @@
-from pickle import dumps, loads
+from platform_components.lib.modules.weights_file_format import pack_weights, unpack_weights, \
+    save_weights, load_weights
 
 class LocalModelUpdate:
     """
-    Class to store and manage local model updates using serialization.
+    Class to store and manage local model updates.
 
-    This class allows storing model weight updates using key-value pairs,
-    where values are serialized using `pickle.dumps` for later retrieval.
+    Values are held by reference, so reading the weights of an update never copies
+    or deserializes the model. Serialization only happens explicitly, through
+    `serialize`/`deserialize` or `save`/`load`, when an update is written to or read
+    from a file. The 'weights' key holds the list of layers; every other key is stored
+    as metadata and must be JSON-serializable.
     """
+    __slots__ = ('_model_updates',)
+
     def __init__(self, **weights):
         """
         Initialize instance with weights.
 
         :param weights: Key-value pairs representing model weight updates.
         """
-        self.__model_updates = {}
+        self._model_updates = {}
         for key, value in weights.items():
             self.add(key, value)
 
     def add(self, key, value):
         """
-        Add a model update by serializing and storing it.
+        Add a model update, stored by reference.
 
         :param key: Unique ID for the model update.
         :param value: The model weight to be stored.
-        :raises Exception: If serialization fails.
         """
-        try:
-            self.__model_updates[key] = dumps(value)
-        except Exception as e:
-            raise Exception(f"Error updating model update: {str(e)}")
+        self._model_updates[key] = value
 
     def get(self, key):
         """
-        Retrieve a model update by deserializing the stored value.
+        Retrieve a model update.
 
         :param key: Unique ID for the model update.
-        :return: The deserialized model update value.
+        :return: The stored model update value (not a copy).
         :raises Exception: If the key does not exist in stored updates.
         """
-        if key not in self.__model_updates:
+        if key not in self._model_updates:
             raise Exception(f"Key {key} not found in model updates")
-        return loads(self.__model_updates[key])
+        return self._model_updates[key]
 
     def exist_key(self, key):
         """
@@ -49,4 +51,58 @@ class LocalModelUpdate:
         :param key: Unique ID for the model update.
         :return: True if the key exists, False otherwise.
         """
-        return key in self.__model_updates
+        return key in self._model_updates
+
+    def _split(self):
+        metadata = {key: value for key, value in self._model_updates.items() if key != 'weights'}
+        return self._model_updates.get('weights', []), metadata
+
+    def serialize(self, codec='none', shuffle=False):
+        """
+        Encode the update in the binary weights file format.
+
+        :param codec: Compression codec applied to each layer.
+        :param shuffle: Byte-shuffle layers before compressing them.
+        :return: The encoded model update.
+        :rtype: bytes
+        """
+        weights, metadata = self._split()
+        return pack_weights(weights, metadata, codec, shuffle)
+
+    @classmethod
+    def deserialize(cls, data, verify=True):
+        """
+        Rebuild a model update from the output of `serialize`.
+
+        :param data: The encoded model update.
+        :param verify: Check the checksum before decoding.
+        :return: A new LocalModelUpdate whose weights are read-only views into `data`.
+        """
+        weights, metadata = unpack_weights(data, verify=verify)
+        return cls(weights=weights, **metadata)
+
+    def save(self, path, codec='none', shuffle=False):
+        """
+        Atomically write the update to a weights file.
+
+        :param path: Destination file path.
+        :param codec: Compression codec applied to each layer.
+        :param shuffle: Byte-shuffle layers before compressing them.
+        :return: File size in bytes and the hex SHA-256 checksum of the file.
+        :rtype: tuple
+        """
+        weights, metadata = self._split()
+        return save_weights(path, weights, metadata, codec, shuffle)
+
+    @classmethod
+    def load(cls, path, mmap=True, verify=True):
+        """
+        Read an update from a weights file.
+
+        :param path: Path of the weights file.
+        :param mmap: Memory-map the file so uncompressed weights are paged in on demand rather than copied.
+        :param verify: Check the checksum before decoding.
+        :return: A new LocalModelUpdate.
+        """
+        weights, metadata = load_weights(path, mmap=mmap, verify=verify)
+        return cls(weights=weights, **metadata)
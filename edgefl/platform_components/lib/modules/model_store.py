@@ -0,0 +1,206 @@
+"""
+Content-addressed store for the model files of one index.
+
+Every model file (own submodels or aggregates, and models downloaded from peers) is
+named after its SHA-256 checksum, `{checksum}.eflw`, in the index's file_write
+directory, so identical models are stored once. `index.json` in the same directory
+records each file's round, kind, size and last access, so lookups by checksum or by
+round never scan the directory.
+
+Retention:
+
+- own files (written by this node or aggregator) are kept for the last `keep_rounds`
+  rounds, plus pinned checkpoints (every `pin_every` rounds, or pinned explicitly)
+- peer files (downloads) are evicted least recently used first once they take up more
+  than `max_cache_bytes`; files of the current round are never evicted
+
+Files that were in the directory before the store existed are left alone.
+"""
+
+import json
+import os
+import threading
+import time
+import uuid
+
+INDEX_FILE = "index.json"
+OWN = "own"
+PEER = "peer"
+
+
+class ModelStore:
+    def __init__(self, directory, keep_rounds=5, max_cache_bytes=1 << 30, pin_every=0, logger=None):
+        """
+        :param directory: Directory of the index's model files; created if missing.
+        :param keep_rounds: Rounds of own files to keep (at least 2, since the previous
+            aggregate is the base of delta-encoded updates).
+        :param max_cache_bytes: Size bound of the downloaded peer files.
+        :param pin_every: Keep the own files of every `pin_every`-th round (0 pins nothing).
+        """
+        self.directory = directory
+        self.keep_rounds = max(2, keep_rounds)
+        self.max_cache_bytes = max_cache_bytes
+        self.pin_every = pin_every
+        self.logger = logger
+
+        self._lock = threading.RLock()
+        self._entries = {} # {checksum: {'round_number', 'kind', 'size', 'pinned', 'last_access'}}
+        self._rounds = {} # {(kind, round_number): [checksum, ...]}
+        os.makedirs(directory, exist_ok=True)
+        self._load_index()
+
+    @classmethod
+    def from_env(cls, directory, logger=None):
+        return cls(
+            directory,
+            keep_rounds=int(os.getenv("MODEL_STORE_KEEP_ROUNDS", "5")),
+            max_cache_bytes=int(float(os.getenv("MODEL_STORE_CACHE_MB", "1024")) * (1 << 20)),
+            pin_every=int(os.getenv("MODEL_STORE_PIN_EVERY", "0")),
+            logger=logger
+        )
+
+    def path_of(self, checksum):
+        return os.path.join(self.directory, f"{checksum}.eflw")
+
+    def put(self, model_update, round_number, codec='none', shuffle=False):
+        """
+        Write an own model file for a round and apply the retention policy.
+
+        :param model_update: LocalModelUpdate to write.
+        :return: Path, size in bytes and hex SHA-256 checksum of the stored file.
+        :rtype: tuple
+        """
+        staging_path = os.path.join(self.directory, f".staging-{uuid.uuid4().hex}.eflw")
+        try:
+            size, checksum = model_update.save(staging_path, codec=codec, shuffle=shuffle)
+            path = self.path_of(checksum)
+            with self._lock:
+                if os.path.exists(path): # same content is already stored
+                    os.remove(staging_path)
+                else:
+                    os.replace(staging_path, path)
+                self._record(checksum, round_number, OWN, size)
+                self._apply_retention(round_number)
+        finally:
+            if os.path.exists(staging_path):
+                os.remove(staging_path)
+        return path, size, checksum
+
+    def add(self, checksum, round_number, kind=PEER):
+        """
+        Register a file that was placed at `path_of(checksum)`, e.g. a verified download.
+        """
+        size = os.path.getsize(self.path_of(checksum))
+        with self._lock:
+            self._record(checksum, round_number, kind, size)
+            self._apply_retention(round_number)
+
+    def lookup(self, checksum):
+        """
+        Path of the stored file with `checksum`, or None if it isn't stored.
+        """
+        with self._lock:
+            entry = self._entries.get(checksum)
+            if entry is None or not os.path.exists(self.path_of(checksum)):
+                return None
+            entry['last_access'] = time.time()
+            return self.path_of(checksum)
+
+    def lookup_round(self, round_number, kind=OWN):
+        """
+        Path of the most recently stored file of `kind` for a round, or None.
+        """
+        with self._lock:
+            for checksum in reversed(self._rounds.get((kind, round_number), [])):
+                path = self.lookup(checksum)
+                if path:
+                    return path
+            return None
+
+    def pin(self, checksum):
+        """
+        Keep a stored file regardless of the retention policy.
+        """
+        with self._lock:
+            if checksum in self._entries:
+                self._entries[checksum]['pinned'] = True
+                self._save_index()
+
+    def _record(self, checksum, round_number, kind, size):
+        entry = self._entries.get(checksum)
+        if entry is None:
+            entry = {'round_number': round_number, 'kind': kind, 'size': size, 'pinned': False}
+            self._entries[checksum] = entry
+        elif kind == OWN and entry['kind'] != OWN: # a file this process wrote is kept as its own
+            self._forget_round(checksum, entry)
+            entry['kind'], entry['round_number'] = OWN, round_number
+        entry['last_access'] = time.time()
+        if self.pin_every and kind == OWN and round_number % self.pin_every == 0:
+            entry['pinned'] = True
+        rounds = self._rounds.setdefault((entry['kind'], entry['round_number']), [])
+        if checksum not in rounds:
+            rounds.append(checksum)
+
+    def _apply_retention(self, current_round):
+        evicted = []
+        for checksum, entry in self._entries.items():
+            if entry['pinned'] or entry['kind'] != OWN:
+                continue
+            if entry['round_number'] <= current_round - self.keep_rounds:
+                evicted.append(checksum)
+
+        peers = sorted(
+            (entry['last_access'], checksum) for checksum, entry in self._entries.items()
+            if entry['kind'] == PEER and not entry['pinned'] and entry['round_number'] < current_round
+        )
+        cached = sum(entry['size'] for entry in self._entries.values() if entry['kind'] == PEER)
+        for _, checksum in peers:
+            if cached <= self.max_cache_bytes:
+                break
+            cached -= self._entries[checksum]['size']
+            evicted.append(checksum)
+
+        for checksum in evicted:
+            self._remove(checksum)
+        self._save_index()
+
+    def _forget_round(self, checksum, entry):
+        key = (entry['kind'], entry['round_number'])
+        if key in self._rounds:
+            self._rounds[key] = [c for c in self._rounds[key] if c != checksum]
+            if not self._rounds[key]:
+                del self._rounds[key]
+
+    def _remove(self, checksum):
+        entry = self._entries.pop(checksum)
+        self._forget_round(checksum, entry)
+        try:
+            os.remove(self.path_of(checksum))
+        except FileNotFoundError:
+            pass
+        except OSError as e:
+            if self.logger:
+                self.logger.warning(f"Unable to remove model file {self.path_of(checksum)}: {str(e)}")
+
+    def _load_index(self):
+        index_path = os.path.join(self.directory, INDEX_FILE)
+        if not os.path.exists(index_path):
+            return
+        try:
+            with open(index_path) as f:
+                entries = json.load(f)['entries']
+        except (OSError, ValueError, KeyError) as e:
+            if self.logger:
+                self.logger.warning(f"Ignoring unreadable model store index {index_path}: {str(e)}")
+            return
+        for checksum, entry in entries.items():
+            if os.path.exists(self.path_of(checksum)):
+                self._entries[checksum] = entry
+                self._rounds.setdefault((entry['kind'], entry['round_number']), []).append(checksum)
+
+    def _save_index(self):
+        index_path = os.path.join(self.directory, INDEX_FILE)
+        tmp_path = f"{index_path}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump({'entries': self._entries}, f)
+        os.replace(tmp_path, index_path)
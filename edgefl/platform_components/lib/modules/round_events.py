@@ -0,0 +1,119 @@
+"""
+Notifications that wake round listeners as soon as a relevant policy is inserted.
+
+The blockchain stays the source of truth: a notification only tells a listener to look
+now instead of at its next poll, and listeners keep polling at their usual interval in
+case a notification is lost. Two kinds of events exist:
+
+- round_start: the aggregator inserted the RoundStart policy of a round (pushed to nodes)
+- submodel:    a node inserted its submodel policy for a round (pushed to the aggregator)
+
+Events are pushed with `push_event` to the `/notify` endpoint of the aggregator and node
+servers, and can be awaited remotely through their `/events/{index}` long-poll endpoint.
+"""
+
+import asyncio
+import logging
+import threading
+
+import requests
+
+from platform_components.EdgeLake_functions import edgelake_client
+
+EVENT_KINDS = ('round_start', 'submodel')
+PUSH_TIMEOUT = 2 # seconds; pushes are best-effort
+
+logger = logging.getLogger(__name__)
+
+
+class RoundEvents:
+    """
+    Thread-safe counters of the events seen for each (index, kind, round_number).
+    """
+    def __init__(self):
+        self._condition = threading.Condition()
+        self._counts = {} # {(index, kind): {round_number: count}}
+        self._async_waiters = {} # {(index, kind): {(event loop, asyncio.Event), ...}}
+
+    def notify(self, index, kind, round_number):
+        """
+        Record an event and wake everyone waiting for it.
+
+        :raises ValueError: If `kind` is not one of EVENT_KINDS.
+        """
+        if kind not in EVENT_KINDS:
+            raise ValueError(f"Unknown event kind '{kind}'. Supported kinds: {', '.join(EVENT_KINDS)}")
+        with self._condition:
+            rounds = self._counts.setdefault((index, kind), {})
+            rounds[round_number] = rounds.get(round_number, 0) + 1
+            # Only the current and previous round are ever waited on
+            for old_round in [r for r in rounds if r < round_number - 1]:
+                del rounds[old_round]
+            self._condition.notify_all()
+            for loop, event in self._async_waiters.get((index, kind), ()):
+                loop.call_soon_threadsafe(event.set)
+
+    def count(self, index, kind, round_number):
+        with self._condition:
+            return self._counts.get((index, kind), {}).get(round_number, 0)
+
+    def wait(self, index, kind, round_number, seen=0, timeout=None):
+        """
+        Block until more than `seen` events arrived for the round, or until `timeout`.
+
+        :param seen: Number of events the caller already handled; pass the previous return value.
+        :param timeout: Seconds to wait at most (None waits forever).
+        :return: The number of events seen for the round so far.
+        :rtype: int
+        """
+        with self._condition:
+            self._condition.wait_for(lambda: self.count(index, kind, round_number) > seen, timeout)
+            return self.count(index, kind, round_number)
+
+    async def async_wait(self, index, kind, round_number, seen=0, timeout=None):
+        """
+        `wait` for coroutines: suspends instead of blocking a thread, so many indexes can wait on one event loop.
+        """
+        loop = asyncio.get_running_loop()
+        event = asyncio.Event()
+        waiter = (loop, event)
+        deadline = None if timeout is None else loop.time() + timeout
+        with self._condition:
+            self._async_waiters.setdefault((index, kind), set()).add(waiter)
+        try:
+            while True:
+                event.clear()
+                if self.count(index, kind, round_number) > seen:
+                    break
+                remaining = None if deadline is None else deadline - loop.time()
+                if remaining is not None and remaining <= 0:
+                    break
+                try:
+                    await asyncio.wait_for(event.wait(), remaining)
+                except asyncio.TimeoutError:
+                    break
+        finally:
+            with self._condition:
+                waiters = self._async_waiters.get((index, kind), set())
+                waiters.discard(waiter)
+                if not waiters:
+                    self._async_waiters.pop((index, kind), None)
+        return self.count(index, kind, round_number)
+
+
+def push_event(urls, index, kind, round_number, sender=None):
+    """
+    Notify the `/notify` endpoint of each server in `urls` in the background.
+
+    Failures are only logged; receivers fall back to polling.
+    """
+    payload = {'index': index, 'kind': kind, 'round_number': round_number, 'sender': sender}
+
+    def push(url):
+        try:
+            edgelake_client.post(f"{url}/notify", json=payload, timeout=PUSH_TIMEOUT, retries=0)
+        except requests.exceptions.RequestException as e:
+            logger.debug(f"[{index}] Unable to push {kind} event for round {round_number} to {url}: {str(e)}")
+
+    for url in urls:
+        threading.Thread(name=f"push--{url}", target=push, args=(url,), daemon=True).start()
@@ -0,0 +1,82 @@
+"""
+Background loading of the next round's training data on nodes.
+
+As soon as a node starts training round r of an index, the data of round r + 1 is
+requested from EdgeLake and decoded on a worker thread, so the SQL round trip and the
+decoding overlap with `fit` instead of preceding it. When round r + 1 starts, the
+prefetched data is handed to the data handler; if it isn't ready yet the node waits
+for it rather than issuing the same queries again.
+
+Data handlers opt in by setting `supports_prefetch = True`; their `load_dataset(node_name,
+round_number)` must then return the data without side effects on the handler, and their
+`train(round_number, dataset=None)` must use `dataset` when it is given.
+
+At most PREFETCH_DEPTH rounds are held per index, so memory stays bounded when rounds are
+skipped (e.g. in async mode). A failed prefetch is logged and the round loads its data
+itself.
+"""
+
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor, CancelledError
+
+
+class RoundPrefetcher:
+    def __init__(self, logger=None, depth=None, workers=None):
+        self.logger = logger
+        self.depth = max(1, int(depth if depth is not None else os.getenv("PREFETCH_DEPTH", "1")))
+        self._executor = ThreadPoolExecutor(max_workers=workers or 2, thread_name_prefix="node/prefetch")
+        self._lock = threading.Lock()
+        self._pending = {} # {index: {round_number: Future}}, oldest round first
+
+    def prefetch(self, index, round_number, load):
+        """
+        Start loading the data of `round_number` in the background.
+
+        :param load: Function called without arguments that returns the round's data.
+        :return: True if a load was started, False if one is already pending for that round.
+        """
+        with self._lock:
+            rounds = self._pending.setdefault(index, {})
+            if round_number in rounds:
+                return False
+            # Bounded: drop the oldest rounds, which are behind the one being prefetched now
+            while len(rounds) >= self.depth:
+                oldest = min(rounds)
+                rounds.pop(oldest).cancel()
+            rounds[round_number] = self._executor.submit(load)
+        if self.logger:
+            self.logger.debug(f"[{index}] Prefetching data of round {round_number}")
+        return True
+
+    def take(self, index, round_number):
+        """
+        Data prefetched for `round_number`, waiting for it if it is still loading.
+
+        Prefetches of earlier rounds are discarded.
+
+        :return: The round's data, or None if it wasn't prefetched or the prefetch failed.
+        """
+        with self._lock:
+            rounds = self._pending.get(index, {})
+            for old_round in [r for r in rounds if r < round_number]:
+                rounds.pop(old_round).cancel()
+            future = rounds.pop(round_number, None)
+        if future is None:
+            return None
+        try:
+            return future.result()
+        except CancelledError:
+            return None
+        except Exception as e:
+            if self.logger:
+                self.logger.warning(f"[{index}] Prefetch of round {round_number} failed, loading it again: {str(e)}")
+            return None
+
+    def cancel(self, index):
+        """
+        Drop everything prefetched for `index`; loads already running finish, but their data is discarded.
+        """
+        with self._lock:
+            for future in self._pending.pop(index, {}).values():
+                future.cancel()
@@ -0,0 +1,108 @@
+"""
+Long-lived scheduler for the training runs of an aggregator's indexes.
+
+Each index's run is a task on the server's own event loop (the uvicorn loop), so runs
+of many indexes share one loop and its connections instead of a thread and a fresh
+event loop per round. Blocking work inside a run (EdgeLake calls, downloads, fusing)
+is expected to be handed to worker threads with `asyncio.to_thread`.
+
+The scheduler keeps a state dict for every index that a run updates as it goes:
+
+- status:       running, completed, cancelled or failed
+- round_number: round in progress (or the last one, once the run ended)
+- end_round:    last round of the run
+- phase:        step of the current round, e.g. starting, collecting, aggregating
+- submodels:    submodels collected for the current round so far
+- started_at / ended_at: UNIX timestamps
+- error:        message of the exception that failed the run
+
+Cancelling a run interrupts it at its next await; work already handed to a thread
+finishes in the background, but its result is discarded.
+"""
+
+import asyncio
+import time
+
+RUNNING = "running"
+COMPLETED = "completed"
+CANCELLED = "cancelled"
+FAILED = "failed"
+
+
+class RoundScheduler:
+    def __init__(self, logger=None):
+        self.logger = logger
+        self._tasks = {} # {index: asyncio.Task}
+        self._states = {} # {index: state dict}
+
+    def is_running(self, index):
+        task = self._tasks.get(index)
+        return task is not None and not task.done()
+
+    def start(self, index, run, starting_round, end_round):
+        """
+        Schedule a training run of `index` on the running event loop.
+
+        :param run: Coroutine function called with the run's state dict; it updates the
+            state while it runs and returns once training finished.
+        :return: The state dict of the run.
+        :raises RuntimeError: If a run of `index` is already in progress.
+        """
+        if self.is_running(index):
+            raise RuntimeError(f"Training is already in progress at index {index}")
+        state = {
+            'index': index,
+            'status': RUNNING,
+            'round_number': starting_round,
+            'end_round': end_round,
+            'phase': 'starting',
+            'submodels': 0,
+            'started_at': time.time(),
+            'ended_at': None,
+            'error': None,
+        }
+        self._states[index] = state
+        self._tasks[index] = asyncio.get_running_loop().create_task(self._run(run, state), name=f"agg/training--{index}")
+        return state
+
+    async def _run(self, run, state):
+        index = state['index']
+        try:
+            await run(state)
+            state['status'] = COMPLETED
+        except asyncio.CancelledError:
+            state['status'] = CANCELLED
+            if self.logger:
+                self.logger.info(f"[{index}] Training cancelled in round {state['round_number']}")
+        except Exception as e:
+            state['status'] = FAILED
+            state['error'] = str(e)
+            if self.logger:
+                self.logger.error(f"[{index}] Training failed in round {state['round_number']}: {str(e)}")
+        finally:
+            state['ended_at'] = time.time()
+
+    async def cancel(self, index):
+        """
+        Cancel the run of `index` and wait until it stopped.
+
+        :return: True if a run was in progress.
+        """
+        if not self.is_running(index):
+            return False
+        task = self._tasks[index]
+        task.cancel()
+        await asyncio.gather(task, return_exceptions=True)
+        return True
+
+    async def cancel_all(self):
+        for index in list(self._tasks):
+            await self.cancel(index)
+
+    def get_state(self, index):
+        """Copy of the state of the last run of `index`, or None if it never trained."""
+        state = self._states.get(index)
+        return dict(state) if state is not None else None
+
+    def get_states(self):
+        return {index: dict(state) for index, state in self._states.items()}
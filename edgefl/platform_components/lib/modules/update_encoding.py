@@ -0,0 +1,167 @@
+"""
+Encodings for the model updates nodes send to the aggregator.
+
+Every round starts from the aggregated model a node just downloaded, so instead of the
+full weights a node can send the change against it:
+
+- full:  the weights as they are (default)
+- delta: local - global for every float layer
+- topk:  the delta sparsified to its largest `topk_ratio` fraction of entries, with the
+         rest carried over to the next round (error feedback) so nothing is lost
+- quantization (int8 / int16) can be applied on top of any of them, per layer with a
+  symmetric scale
+
+The encoded arrays are stored in a weights file together with the metadata returned by
+`UpdateEncoder.encode`; `decode_update` rebuilds full weights from it and the global model
+of the round it was trained on.
+"""
+
+import math
+
+import numpy as np
+
+UPDATE_ENCODINGS = ('full', 'delta', 'topk')
+QUANTIZATIONS = {'none': None, 'int8': np.int8, 'int16': np.int16}
+
+
+class UpdateEncoder:
+    """
+    Encodes one node's updates for an index, keeping the top-k error feedback between rounds.
+    """
+    def __init__(self, encoding='full', topk_ratio=0.01, quantization='none'):
+        if encoding not in UPDATE_ENCODINGS:
+            raise ValueError(f"Unknown update encoding '{encoding}'. Supported encodings: {', '.join(UPDATE_ENCODINGS)}")
+        if quantization not in QUANTIZATIONS:
+            raise ValueError(f"Unknown quantization '{quantization}'. Supported: {', '.join(QUANTIZATIONS)}")
+        if encoding == 'topk' and not 0 < topk_ratio <= 1:
+            raise ValueError(f"topk_ratio must be in (0, 1], got {topk_ratio}")
+
+        self.encoding = encoding
+        self.topk_ratio = topk_ratio
+        self.quantization = quantization
+        self.residuals = None # top-k error feedback, one flat array per layer
+
+    def encode(self, local_weights, global_weights, base_round):
+        """
+        Encode trained weights against the global model they started from.
+
+        :param local_weights: Per-layer weights after local training.
+        :param global_weights: Per-layer weights of the global model of `base_round`, or None
+            if the node did not start from one (e.g. the first round), in which case the
+            layers are sent in full.
+        :param base_round: Round whose global model `global_weights` is.
+        :return: The arrays to store and the metadata needed to decode them.
+        :rtype: tuple
+        """
+        local_weights = [np.asarray(layer) for layer in local_weights]
+        encoding = self.encoding if global_weights is not None else 'full'
+        if global_weights is not None and len(global_weights) != len(local_weights):
+            raise ValueError(f"Expected {len(global_weights)} layers, got {len(local_weights)}")
+        if encoding == 'topk' and (self.residuals is None or len(self.residuals) != len(local_weights)):
+            self.residuals = [None] * len(local_weights)
+
+        arrays, layers = [], []
+        for i, local in enumerate(local_weights):
+            is_float = np.issubdtype(local.dtype, np.floating)
+            mode = encoding if is_float else 'full'
+            if mode == 'full':
+                values = local
+            else:
+                values = local - np.asarray(global_weights[i], dtype=local.dtype)
+
+            layer = {'mode': mode, 'shape': list(local.shape), 'dtype': local.dtype.str}
+            if mode == 'topk':
+                accumulated = values.reshape(-1)
+                if self.residuals[i] is not None:
+                    accumulated = accumulated + self.residuals[i]
+                indices = _top_k_indices(accumulated, self.topk_ratio)
+                values = accumulated[indices]
+                arrays.append(indices)
+
+            transmitted = values
+            if is_float and self.quantization != 'none':
+                values, scale = _quantize(values, QUANTIZATIONS[self.quantization])
+                transmitted = values * local.dtype.type(scale)
+                layer['scale'] = scale
+
+            if mode == 'topk':
+                # Whatever was not sent this round (unselected entries and quantization error) is sent later
+                residual = accumulated.copy()
+                residual[indices] -= transmitted
+                self.residuals[i] = residual
+
+            arrays.append(values)
+            layers.append(layer)
+
+        metadata = {
+            'update_encoding': encoding,
+            'base_round': base_round,
+            'encoded_layers': layers,
+        }
+        return arrays, metadata
+
+
+def _top_k_indices(values, ratio):
+    size = values.size
+    k = min(size, max(1, math.ceil(ratio * size)))
+    if k == size:
+        indices = np.arange(size)
+    else:
+        indices = np.argpartition(np.abs(values), size - k)[size - k:]
+    return np.sort(indices).astype(np.int64 if size > np.iinfo(np.int32).max else np.int32)
+
+
+def _quantize(values, dtype):
+    limit = np.iinfo(dtype).max
+    peak = float(np.max(np.abs(values))) if values.size else 0.0
+    scale = peak / limit if peak > 0 else 1.0
+    return np.clip(np.rint(values / scale), -limit, limit).astype(dtype), scale
+
+
+def decode_update(update, base_weights):
+    """
+    Rebuild full per-layer weights from an encoded update.
+
+    :param update: LocalModelUpdate read from a node's weights file.
+    :param base_weights: Global weights of the update's base round; only needed for delta/topk layers.
+    :return: The node's full weights.
+    :raises ValueError: If the update needs base weights that were not provided or don't match.
+    """
+    arrays = update.get('weights')
+    if not update.exist_key('encoded_layers'): # sent as plain weights
+        return arrays
+
+    layers = update.get('encoded_layers')
+    if any(layer['mode'] != 'full' for layer in layers):
+        if base_weights is None:
+            raise ValueError(f"Update is encoded against round {update.get('base_round')}, whose global model is unavailable")
+        if len(base_weights) != len(layers):
+            raise ValueError(f"Expected {len(layers)} base layers, got {len(base_weights)}")
+
+    weights = []
+    position = 0
+    for i, layer in enumerate(layers):
+        dtype = np.dtype(layer['dtype'])
+        shape = tuple(layer['shape'])
+        if layer['mode'] == 'topk':
+            indices = arrays[position]
+            position += 1
+        values = arrays[position]
+        position += 1
+        if 'scale' in layer:
+            values = values.astype(dtype) * dtype.type(layer['scale'])
+
+        if layer['mode'] == 'full':
+            weights.append(np.asarray(values, dtype=dtype).reshape(shape))
+            continue
+
+        base = np.asarray(base_weights[i])
+        if base.shape != shape:
+            raise ValueError(f"Base layer shape mismatch: expected {shape}, got {base.shape}")
+        if layer['mode'] == 'delta':
+            weights.append((base + values.reshape(shape)).astype(dtype, copy=False))
+        else:
+            restored = np.array(base, dtype=dtype).reshape(-1)
+            restored[indices] += values
+            weights.append(restored.reshape(shape))
+    return weights
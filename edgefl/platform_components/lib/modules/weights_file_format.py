@@ -0,0 +1,299 @@
+"""
+Binary file format for model weights exchanged between nodes and the aggregator.
+
+Layout (all integers little-endian)::
+
+    magic        4 bytes   b"EFLW"
+    version      uint16
+    flags        uint16    reserved, 0
+    header_len   uint32
+    header       header_len bytes of UTF-8 JSON
+    padding      up to the next ALIGNMENT boundary
+    tensors      C-ordered layer bytes, each starting on an ALIGNMENT boundary
+    checksum     32 bytes, SHA-256 of everything before it
+
+The JSON header lists every layer's name, shape, dtype (with byte order, e.g. "<f4"),
+absolute byte offset and stored size, plus a flat metadata dict of JSON values (e.g.
+num_samples). Uncompressed files (codec "none") hold raw tensor bytes, so readers can
+map the file and view layers in place without copying or unpickling anything. With a
+compression codec, each layer is compressed on its own, optionally byte-shuffled first.
+
+Version 1 files (no codec fields) are read as uncompressed.
+"""
+
+import hashlib
+import io
+import json
+import os
+import struct
+
+import numpy as np
+
+from platform_components.lib.modules.compression import get_codec, byte_shuffle, byte_unshuffle
+
+MAGIC = b"EFLW"
+FORMAT_VERSION = 2
+ALIGNMENT = 64
+CHECKSUM_SIZE = hashlib.sha256().digest_size
+
+_PREAMBLE = struct.Struct("<4sHHI")
+_HASH_CHUNK_SIZE = 1 << 20
+
+
+class WeightsFileError(ValueError):
+    """Raised when a weights file is malformed, unsupported or fails its checksum."""
+
+
+def _align(offset):
+    return (offset + ALIGNMENT - 1) // ALIGNMENT * ALIGNMENT
+
+
+def _layer_name(layer, position):
+    # Keras variables carry a path/name; plain arrays are named by position
+    return str(getattr(layer, "path", None) or getattr(layer, "name", None) or position)
+
+
+def _build_header(layers, names, payloads, metadata, codec, shuffle):
+    entries = []
+    offset = 0  # relative to the start of the tensor section, fixed up below
+    for name, layer, payload in zip(names, layers, payloads):
+        offset = _align(offset)
+        entries.append({
+            "name": name,
+            "shape": list(layer.shape),
+            "dtype": layer.dtype.str,
+            "offset": offset,
+            "nbytes": layer.nbytes,
+            "stored_nbytes": len(payload),
+        })
+        offset += len(payload)
+
+    # The header length depends on the absolute offsets, which depend on the header
+    # length; iterate until the size of the encoded header stops changing.
+    data_start = 0
+    while True:
+        header = {
+            "codec": codec,
+            "shuffle": shuffle,
+            "layers": [dict(entry, offset=entry["offset"] + data_start) for entry in entries],
+            "metadata": metadata,
+        }
+        encoded = json.dumps(header, separators=(",", ":")).encode("utf-8")
+        new_data_start = _align(_PREAMBLE.size + len(encoded))
+        if new_data_start == data_start:
+            return encoded, data_start, data_start + offset
+        data_start = new_data_start
+
+
+def _layer_payload(layer, codec, shuffle):
+    if codec.name == "none":
+        return memoryview(layer.reshape(-1).view(np.uint8))
+    data = byte_shuffle(layer) if shuffle else layer.tobytes()
+    return codec.compress(data)
+
+
+def write_weights(fileobj, weights, metadata=None, codec="none", shuffle=False):
+    """
+    Write weights and metadata to a binary file object.
+
+    :param fileobj: Writable binary file object.
+    :param weights: List of per-layer arrays (or array-likes).
+    :param metadata: Dict of JSON-serializable values stored in the header.
+    :param codec: Name of the compression codec applied to each layer.
+    :param shuffle: Byte-shuffle each layer before compressing it (ignored for codec "none").
+    :return: Total bytes written and the hex SHA-256 of the written bytes.
+    :rtype: tuple
+    :raises WeightsFileError: If a layer or the metadata can't be represented.
+    """
+    names = [_layer_name(layer, i) for i, layer in enumerate(weights)]
+    layers = [np.asarray(layer, order="C") for layer in weights]
+    for name, layer in zip(names, layers):
+        if layer.dtype.hasobject:
+            raise WeightsFileError(f"Layer {name} has unsupported dtype {layer.dtype}")
+
+    codec = get_codec(codec)
+    shuffle = bool(shuffle) and codec.name != "none"
+    payloads = [_layer_payload(layer, codec, shuffle) for layer in layers]
+
+    try:
+        header, data_start, data_end = _build_header(layers, names, payloads, metadata or {}, codec.name, shuffle)
+    except TypeError as e:
+        raise WeightsFileError(f"Metadata is not JSON serializable: {str(e)}")
+
+    digest = hashlib.sha256()
+
+    def emit(chunk):
+        fileobj.write(chunk)
+        digest.update(chunk)
+
+    emit(_PREAMBLE.pack(MAGIC, FORMAT_VERSION, 0, len(header)))
+    emit(header)
+    position = _PREAMBLE.size + len(header)
+    for payload in payloads:
+        padding = _align(position) - position
+        if padding:
+            emit(b"\0" * padding)
+        if len(payload):
+            emit(payload)
+        position += padding + len(payload)
+
+    checksum = digest.digest()
+    fileobj.write(checksum)
+    return data_end + CHECKSUM_SIZE, digest.hexdigest()
+
+
+def save_weights(path, weights, metadata=None, codec="none", shuffle=False):
+    """
+    Atomically write a weights file to `path`.
+
+    The file is written next to its destination and renamed into place, so readers
+    never observe a partially written file.
+
+    :return: File size in bytes and the hex SHA-256 of the file's contents before the checksum.
+    :rtype: tuple
+    """
+    tmp_path = f"{path}.tmp"
+    try:
+        with open(tmp_path, "wb") as f:
+            result = write_weights(f, weights, metadata, codec, shuffle)
+        os.replace(tmp_path, path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+    return result
+
+
+def pack_weights(weights, metadata=None, codec="none", shuffle=False):
+    """
+    Encode weights and metadata into bytes in the weights file format.
+    """
+    buffer = io.BytesIO()
+    write_weights(buffer, weights, metadata, codec, shuffle)
+    return buffer.getvalue()
+
+
+def _parse(buffer):
+    size = len(buffer)
+    if size < _PREAMBLE.size + CHECKSUM_SIZE:
+        raise WeightsFileError("Weights file is truncated")
+
+    magic, version, _, header_len = _PREAMBLE.unpack(bytes(buffer[:_PREAMBLE.size]))
+    if magic != MAGIC:
+        raise WeightsFileError("Not a weights file (bad magic)")
+    if version > FORMAT_VERSION:
+        raise WeightsFileError(f"Unsupported weights file version {version}")
+
+    header_end = _PREAMBLE.size + header_len
+    if header_end > size - CHECKSUM_SIZE:
+        raise WeightsFileError("Weights file header is truncated")
+    try:
+        header = json.loads(bytes(buffer[_PREAMBLE.size:header_end]).decode("utf-8"))
+    except ValueError as e:
+        raise WeightsFileError(f"Weights file header is corrupt: {str(e)}")
+
+    try:
+        codec = get_codec(header.get("codec", "none"))
+    except ValueError as e:
+        raise WeightsFileError(str(e))
+    shuffle = header.get("shuffle", False)
+
+    layers = []
+    for entry in header["layers"]:
+        dtype = np.dtype(entry["dtype"])
+        if dtype.hasobject:
+            raise WeightsFileError(f"Layer {entry['name']} has unsupported dtype {dtype}")
+        start, nbytes = entry["offset"], entry["nbytes"]
+        stored_nbytes = entry.get("stored_nbytes", nbytes)
+        shape = tuple(entry["shape"])
+        if start < header_end or start + stored_nbytes > size - CHECKSUM_SIZE \
+                or nbytes != dtype.itemsize * int(np.prod(shape, dtype=np.int64)):
+            raise WeightsFileError(f"Layer {entry['name']} lies outside the tensor section")
+
+        stored = buffer[start:start + stored_nbytes]
+        if codec.name == "none":
+            # Views into the buffer, no copy
+            layers.append(stored.view(dtype).reshape(shape))
+            continue
+
+        try:
+            raw = codec.decompress(stored, nbytes) if stored_nbytes else b""
+        except Exception as e:
+            raise WeightsFileError(f"Layer {entry['name']} failed to decompress: {str(e)}")
+        if len(raw) != nbytes:
+            raise WeightsFileError(f"Layer {entry['name']} decompressed to {len(raw)} bytes, expected {nbytes}")
+        layer = byte_unshuffle(raw, dtype) if shuffle else np.frombuffer(raw, dtype=dtype)
+        layers.append(layer.reshape(shape))
+
+    return layers, header.get("metadata", {})
+
+
+def _verify(buffer):
+    digest = hashlib.sha256()
+    end = len(buffer) - CHECKSUM_SIZE
+    for start in range(0, end, _HASH_CHUNK_SIZE):
+        digest.update(buffer[start:min(start + _HASH_CHUNK_SIZE, end)])
+    if digest.digest() != bytes(buffer[end:]):
+        raise WeightsFileError("Weights file checksum mismatch")
+
+
+def check_weights_file(path, content_length=None, checksum=None):
+    """
+    Check that the file at `path` is the complete file a writer announced.
+
+    Only the size and the stored checksum are compared, which is cheap; reading the file
+    with verification on then confirms its contents match that checksum.
+
+    :param content_length: Expected size in bytes, as returned by `save_weights` (None or 0 skips the check).
+    :param checksum: Expected hex SHA-256, as returned by `save_weights` (None or "" skips the check).
+    :raises WeightsFileError: If the file is missing, incomplete or a different file.
+    """
+    if not os.path.exists(path):
+        raise WeightsFileError(f"Weights file {path} does not exist")
+    size = os.path.getsize(path)
+    if content_length and size != content_length:
+        raise WeightsFileError(f"Weights file {path} has {size} bytes, expected {content_length}")
+    if checksum:
+        if size < CHECKSUM_SIZE:
+            raise WeightsFileError(f"Weights file {path} is truncated")
+        with open(path, "rb") as f:
+            f.seek(size - CHECKSUM_SIZE)
+            stored = f.read(CHECKSUM_SIZE).hex()
+        if stored != checksum:
+            raise WeightsFileError(f"Weights file {path} has checksum {stored}, expected {checksum}")
+
+
+def unpack_weights(data, verify=True):
+    """
+    Decode bytes in the weights file format.
+
+    :param data: Encoded bytes (or any buffer).
+    :param verify: Check the trailing checksum before decoding.
+    :return: List of read-only per-layer arrays viewing `data`, and the metadata dict.
+    :rtype: tuple
+    :raises WeightsFileError: If the data is malformed or fails verification.
+    """
+    buffer = np.frombuffer(data, dtype=np.uint8)
+    if verify:
+        _verify(buffer)
+    return _parse(buffer)
+
+
+def load_weights(path, mmap=True, verify=True):
+    """
+    Read a weights file.
+
+    :param path: Path of the weights file.
+    :param mmap: Memory-map the file so layers are paged in on demand instead of copied into memory.
+    :param verify: Check the trailing checksum before decoding.
+    :return: List of read-only per-layer arrays and the metadata dict.
+    :rtype: tuple
+    :raises WeightsFileError: If the file is malformed or fails verification.
+    """
+    if mmap and os.path.getsize(path) > 0:
+        buffer = np.memmap(path, dtype=np.uint8, mode="r")
+    else:
+        with open(path, "rb") as f:
+            buffer = np.frombuffer(f.read(), dtype=np.uint8)
+    if verify:
+        _verify(buffer)
+    return _parse(buffer)
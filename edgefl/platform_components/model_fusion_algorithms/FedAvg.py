@@ -1,10 +1,83 @@
 
 import numpy as np
 
-# Takes in a list of ModelUpdates and returns new weights
+# Takes in a list of ModelUpdates and returns new weights, weighted by each model's sample count
 def FedAvg_aggregate(models : list):
     my_weights = [d.get('weights') for d in models]
-    fed_max = [np.average(np.stack(layer_weights), axis=0) for layer_weights in zip(*my_weights)]
-    return fed_max
+    sample_counts = get_sample_counts(models)
+    fed_avg = [np.average(np.stack(layer_weights), axis=0, weights=sample_counts) for layer_weights in zip(*my_weights)]
+    return fed_avg
 
 
+def get_sample_counts(models : list):
+    """
+    Returns the sample count of each model as the weights of the average.
+
+    Models that did not report a count contribute with unit weight, so when no node
+    reports one this is a plain average.
+    """
+    counts = [d.get('num_samples') if d.exist_key('num_samples') else 0 for d in models]
+    return np.array([count or 1 for count in counts], dtype=np.float64)
+
+
+class StreamingFedAvg:
+    """
+    Incremental FedAvg that folds node updates in as soon as they are decoded.
+
+    A running weighted sum is kept per layer in float buffers that are allocated
+    once, on the first update. Peak memory is therefore the size of the buffers
+    plus the update currently being folded, independent of the number of nodes.
+    """
+    def __init__(self):
+        self.sums = None
+        self.dtypes = None
+        self.total_weight = 0.0
+        self.count = 0
+
+    def fold(self, weights, weight=1.0):
+        """
+        Add one node's weights to the running sum.
+
+        :param weights: List of per-layer arrays (or array-likes) of a single model.
+        :param weight: Contribution of this model to the average.
+        :raises ValueError: If the layer layout differs from previously folded models.
+        """
+        if weight <= 0:
+            raise ValueError(f"Update weight must be positive, got {weight}")
+
+        layers = [np.asarray(layer) for layer in weights]
+        if self.sums is None:
+            self.dtypes = [layer.dtype for layer in layers]
+            # Accumulate at the layer's own float precision so the buffers are the size of one model
+            self.sums = [np.zeros(layer.shape, dtype=np.promote_types(layer.dtype, np.float32)) for layer in layers]
+
+        # Validate the whole update first so a bad one never leaves a partial sum behind
+        if len(layers) != len(self.sums):
+            raise ValueError(f"Expected {len(self.sums)} layers, got {len(layers)}")
+        for buffer, layer in zip(self.sums, layers):
+            if layer.shape != buffer.shape:
+                raise ValueError(f"Layer shape mismatch: expected {buffer.shape}, got {layer.shape}")
+
+        for buffer, layer in zip(self.sums, layers):
+            if weight == 1.0:
+                np.add(buffer, layer, out=buffer)
+            else:
+                buffer += np.multiply(layer, weight, dtype=buffer.dtype)
+
+        self.total_weight += weight
+        self.count += 1
+
+    def result(self):
+        """
+        Returns the weighted average of all folded models, cast back to the layer dtypes.
+        """
+        if not self.count:
+            raise ValueError("No model updates have been folded")
+        return [(buffer / self.total_weight).astype(dtype, copy=False)
+                for buffer, dtype in zip(self.sums, self.dtypes)]
+
+    def reset(self):
+        self.sums = None
+        self.dtypes = None
+        self.total_weight = 0.0
+        self.count = 0
@@ -3,19 +3,30 @@ This Source Code Form is subject to the terms of the Mozilla Public
 License, v. 2.0. If a copy of the MPL was not distributed with this
 file, You can obtain one at http://mozilla.org/MPL/2.0/
 """
-import gzip
 import logging
 import os
-import pickle
-from asyncio import sleep
+import threading
+import time
 
 # import numpy as np
 
-from platform_components.EdgeLake_functions.blockchain_EL_functions import insert_policy, check_policy_inserted, \
-    get_policies
+from platform_components.EdgeLake_functions.blockchain_EL_functions import get_policies
+from platform_components.EdgeLake_functions.policy_cache import PolicyCache
+from platform_components.EdgeLake_functions.policies import InitPolicy, SubmodelPolicy
+from platform_components.EdgeLake_functions.policy_writer import PolicyWriter
+from platform_components.EdgeLake_functions.edgelake_client import backoff_delay
 from platform_components.EdgeLake_functions.mongo_file_store import copy_file_to_container, create_directory_in_container
 from platform_components.EdgeLake_functions.mongo_file_store import read_file, write_file, copy_file_from_container
 from platform_components.helpers.LoadClassFromFile import load_class_from_file
+from platform_components.lib.modules.local_model_update import LocalModelUpdate
+from platform_components.lib.modules.weights_file_format import check_weights_file
+from platform_components.lib.modules.model_store import ModelStore
+from platform_components.lib.modules.evaluation_cache import EvaluationCache
+from platform_components.lib.modules.compute_executor import ComputeExecutor
+from platform_components.lib.modules.inference_dispatcher import InferenceDispatcher
+from platform_components.lib.modules.round_prefetcher import RoundPrefetcher
+from platform_components.lib.modules.compression import is_codec_available
+from platform_components.lib.modules.update_encoding import UpdateEncoder
 
 from dotenv import load_dotenv
 load_dotenv()
@@ -26,6 +37,12 @@ class Node:
         self.github_dir = os.getenv('GITHUB_DIR')
         self.edgelake_node_url = f'http://{os.getenv("EXTERNAL_IP")}'
         self.edgelake_tcp_node_ip_port = f'{os.getenv("EXTERNAL_TCP_IP_PORT")}'
+        self.policy_cache = PolicyCache(self.edgelake_node_url, logger) # RoundStart policies seen so far
+        self.policy_writer = PolicyWriter(self.edgelake_node_url, logger) # idempotent, batch-confirmed policy inserts
+        self.prefetcher = RoundPrefetcher(logger) # loads the next round's data while the current round trains
+        self.evaluations = EvaluationCache(logger) # /inference results of each index's current model
+        self.compute = ComputeExecutor(logger) # runs all model work (training, evaluation, inference)
+        self.inference_dispatcher = InferenceDispatcher(logger, executor=self.compute) # batches concurrent /infer requests
 
         self.replica_name = replica_name
         self.node_ip = ip
@@ -40,6 +57,15 @@ class Node:
         # self.replica_names = {}
         self.data_batches = {} # {'index1': [], 'index2': [], ...}
         self.round_number = {}
+        self.aggregator_urls = {} # aggregator server each index pushes its submodel events to
+        self.parents = {} # aggregator that initialized each index, named as parent in the submodels
+        self.num_samples = {} # samples used in the last training round, published with the submodel
+        self.model_files = {} # (content_length, checksum) of the last submodel file, published with the submodel
+        self.model_stores = {} # ModelStore of the model files at each index
+        self.model_locks = {} # held while the model of an index is trained or evaluated
+        self.index_policies = {} # init policy of each index, cached once the aggregator has inserted it
+        self.codecs = {} # (codec, byte_shuffle) for model files at each index, read from its init policy
+        self.update_encoders = {} # UpdateEncoder for the submodels at each index, configured by its init policy
 
         self.module_names = {}
         self.module_paths = {}
@@ -53,6 +79,10 @@ class Node:
         self.docker_file_write_destination = None
         # =====
 
+        self.fetch_retries = int(os.getenv("FETCH_RETRIES", "3"))
+        # Seconds to wait for a policy to be confirmed, as long as a transfer with all its retries
+        self.policy_write_timeout = float(os.getenv("FETCH_TIMEOUT", "60")) * (self.fetch_retries + 1)
+
         if os.getenv("EDGELAKE_DOCKER_RUNNING").lower() == "false":
             self.docker_running = False
         else:
@@ -78,6 +108,9 @@ class Node:
         if not os.path.exists(os.path.join(self.tmp_dir, index)):
             os.makedirs(os.path.join(self.tmp_dir, index), exist_ok=True)
 
+        if index not in self.model_stores:
+            self.model_stores[index] = ModelStore.from_env(os.path.join(self.file_write_destination, index), self.logger)
+
         if self.docker_running:
             self.docker_file_write_destination = os.path.join(os.getenv("DOCKER_FILE_WRITE_DESTINATION"), self.replica_name)
             self.docker_container_name = os.getenv("EDGELAKE_DOCKER_CONTAINER_NAME")
@@ -148,7 +181,67 @@ class Node:
         if len(policies) > 1: # dev check
             raise Exception(f"Multiple instances of index {index} found in the blockchain")
 
-        return policies[0] # attributes: name, module_name, module_path, id, date, ledger
+        return InitPolicy.parse(index, policies[0]) # attributes: name, module_name, module_path, codec, ..., id, date, ledger
+
+    # Init policy of the index, or None if the aggregator hasn't inserted it yet (then asked again next time)
+    def get_index_policy(self, index):
+        if index not in self.index_policies:
+            index_data = self.get_index_data_in_blockchain(index)
+            if not index_data:
+                return None
+            self.index_policies[index] = index_data
+        return self.index_policies[index]
+
+    # Round mode the aggregator recorded in the index's init policy; indexes initialized before it existed are sync
+    def get_round_mode(self, index):
+        index_data = self.get_index_policy(index)
+        return index_data.get('round_mode', 'sync') if index_data else 'sync'
+
+    # Codec the aggregator recorded in the index's init policy; files are self-describing, so this only matters for writing
+    def get_transfer_codec(self, index):
+        if index in self.codecs:
+            return self.codecs[index]
+
+        try:
+            index_data = self.get_index_policy(index)
+        except Exception as e:
+            self.logger.warning(f"[{index}] Unable to read the index's codec, sending uncompressed: {str(e)}")
+            return 'none', False
+        if not index_data: # init policy not inserted yet; try again next round
+            return 'none', False
+
+        codec = index_data.get('codec', 'none')
+        byte_shuffle = str(index_data.get('byte_shuffle', 'false')).lower() == 'true'
+        if not is_codec_available(codec):
+            self.logger.error(f"[{index}] Codec '{codec}' is not installed on this node, sending uncompressed")
+            codec, byte_shuffle = 'none', False
+        self.codecs[index] = (codec, byte_shuffle)
+        return self.codecs[index]
+
+    # Update encoding the aggregator recorded in the index's init policy; full weights until it can be read
+    def get_update_encoder(self, index):
+        if index in self.update_encoders:
+            return self.update_encoders[index]
+
+        try:
+            index_data = self.get_index_policy(index)
+        except Exception as e:
+            self.logger.warning(f"[{index}] Unable to read the index's update encoding, sending full weights: {str(e)}")
+            return UpdateEncoder()
+        if not index_data:
+            return UpdateEncoder()
+
+        try:
+            encoder = UpdateEncoder(
+                encoding=index_data.get('update_encoding', 'full'),
+                topk_ratio=float(index_data.get('topk_ratio', 0.01)),
+                quantization=index_data.get('quantization', 'none')
+            )
+        except ValueError as e:
+            self.logger.error(f"[{index}] Invalid update encoding in the init policy, sending full weights: {str(e)}")
+            encoder = UpdateEncoder()
+        self.update_encoders[index] = encoder
+        return encoder
 
     '''
     add_data_batch(data)
@@ -165,29 +258,22 @@ class Node:
     '''
     def add_node_params(self, round_number, model_metadata, index):
         self.logger.debug(f"[{index}] in add_node_params")
+        # Lets the aggregator tell a complete download of this exact file from a partial or stale one
+        content_length, checksum = self.model_files.get(index, (0, ''))
         try:
-            data = f'''<my_policy = {{"{index}" : {{
-                                "node" : "{self.replica_name}",
-                                "round_number" : {round_number},
-                                "policy_type": "submodel",
-                                "index": "{index}",
-                                "node_type": "training",
-                                "ip_port": "{self.edgelake_tcp_node_ip_port}", 
-                                "rest_ip_port": "{self.edgelake_node_url}",                              
-                                "trained_params_local_path": "{model_metadata}"
-            }} }}>'''
-
-            success = False
-            while not success:
-                self.logger.debug(f"[{index}] Attempting insert")
-                response = insert_policy(self.edgelake_node_url, data)
-                if response.status_code == 200:
-                    success = True
-                else:
-                    # sleep(np.random.randint(5,15))
-                    sleep(5)
-                    if check_policy_inserted(self.edgelake_node_url, data):
-                        success = True
+            self.policy_writer.write(SubmodelPolicy(
+                index,
+                node=self.replica_name,
+                round_number=round_number,
+                index=index,
+                ip_port=self.edgelake_tcp_node_ip_port,
+                rest_ip_port=self.edgelake_node_url,
+                trained_params_local_path=model_metadata,
+                num_samples=self.num_samples.get(index, 0),
+                content_length=content_length,
+                checksum=checksum,
+                parent=self.parents.get(index, '')
+            ), timeout=self.policy_write_timeout)
 
             self.logger.debug(f"[{index}] Submitting results for round {round_number}")
             # response = requests.post(self.edgelake_node_url, headers=headers, data=data)
@@ -197,6 +283,13 @@ class Node:
                 'status': 'success',
                 'message': 'node model parameters added successfully'
             }
+        except TimeoutError as e:
+            # Not confirmed in time (EdgeLake node down or overloaded); it may still be written later
+            self.logger.error(f"[{index}] SubmodelPolicy not confirmed on the blockchain: {str(e)}")
+            return {
+                'status': 'error',
+                'message': str(e)
+            }
         except Exception as e: # TODO: raise an actual Error
             return {
                 'status': 'error',
@@ -208,57 +301,70 @@ class Node:
         - Uses updated aggregator model params and updates local model
         - Gets local data and runs training on updated model
     '''
-    def train_model_params(self, aggregator_model_params_db_link, round_number, ip_ports, rest_ip_port, index):
+    def train_model_params(self, aggregator_model_params_db_link, round_number, ip_ports, rest_ip_port, index,
+                           content_length=0, checksum=''):
         self.logger.debug(f"[{index}] in train_model_params for round {round_number}")
 
+        # Global model this round starts from; updates are encoded against it
+        global_weights, base_round = None, None
+
         # First round initialization
         if round_number == 1 and not aggregator_model_params_db_link:
             weights = self.data_handlers[index].get_weights()
         else:
             try:
-                # Extract the key from the URL
-                filename = aggregator_model_params_db_link.split('/')[-1]
-                if self.docker_running:
-                    # response = read_file(rest_ip_port, aggregator_model_params_db_link,
-                    #                      f'{self.docker_file_write_destination}/{index}/{filename}', ip_ports)
-                    response = copy_file_from_container(os.path.join(self.tmp_dir, index), self.docker_container_name, rest_ip_port,aggregator_model_params_db_link, f'{self.file_write_destination}/{index}/{filename}', ip_ports)
-                else:
-                    response = read_file(rest_ip_port, aggregator_model_params_db_link, f'{self.file_write_destination}/{index}/{filename}', ip_ports)
-
-                if response.status_code == 200:
-                    sleep(1)
-                    with open(
-                            f'{self.file_write_destination}/{index}/{filename}',
-                            'rb') as f:
-                        data = pickle.load(f)
-
-                # Ensure the data is valid and decode the parameters
-                if data and 'newUpdates' in data:
-                    weights = self.decode_params(data['newUpdates'])
-                else:
-                    self.logger.error(f"[{index}] Invalid data or 'newUpdates' missing in Firestore response: {data}")
-                    raise ValueError(f"[{index}] Invalid data or 'newUpdates' missing in Firestore response: {data}")
+                data = self.fetch_aggregated_model(aggregator_model_params_db_link, ip_ports, rest_ip_port, index,
+                                                   content_length, checksum, round_number)
+                weights = data.get('weights')
+                if data.exist_key('round_number'):
+                    global_weights, base_round = weights, data.get('round_number')
             except Exception as e:
                 self.logger.error(f"[{index}] Error getting weights: {str(e)}")
                 raise
 
-        # Update model with weights
-        self.data_handlers[index].update_model(weights)
-
-        # Train model
-        # model_update = self.local_training_handler.train({})
-        # print(f"[INFO] [{index}][Round {round_number}] ========== Model training progress ==========")
-        model_params = self.data_handlers[index].train(round_number)
+        # Evaluations of the model wait until the round's model is trained, and training until they finished
+        data_handler = self.data_handlers[index]
+        supports_prefetch = getattr(data_handler, 'supports_prefetch', False)
+
+        def train():
+            # Update model with weights
+            data_handler.update_model(weights)
+            # model_update = self.local_training_handler.train({})
+            # print(f"[INFO] [{index}][Round {round_number}] ========== Model training progress ==========")
+            if supports_prefetch:
+                return data_handler.train(round_number, dataset=dataset)
+            return data_handler.train(round_number)
+
+        with self.model_locks.setdefault(index, threading.Lock()):
+            # Train model, loading the next round's data in the background meanwhile
+            dataset = None
+            if supports_prefetch:
+                dataset = self.prefetcher.take(index, round_number)
+                self.prefetcher.prefetch(index, round_number + 1,
+                                         lambda: data_handler.load_dataset(data_handler.node_name, round_number + 1))
+            model_params = self.compute.submit(index, train).result()
+        self.evaluations.model_changed(index, round_number, lambda: self.evaluate(index))
+        # Data handlers may return a LocalModelUpdate carrying the number of samples they trained on
+        if not isinstance(model_params, LocalModelUpdate):
+            model_params = LocalModelUpdate(weights=model_params)
+        self.num_samples[index] = 0
+        if model_params.exist_key('num_samples'):
+            self.num_samples[index] = int(model_params.get('num_samples') or 0)
         self.logger.info(f"[{index}][Round {round_number}] Step 2 Complete: Model training done")
 
-        # Save and return new weights
-        encoded_params = self.encode_model(model_params)
-        file = f"{round_number}-replica-{self.replica_name}.pkl"
-        # make sure directory exists
-        os.makedirs(os.path.dirname(f"{self.file_write_destination}/{index}/"), exist_ok=True)
-        file_name = f"{self.file_write_destination}/{index}/{file}"
-        with open(f"{file_name}", "wb") as f:
-            f.write(encoded_params)
+        # Send the change against the global model instead of the full weights if the index is configured to
+        encoded_weights, encoding_metadata = self.get_update_encoder(index).encode(
+            model_params.get('weights'), global_weights, base_round
+        )
+        model_params = LocalModelUpdate(weights=encoded_weights, num_samples=self.num_samples[index], **encoding_metadata)
+
+        # Save and return new weights, named by their checksum in the index's model store
+        codec, byte_shuffle = self.get_transfer_codec(index)
+        file_name, content_length, checksum = self.model_stores[index].put(
+            model_params, round_number, codec=codec, shuffle=byte_shuffle
+        )
+        self.model_files[index] = (content_length, checksum)
+        file = os.path.basename(file_name)
 
         if self.docker_running:
             self.logger.debug(f'[{index}] written to container at {f"{self.docker_file_write_destination}/{index}/{file}"}')
@@ -266,18 +372,70 @@ class Node:
             return f'{self.docker_file_write_destination}/{index}/{file}'
         return file_name
 
-    def encode_model(self, model_update):
-        # serialized_data = gzip.compress(pickle.dumps(model_update)) # maybe, so that we don't stored super large models as is
-        serialized_data = pickle.dumps(model_update)
+    def fetch_aggregated_model(self, link, ip_port, rest_ip_port, index, content_length=0, checksum='', round_number=0):
+        """
+        Download the aggregated model at `link` and load it, retrying until the file matches the
+        content length and checksum announced in the RoundStart policy.
+
+        :return: The aggregated LocalModelUpdate.
+        :raises Exception: The last error once all attempts failed.
+        """
+        # Extract the key from the URL
+        filename = link.split('/')[-1]
+        store = self.model_stores[index]
+        # Downloads with a known checksum are kept in the model store under it, and not downloaded again
+        local_path = store.path_of(checksum) if checksum else f'{self.file_write_destination}/{index}/{filename}'
+        for attempt in range(self.fetch_retries + 1):
+            try:
+                if not (checksum and store.lookup(checksum)):
+                    if self.docker_running:
+                        # response = read_file(rest_ip_port, link,
+                        #                      f'{self.docker_file_write_destination}/{index}/{filename}', ip_ports)
+                        response = copy_file_from_container(os.path.join(self.tmp_dir, index), self.docker_container_name, rest_ip_port, link, local_path, ip_port)
+                    else:
+                        response = read_file(rest_ip_port, link, local_path, ip_port)
+                    if response is None or response.status_code != 200:
+                        raise ValueError(f"Failed to retrieve aggregated model: {filename}. "
+                                         f"HTTP Status: {getattr(response, 'status_code', None)}")
+
+                check_weights_file(local_path, content_length, checksum)
+                data = LocalModelUpdate.load(local_path)
+
+                # Ensure the data is valid and extract the weights
+                if not data.exist_key('weights'):
+                    raise ValueError(f"[{index}] Invalid data or 'weights' missing in aggregated model file: {filename}")
+                if checksum:
+                    store.add(checksum, round_number)
+                return data
+            except Exception as e:
+                if attempt == self.fetch_retries:
+                    raise
+                self.logger.warning(f"[{index}] Attempt {attempt + 1} to fetch {filename} failed, retrying: {str(e)}")
+                time.sleep(backoff_delay(attempt))
+
+    def encode_model(self, model_update, index=None):
+        codec, byte_shuffle = self.codecs.get(index, ('none', False))
+        serialized_data = model_update.serialize(codec=codec, shuffle=byte_shuffle)
         return serialized_data
 
     def decode_params(self, encoded_model_update):
-        # model_weights = pickle.loads(gzip.decompress(encoded_model_update))
-        model_weights = pickle.loads(encoded_model_update)
-        return model_weights
+        # The codec is recorded in the encoded header
+        model_update = LocalModelUpdate.deserialize(encoded_model_update)
+        return model_update
 
+    # Latest evaluation of the index's model (see EvaluationCache), re-evaluated in the background once out of date
     def inference(self, index):
-        return self.data_handlers[index].run_inference()
+        return self.evaluations.get(index, lambda: self.evaluate(index))
 
+    def evaluate(self, index):
+        # The lock is taken before submitting, so waiting for a round's training doesn't hold a compute slot
+        with self.model_locks.setdefault(index, threading.Lock()):
+            return self.compute.submit(index, self.data_handlers[index].run_inference).result()
+
+    # Predictions for one or more samples, batched with concurrent requests if the data handler can
     def direct_inference(self, index, data):
-        return self.data_handlers[index].direct_inference(data)
\ No newline at end of file
+        return self.submit_direct_inference(index, data).result()
+
+    # Future of the predictions, for callers on an event loop to await
+    def submit_direct_inference(self, index, data):
+        return self.inference_dispatcher.submit(index, self.data_handlers[index], data)
\ No newline at end of file
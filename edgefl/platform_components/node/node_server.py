@@ -10,14 +10,15 @@ from fastapi.responses import PlainTextResponse
 from platform_components.EdgeLake_functions.blockchain_EL_functions import get_local_ip, \
     connect_to_db, get_all_databases
 from platform_components.node.node import Node
+from platform_components.EdgeLake_functions import edgelake_client
 # import numpy as np
+import asyncio
 import logging
 import threading
 import time
 from dotenv import load_dotenv
 import os
 import argparse
-import requests
 import warnings
 
 from uvicorn import run
@@ -29,6 +30,7 @@ from contextlib import asynccontextmanager
 from pydantic import BaseModel
 
 from platform_components.lib.logger.logger_config import configure_logging
+from platform_components.lib.modules.round_events import RoundEvents, push_event, EVENT_KINDS
 
 
 warnings.filterwarnings("ignore")
@@ -47,6 +49,7 @@ logger = logging.getLogger(__name__)
 node_instance = None
 listener_thread = None
 stop_listening_thread = False
+round_events = RoundEvents()
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
@@ -70,6 +73,8 @@ class InitNodeRequest(BaseModel):
     replica_port: str
     replica_index: str
     round_number: int
+    aggregator_url: str | None = None # where to push submodel events; older aggregators don't send it
+    aggregator_name: str | None = None # parent named in our submodels, so only that (possibly regional) aggregator fuses them
 
 
 @app.post('/init-node')
@@ -97,7 +102,12 @@ def init_node(request: InitNodeRequest):
             node_instance.databases[index] = db_name
 
         node_instance.initialize_specific_node_on_index(index, module_name, module_file)
+        node_instance.prefetcher.cancel(index) # data prefetched for a previous run of the index
         node_instance.round_number[index] = most_recent_round # 1 or current round
+        if request.aggregator_url:
+            node_instance.aggregator_urls[index] = request.aggregator_url
+        if request.aggregator_name:
+            node_instance.parents[index] = request.aggregator_name
 
         logger.info(f"{replica_name} successfully initialized for ({index})")
         # print(f"indexes: {node_instance.indexes}")
@@ -138,43 +148,89 @@ def listen_for_start_round(nodeInstance, index, stop_event):
     current_round = nodeInstance.round_number[index]
 
     logger.info(f"[{index}][Round {current_round}] Listening for start round {current_round}")
+    events_seen = 0 # round_start events pushed by the aggregator for current_round
     while True:
         try:
-            headers = {
-                'User-Agent': 'AnyLog/1.23',
-                'command': f'blockchain get {index} where round_number = {current_round} and node_type = aggregator'
-            }
-            response = requests.get(edgelake_node_url, headers=headers)
-
-            if response.status_code == 200:
-                data = response.json()
-                # if no policies, then wait 2 seconds
-                if not data:
-                    time.sleep(2)
-                    continue
-                round_data = data[0].get(index)
-                # for item in data:
-                #     # Check if the key exists in the current dictionary
-                #     if f'{index}-r{current_round}' in item:
-                #         round_data = item.get(index).get("initParams")
-                #         break  # Stop searching once the current round's data is found
-
-                if round_data:
-                    logger.debug(f"[{index}] Round Data: {round_data}")  # Debugging line
-                    paramsLink = round_data.get('initParams', '')
-                    ip_port = round_data.get('ip_port', '')
-                    rest_ip_port = round_data.get('rest_ip_port', '')
-                    modelUpdate_metadata = nodeInstance.train_model_params(paramsLink, current_round, ip_port, rest_ip_port, index)
-                    nodeInstance.add_node_params(current_round, modelUpdate_metadata, index)
-                    logger.info(f"[{index}][Round {current_round}] Step 3 Complete: Model parameters published")
-                    current_round += 1
-                    logger.info(f"[{index}][Round {current_round}] Listening for start round {current_round}")
-
-            time.sleep(5)  # Poll every 2 seconds
+            # RoundStart policy of the round, queried until it has been seen once
+            round_data = nodeInstance.policy_cache.get_round_start(index, current_round)
+            # if no policy, then wait until the aggregator announces the round, or 2 seconds
+            if not round_data:
+                events_seen = round_events.wait(index, 'round_start', current_round, events_seen, 2)
+                continue
+
+            if nodeInstance.get_round_mode(index) == 'async':
+                # Train on the newest model rather than catching up on rounds that went by while training
+                latest = nodeInstance.policy_cache.get_latest_round_start(index)
+                if latest and int(latest['round_number']) > current_round:
+                    logger.info(f"[{index}] Skipping to round {latest['round_number']} from round {current_round}")
+                    round_data, current_round = latest, int(latest['round_number'])
+
+            logger.debug(f"[{index}] Round Data: {round_data}")  # Debugging line
+            paramsLink = round_data.get('initParams', '')
+            ip_port = round_data.get('ip_port', '')
+            rest_ip_port = round_data.get('rest_ip_port', '')
+            content_length = int(round_data.get('content_length', 0) or 0)
+            checksum = round_data.get('checksum', '')
+            modelUpdate_metadata = nodeInstance.train_model_params(paramsLink, current_round, ip_port, rest_ip_port, index,
+                                                                   content_length, checksum)
+            result = nodeInstance.add_node_params(current_round, modelUpdate_metadata, index)
+            if result['status'] != 'success':
+                # The aggregator closes the round without us; move on to the next one
+                logger.error(f"[{index}][Round {current_round}] Submodel not published, skipping the round: {result['message']}")
+            else:
+                if index in nodeInstance.aggregator_urls:
+                    push_event([nodeInstance.aggregator_urls[index]], index, 'submodel', current_round, nodeInstance.replica_name)
+                logger.info(f"[{index}][Round {current_round}] Step 3 Complete: Model parameters published")
+            current_round += 1
+            events_seen = 0
+            logger.info(f"[{index}][Round {current_round}] Listening for start round {current_round}")
+
+            # Poll every 5 seconds unless the aggregator announces the round first
+            events_seen = round_events.wait(index, 'round_start', current_round, events_seen, 5)
         except Exception as e:
             logger.error(f"[{index}] Error in listener thread: {str(e)}")
             time.sleep(2)
 
+class NotifyRequest(BaseModel):
+    index: str
+    kind: str
+    round_number: int
+    sender: str | None = None
+
+
+@app.post('/notify')
+def notify(request: NotifyRequest):
+    """Wake the listener waiting for a policy; sent by the aggregator after inserting a RoundStart policy."""
+    try:
+        round_events.notify(request.index, request.kind, request.round_number)
+    except ValueError as e:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=str(e)
+        )
+    return {
+        'status': 'success',
+        'message': f'{request.kind} event for round {request.round_number} received'
+    }
+
+
+@app.get('/events/{index}')
+async def wait_for_event(index, kind: str, round_number: int, seen: int = 0, timeout: float = 25):
+    """Long-poll: return once more than `seen` events of `kind` arrived for the round, or after `timeout` seconds."""
+    if kind not in EVENT_KINDS:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"Unknown event kind '{kind}'. Supported kinds: {', '.join(EVENT_KINDS)}"
+        )
+    # Suspends on the event loop instead of holding one of the threads sync endpoints run on
+    count = await round_events.async_wait(index, kind, round_number, seen, min(max(timeout, 0), 60))
+    return {
+        'index': index,
+        'kind': kind,
+        'round_number': round_number,
+        'count': count
+    }
+
 # TODO: move to a (helper) file (i.e. 'node_helpers.py'?)
 # Extracts initParams from the policy 'index-r' at the specified index
 def get_most_recent_agg_params(index):
@@ -186,7 +242,7 @@ def get_most_recent_agg_params(index):
             'User-Agent': 'AnyLog/1.23',
             'command': f'blockchain get {index}'
         }
-        response = requests.get(edgelake_node_url, headers=headers)
+        response = edgelake_client.get(edgelake_node_url, headers=headers)
 
         if response.status_code == 200:
             data = response.json()
@@ -211,12 +267,16 @@ def inference(index):
                 status_code=status.HTTP_400_BAD_REQUEST,
                 detail="Index must be specified."
             )
-        results = node_instance.inference(index)
+        # Cached per model round; 'stale' means a newer model or test set is being evaluated meanwhile
+        evaluation = node_instance.inference(index)
         response = {
                     'index': f'{index}',
                     'status': 'success',
                     'message': 'Inference completed successfully',
-                    'model_accuracy': f'{str(results)}'
+                    'model_accuracy': f'{str(evaluation["metrics"])}',
+                    'model_round': evaluation['model_round'],
+                    'evaluated_at': evaluation['evaluated_at'],
+                    'stale': evaluation['stale']
                     }
         return JSONResponse(content=response)
     except Exception as e:
@@ -232,12 +292,13 @@ class InferenceRequest(BaseModel):
 # TODO: add index and reformat response to FastAPI PlainTextResponse
 # @app.route('/infer', methods=['POST'])
 @app.post('/infer')
-def direct_inference(request: InferenceRequest):
+async def direct_inference(request: InferenceRequest):
     """Inference on current model w/ data passed in."""
     try:
         float_list = request.input
         index = request.index
-        results = node_instance.direct_inference(index, float_list)
+        # Awaited, not run inline: the model work runs on the node's compute executor, off the event loop
+        results = await asyncio.wrap_future(node_instance.submit_direct_inference(index, float_list))
         response = {
             'prediction': str(results),
         }
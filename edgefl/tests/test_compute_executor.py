@@ -0,0 +1,12 @@
+import pytest
+
+from platform_components.lib.modules.compute_executor import ComputeExecutor
+
+
+def test_submit_after_shutdown_fails_and_frees_the_slot():
+    executor = ComputeExecutor(workers=1, per_index=1)
+    executor._executor.shutdown()
+
+    with pytest.raises(RuntimeError):
+        executor.submit('index', sum, [1, 2]).result(timeout=3)
+    assert executor._running['index'] == 0
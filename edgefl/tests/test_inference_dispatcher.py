@@ -0,0 +1,34 @@
+import numpy as np
+
+from platform_components.lib.modules.compute_executor import ComputeExecutor
+from platform_components.lib.modules.inference_dispatcher import InferenceDispatcher
+
+
+class SumHandler:
+    # Samples of 2 values, predicted as their sum; NaN input fails the prediction
+    def prepare_samples(self, data):
+        return np.asarray(data, dtype=np.float32).reshape(-1, 2)
+
+    def predict_batch(self, samples):
+        if np.isnan(samples).any():
+            raise ValueError("NaN input")
+        return samples.sum(axis=1)
+
+
+def test_cancelled_request_does_not_block_its_batch():
+    dispatcher = InferenceDispatcher(max_delay_ms=200)
+    cancelled = dispatcher.submit('index', SumHandler(), [1, 2])
+    other = dispatcher.submit('index', SumHandler(), [[3, 4], [5, 6]])
+    assert cancelled.cancel()
+
+    assert other.result(timeout=3) == [7.0, 11.0]
+    assert cancelled.cancelled()
+
+
+def test_failed_batch_only_fails_the_bad_request():
+    dispatcher = InferenceDispatcher(max_delay_ms=200, executor=ComputeExecutor(workers=2))
+    good = dispatcher.submit('index', SumHandler(), [1, 2])
+    bad = dispatcher.submit('index', SumHandler(), [float('nan'), 1])
+
+    assert good.result(timeout=3) == [3.0]
+    assert isinstance(bad.exception(timeout=3), ValueError)